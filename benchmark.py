@@ -0,0 +1,264 @@
+#!/bin/env python3
+# Load, join, UTxO-scan and draw benchmark over synthetic ledgers of growing size.
+#
+# Every size is a number of delegators, the other counts follow mainnet's proportions (see
+# ledgergen.scaled). The ledgers are generated once into the work directory and reused. Each case
+# runs in a fresh process so its peak RSS is its own, and records the phases of phasemetrics.py:
+# ledger_load (with delegation_join, stake_aggregation and utxo_scan inside it), eligibility and
+# draw, for the biggest pool and the most held policy. JSON ledgers are read with every backend of
+# --json-backends (see jsonbackend.py), to pick the fastest one installed on the host.
+#
+# --save writes the results as a baseline, --compare checks a run against one and exits with 1 when
+# a phase got slower (or the peak RSS bigger) than --tolerance allows. With doubling sizes, the
+# growth table shows which phases stop scaling linearly.
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import drawengine
+import giveaway
+import jsonbackend
+import ledgergen
+import ledgerindex
+import phasemetrics
+
+DEFAULT_SIZES = "25000,50000,100000"
+DEFAULT_WORKDIR = "benchmark"
+TOLERANCE = 1.25
+# phases shorter than this in the baseline are too noisy to compare
+NOISE_FLOOR = 0.2
+WINNERS = 100
+BATCH_DRAWS = 100000
+PHASES = ("ledger_load", "delegation_join", "stake_aggregation", "utxo_scan", "eligibility", "draw")
+
+
+def ledger_path(workdir, delegators, ledger_format, seed=1):
+    return os.path.join(workdir, "ledger-" + str(delegators) + "-" + str(seed) + "." + ledger_format)
+
+
+def ensure_ledger(workdir, delegators, ledger_format, seed=1):
+    # Generates the size's ledger unless the work directory already has it, returns (path, manifest).
+    path = ledger_path(workdir, delegators, ledger_format, seed)
+    options = ledgergen.scaled(delegators, seed)
+    try:
+        with open(ledgergen.manifest_path(path)) as manifest_file:
+            manifest = json.load(manifest_file)
+        if os.path.exists(path) and all(manifest.get(name) == value for name, value in options.items()):
+            return path, manifest
+    except (OSError, ValueError):
+        pass
+    os.makedirs(workdir, exist_ok=True)
+    print("Generating " + path + "...")
+    return path, ledgergen.generate(path, ledger_format, **options)
+
+
+def run_case(path, pool_id, policy_id, workers=1, trace_memory=False, json_backend="auto"):
+    # One benchmark case, meant to run in its own process. Returns phasemetrics' dict.
+    metrics = phasemetrics.Metrics(trace_memory)
+    with metrics.phase("ledger_load"):
+        extract = ledgerindex.read_ledger_file(path, [pool_id], [policy_id], workers=workers, metrics=metrics,
+                                               json_backend=json_backend)
+    for raffle in (giveaway.Raffle("pool", pool_id=pool_id, number_winners=WINNERS, unique=True, metrics=metrics),
+                   giveaway.Raffle("policy", policy_id=policy_id, number_winners=WINNERS, unique=True,
+                                   metrics=metrics)):
+        with metrics.phase("eligibility"):
+            giveaway.collect(raffle, extract)
+        with metrics.phase("draw"):
+            draw = drawengine.from_dict(raffle.eligible_participants)
+            for _ in range(min(raffle.number_winners, len(draw))):
+                giveaway.draw_prize(raffle, draw)
+            drawengine.batch_win_counts(raffle.eligible_participants.values(), BATCH_DRAWS, seed=1)
+    return metrics.as_dict()
+
+
+def run_isolated(path, manifest, workers=1, trace_memory=False, json_backend="auto"):
+    # ProcessPoolExecutor's processes aren't daemonic (multiprocessing.Pool's are), so that with
+    # workers > 1 the case can start its own UTxO scan workers
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=context) as executor:
+        return executor.submit(run_case, path, manifest["biggest_pool"], manifest["top_policy"], workers,
+                               trace_memory, json_backend).result()
+
+
+def run(sizes, formats, workdir=DEFAULT_WORKDIR, workers=1, trace_memory=False, json_backends=("auto",)):
+    # Returns the results, cases keyed by "<reader>/<delegators>", the reader being "cbor" or
+    # "json-<backend>".
+    readers = []
+    for ledger_format in formats:
+        if ledger_format == "json":
+            backends = {jsonbackend.get_backend(backend).name for backend in json_backends}
+            readers.extend((ledger_format, backend) for backend in jsonbackend.AUTO_ORDER if backend in backends)
+        else:
+            readers.append((ledger_format, None))
+    cases = {}
+    for ledger_format, json_backend in readers:
+        reader = ledger_format if json_backend is None else ledger_format + "-" + json_backend
+        for delegators in sizes:
+            path, manifest = ensure_ledger(workdir, delegators, ledger_format)
+            print("Running " + reader + " with " + str(delegators) + " delegators...")
+            cases[reader + "/" + str(delegators)] = {
+                "format": ledger_format,
+                "reader": reader,
+                "delegators": delegators,
+                "ledger_bytes": os.path.getsize(path),
+                "manifest": manifest,
+                "metrics": run_isolated(path, manifest, workers, trace_memory, json_backend or "stdlib"),
+            }
+    return {
+        "created": datetime.datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "workers": workers,
+        "trace_memory": trace_memory,
+        "cases": cases,
+    }
+
+
+def _mib(size):
+    return "-" if size is None else str(round(size / (1 << 20), 1))
+
+
+def print_results(results):
+    print("case".ljust(24) + "".join(phase.rjust(19) for phase in PHASES) + "peak RSS MiB".rjust(14))
+    for name, case in results["cases"].items():
+        phases = case["metrics"]["phases"]
+        print(name.ljust(24) + "".join((str(round(phases[phase]["wall_s"], 3)) if phase in phases else "-").rjust(19)
+                                       for phase in PHASES) + _mib(case["metrics"]["peak_rss_bytes"]).rjust(14))
+        if any("tracemalloc_peak_bytes" in phases[phase] for phase in phases):
+            print("  tracemalloc MiB".ljust(24) + "".join(
+                _mib(phases.get(phase, {}).get("tracemalloc_peak_bytes")).rjust(19) for phase in PHASES))
+
+
+def growth(results, tolerance=TOLERANCE):
+    # (reader, smaller size, bigger size, phase, size ratio, time ratio, superlinear) between
+    # consecutive sizes of each reader.
+    rows = []
+    by_reader = {}
+    for case in results["cases"].values():
+        by_reader.setdefault(case["reader"], []).append(case)
+    for reader, cases in by_reader.items():
+        cases.sort(key=lambda case: case["delegators"])
+        for smaller, bigger in zip(cases, cases[1:]):
+            size_ratio = bigger["delegators"] / smaller["delegators"]
+            for phase in PHASES:
+                before = smaller["metrics"]["phases"].get(phase)
+                after = bigger["metrics"]["phases"].get(phase)
+                if before is None or after is None or before["wall_s"] < NOISE_FLOOR:
+                    continue
+                time_ratio = after["wall_s"] / before["wall_s"]
+                rows.append((reader, smaller["delegators"], bigger["delegators"], phase, size_ratio, time_ratio,
+                             time_ratio > size_ratio * tolerance))
+    return rows
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    # Regressions against a baseline: (case, phase or "peak_rss", baseline value, new value).
+    for setting in ("workers", "trace_memory"):
+        if results.get(setting) != baseline.get(setting):
+            raise ValueError("The baseline was run with " + setting + "=" + str(baseline.get(setting)) + ", not "
+                             + str(results.get(setting)) + ", their times can't be compared")
+    regressions = []
+    for name, case in results["cases"].items():
+        base_case = baseline["cases"].get(name)
+        if base_case is None:
+            continue
+        base_phases = base_case["metrics"]["phases"]
+        for phase, record in case["metrics"]["phases"].items():
+            base_record = base_phases.get(phase)
+            if base_record is None or base_record["wall_s"] < NOISE_FLOOR:
+                continue
+            if record["wall_s"] > base_record["wall_s"] * tolerance:
+                regressions.append((name, phase, base_record["wall_s"], record["wall_s"]))
+        base_rss = base_case["metrics"]["peak_rss_bytes"]
+        rss = case["metrics"]["peak_rss_bytes"]
+        if base_rss and rss and rss > base_rss * tolerance:
+            regressions.append((name, "peak_rss", base_rss, rss))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time and memory-profile the ledger load, join, UTxO scan and draw phases over synthetic "
+                    + "ledgers of several sizes.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="numbers of delegators to benchmark, comma separated, the other counts scale with them "
+                             + "(default: " + DEFAULT_SIZES + ")")
+    parser.add_argument("--formats", default="json",
+                        help="ledger formats to benchmark, comma separated: json, cbor (default: json)")
+    parser.add_argument("--json-backends", dest="json_backends", default="auto",
+                        help="JSON decoders to benchmark JSON ledgers with, comma separated: "
+                             + ", ".join(jsonbackend.BACKENDS) + " (default: auto, the fastest installed)")
+    parser.add_argument('-d', "--workdir", dest="workdir", default=DEFAULT_WORKDIR,
+                        help="the directory keeping the generated ledgers between runs (default: "
+                             + DEFAULT_WORKDIR + ")")
+    parser.add_argument('-j', "--workers", dest="workers", type=int, default=1,
+                        help="worker processes for the UTxO scan, as with randomdelegatorpicker.py (default: 1)")
+    parser.add_argument("--trace-memory", dest="trace_memory", action="store_true",
+                        help="if used, also records tracemalloc peaks per phase (slows the run down considerably)")
+    parser.add_argument("--save", help="if specified will write the results to this baseline file")
+    parser.add_argument("--compare",
+                        help="if specified will compare the results with this baseline file and exit with 1 on "
+                             + "regressions")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="slowdown (or memory growth) factor counted as a regression (default: "
+                             + str(TOLERANCE) + ")")
+    args = parser.parse_args()
+
+    try:
+        benchmark_sizes = sorted({int(size) for size in args.sizes.split(",") if size.strip()})
+        benchmark_formats = [name.strip() for name in args.formats.split(",") if name.strip()]
+        for benchmark_format in benchmark_formats:
+            if benchmark_format not in ("json", "cbor"):
+                raise ValueError("Unknown ledger format " + benchmark_format + ", expected json or cbor")
+        benchmark_backends = [name.strip() for name in args.json_backends.split(",") if name.strip()]
+        for benchmark_backend in benchmark_backends:
+            jsonbackend.get_backend(benchmark_backend)
+        baseline_results = None
+        if args.compare is not None:
+            with open(args.compare) as baseline_file:
+                baseline_results = json.load(baseline_file)
+    except (ValueError, OSError) as error:
+        print(error)
+        exit()
+
+    benchmark_results = run(benchmark_sizes, benchmark_formats, args.workdir, args.workers, args.trace_memory,
+                            benchmark_backends)
+    print_results(benchmark_results)
+
+    growth_rows = growth(benchmark_results, args.tolerance)
+    if growth_rows:
+        print("Growth between sizes (time ratio for the size ratio):")
+        for row_reader, smaller_size, bigger_size, row_phase, size_factor, time_factor, superlinear in growth_rows:
+            print("  " + row_reader + " " + str(smaller_size) + " -> " + str(bigger_size) + " " + row_phase + ": x"
+                  + str(round(time_factor, 2)) + " for x" + str(round(size_factor, 2))
+                  + ("  <- grows faster than the ledger" if superlinear else ""))
+
+    if args.save is not None:
+        with open(args.save, "w") as out:
+            json.dump(benchmark_results, out, indent=2)
+            out.write("\n")
+        print("Baseline written to " + args.save)
+
+    if baseline_results is not None:
+        try:
+            found = compare(benchmark_results, baseline_results, args.tolerance)
+        except ValueError as error:
+            print(error)
+            exit(1)
+        if not found:
+            print("No regressions against " + args.compare)
+        else:
+            print("Regressions against " + args.compare + ":")
+            for case_name, what, before_value, after_value in found:
+                if what == "peak_rss":
+                    print("  " + case_name + " peak RSS: " + _mib(before_value) + " -> " + _mib(after_value) + " MiB")
+                else:
+                    print("  " + case_name + " " + what + ": " + str(round(before_value, 3)) + "s -> "
+                          + str(round(after_value, 3)) + "s")
+            exit(1)
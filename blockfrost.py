@@ -0,0 +1,149 @@
+#!/bin/env python3
+# Asynchronous Blockfrost client.
+#
+# One pooled aiohttp session is shared by all requests. Concurrency is bounded by a semaphore, the
+# request rate by a token bucket matching Blockfrost's limits, and 429/5xx responses (as well as
+# connection errors) are retried with exponential backoff. Paginated endpoints fetch several pages
+# at once. base_url can point at a local mock server for testing.
+import asyncio
+import random
+import time
+
+BLOCKFROST_URL = "https://cardano-mainnet.blockfrost.io"
+DEFAULT_PROJECT_ID = "3teoBXL8asW1eHbwNSwM8InJtJmNyFfJ"
+# Blockfrost allows 10 requests per second per project, with bursts of up to 500 requests
+RATE_LIMIT = 10
+BURST_LIMIT = 500
+PAGE_SIZE = 100
+
+
+class BlockfrostError(Exception):
+    def __init__(self, status, path, body=""):
+        super().__init__("Blockfrost returned " + str(status) + " for " + path + ": " + body)
+        self.status = status
+        self.path = path
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = self.clock()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BlockfrostClient:
+    def __init__(self, project_id=DEFAULT_PROJECT_ID, base_url=BLOCKFROST_URL, concurrency=10, rate=RATE_LIMIT,
+                 burst=BURST_LIMIT, max_retries=8, backoff=0.5, max_backoff=30, page_concurrency=4):
+        self.project_id = project_id
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.page_concurrency = page_concurrency
+        self.bucket = TokenBucket(rate, burst)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.session = None
+        self.requests = 0
+        self.retries = 0
+
+    async def __aenter__(self):
+        import aiohttp
+        self._aiohttp = aiohttp
+        self.session = aiohttp.ClientSession(
+            headers={"project_id": self.project_id},
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=60),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    def _retry_delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * (0.5 + random.random() / 2)
+
+    async def get(self, path, params=None):
+        # Returns the decoded JSON body, or None for a 404.
+        url = self.base_url + path
+        attempt = 0
+        while True:
+            retry_after = None
+            async with self.semaphore:
+                await self.bucket.acquire()
+                self.requests += 1
+                try:
+                    async with self.session.get(url, params=params) as response:
+                        if response.status == 200:
+                            return await response.json()
+                        if response.status == 404:
+                            return None
+                        if response.status != 429 and response.status < 500:
+                            raise BlockfrostError(response.status, path, await response.text())
+                        retry_after = response.headers.get("Retry-After")
+                        failure = BlockfrostError(response.status, path)
+                except (self._aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    failure = error
+            if attempt >= self.max_retries:
+                raise failure
+            self.retries += 1
+            await asyncio.sleep(self._retry_delay(attempt, retry_after))
+            attempt += 1
+
+    async def fetch_page(self, path, page, params=None):
+        page_params = dict(params or {})
+        page_params.update({"page": page, "count": PAGE_SIZE})
+        return await self.get(path, page_params) or []
+
+    async def fetch_list(self, path, params=None):
+        # Fetches every page of a paginated endpoint. Most lists fit in the first page, only when it
+        # is full are the following pages requested, page_concurrency at a time.
+        items = await self.fetch_page(path, 1, params)
+        if len(items) < PAGE_SIZE:
+            return items
+        first_page = 2
+        while True:
+            pages = await asyncio.gather(*(self.fetch_page(path, page, params)
+                                           for page in range(first_page, first_page + self.page_concurrency)))
+            for page in pages:
+                items.extend(page)
+                if len(page) < PAGE_SIZE:
+                    return items
+            first_page += self.page_concurrency
+
+    async def fetch_lists(self, paths, params=None):
+        return await asyncio.gather(*(self.fetch_list(path, params) for path in paths))
+
+    async def fetch_list_until(self, path, stop, params=None):
+        # Fetches pages one at a time until stop(item) is true for an item of the page, returns the
+        # items before that one. Meant for lists ordered newest first, to stop at already known data.
+        items = []
+        page = 1
+        while True:
+            page_items = await self.fetch_page(path, page, params)
+            for item in page_items:
+                if stop(item):
+                    return items
+                items.append(item)
+            if len(page_items) < PAGE_SIZE:
+                return items
+            page += 1
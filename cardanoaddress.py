@@ -0,0 +1,155 @@
+#!/bin/env python3
+# In-process Cardano address codec, replaces shelling out to IOHK's bech32 binary.
+#
+# Shelley addresses are bech32 encoded with a prefix chosen from the address header (CIP-19),
+# Byron addresses keep their base58 form.
+
+MAINNET = 1
+TESTNET = 0
+
+_CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+_CHARSET_REV = {char: value for value, char in enumerate(_CHARSET)}
+_GENERATOR = (0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3)
+_BASE58 = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+BYRON_TYPE = 8
+STAKE_KEY_TYPE = 14
+STAKE_SCRIPT_TYPE = 15
+
+
+def _polymod(values):
+    chk = 1
+    for value in values:
+        top = chk >> 25
+        chk = (chk & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            if (top >> i) & 1:
+                chk ^= _GENERATOR[i]
+    return chk
+
+
+def _hrp_expand(hrp):
+    return [ord(char) >> 5 for char in hrp] + [0] + [ord(char) & 31 for char in hrp]
+
+
+def _convert_bits(data, from_bits, to_bits, pad):
+    acc = 0
+    bits = 0
+    out = []
+    max_value = (1 << to_bits) - 1
+    for value in data:
+        acc = (acc << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            out.append((acc >> bits) & max_value)
+    if pad:
+        if bits:
+            out.append((acc << (to_bits - bits)) & max_value)
+    elif bits >= from_bits or (acc << (to_bits - bits)) & max_value:
+        raise ValueError("Invalid padding in bech32 data")
+    return out
+
+
+def bech32_encode(hrp, payload):
+    data = _convert_bits(payload, 8, 5, True)
+    checksum = _polymod(_hrp_expand(hrp) + data + [0] * 6) ^ 1
+    data += [(checksum >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + "1" + "".join(_CHARSET[value] for value in data)
+
+
+def bech32_decode(text):
+    # Returns (hrp, payload bytes). Cardano addresses are longer than BIP-173's 90 character limit,
+    # so no length limit is enforced.
+    text = text.lower()
+    separator = text.rfind("1")
+    if separator < 1 or separator + 7 > len(text):
+        raise ValueError("Not a bech32 string: " + text)
+    hrp = text[:separator]
+    try:
+        data = [_CHARSET_REV[char] for char in text[separator + 1:]]
+    except KeyError:
+        raise ValueError("Invalid bech32 character in " + text)
+    if _polymod(_hrp_expand(hrp) + data) != 1:
+        raise ValueError("Invalid bech32 checksum in " + text)
+    return hrp, bytes(_convert_bits(data[:-6], 5, 8, False))
+
+
+def base58_encode(payload):
+    number = int.from_bytes(payload, "big")
+    out = []
+    while number:
+        number, rem = divmod(number, 58)
+        out.append(_BASE58[rem])
+    leading_zeroes = len(payload) - len(payload.lstrip(b"\0"))
+    return "1" * leading_zeroes + "".join(reversed(out))
+
+
+def address_prefix(header):
+    address_type = header >> 4
+    network = header & 0x0f
+    if address_type in (STAKE_KEY_TYPE, STAKE_SCRIPT_TYPE):
+        return "stake" if network == MAINNET else "stake_test"
+    return "addr" if network == MAINNET else "addr_test"
+
+
+def encode_address(raw):
+    if not raw:
+        raise ValueError("Empty address")
+    if raw[0] >> 4 == BYRON_TYPE:
+        return base58_encode(raw)
+    return bech32_encode(address_prefix(raw[0]), raw)
+
+
+def stake_address_bytes(key_hash_hex, network=MAINNET):
+    return bytes([STAKE_KEY_TYPE << 4 | network]) + bytes.fromhex(key_hash_hex)
+
+
+def stake_address_hex(hex_address):
+    # The reward address (header and stake credential) of a base address as hex, None for addresses
+    # without a stake credential of their own (enterprise, pointer, Byron). Slices the hex string,
+    # nothing is decoded.
+    if len(hex_address) < 114 or hex_address[0] not in "0123":
+        return None
+    # base address types 2 and 3 have a script stake credential
+    header = "f" if hex_address[0] in "23" else "e"
+    return header + hex_address[1] + hex_address[58:114]
+
+
+def group_by_stake(holdings):
+    # Sums {hex address: amount} per stake credential, keyed by the hex reward address. Addresses
+    # without a stake credential keep their own entry.
+    grouped = {}
+    for hex_address, amount in holdings.items():
+        key = stake_address_hex(hex_address) or hex_address
+        grouped[key] = grouped.get(key, 0) + amount
+    return grouped
+
+
+def encode_addresses(hex_addresses, cache=None):
+    # Encodes a list of hex addresses in one call. Pass a dict as cache to remember addresses
+    # across calls, e.g. when the same address wins several prizes.
+    encoded = []
+    for hex_address in hex_addresses:
+        if cache is not None and hex_address in cache:
+            encoded.append(cache[hex_address])
+            continue
+        address = encode_address(bytes.fromhex(hex_address))
+        if cache is not None:
+            cache[hex_address] = address
+        encoded.append(address)
+    return encoded
+
+
+def encode_stake_addresses(key_hashes, network=MAINNET, cache=None):
+    # Same as encode_addresses, for the stake key hashes found in the ledger's delegations.
+    encoded = []
+    for key_hash in key_hashes:
+        if cache is not None and key_hash in cache:
+            encoded.append(cache[key_hash])
+            continue
+        address = encode_address(stake_address_bytes(key_hash, network))
+        if cache is not None:
+            cache[key_hash] = address
+        encoded.append(address)
+    return encoded
@@ -0,0 +1,121 @@
+#!/bin/env python3
+# Weighted draw over exact integer tickets.
+#
+# Tickets are kept in a Fenwick (binary indexed) tree, so drawing a winner and taking a winner out of
+# the draw (--unique) both cost O(log n) instead of a scan over every participant.
+import bisect
+import itertools
+import random
+
+# winners drawn per vectorized call in batch mode, bounds the memory used by the draw
+BATCH_CHUNK = 1 << 22
+
+
+class TicketDraw:
+    def __init__(self, participants, tickets, rng=random):
+        # participants and tickets are parallel sequences, tickets must be non-negative integers
+        self.participants = list(participants)
+        self.rng = rng
+        size = len(self.participants)
+        self._tickets = [int(t) for t in tickets]
+        if len(self._tickets) != size:
+            raise ValueError("Every participant needs a number of tickets")
+        if any(t < 0 for t in self._tickets):
+            raise ValueError("Tickets can't be negative")
+        tree = [0] + self._tickets
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._top_bit = 1 << (size.bit_length() - 1) if size else 0
+        self.total = sum(self._tickets)
+
+    def __len__(self):
+        return len(self.participants)
+
+    def tickets(self, index):
+        return self._tickets[index]
+
+    def ticket_holder(self, winning_num):
+        # Index of the participant holding ticket number winning_num (1 <= winning_num <= total).
+        if not 1 <= winning_num <= self.total:
+            raise ValueError("Winning number " + str(winning_num) + " is outside 1.." + str(self.total))
+        tree = self._tree
+        size = len(self.participants)
+        pos = 0
+        remaining = winning_num
+        step = self._top_bit
+        while step:
+            nxt = pos + step
+            if nxt <= size and tree[nxt] < remaining:
+                pos = nxt
+                remaining -= tree[nxt]
+            step >>= 1
+        return pos
+
+    def draw(self):
+        # Returns (winning number, winner index).
+        if self.total <= 0:
+            raise ValueError("No tickets left to draw from")
+        winning_num = self.rng.randint(1, self.total)
+        return winning_num, self.ticket_holder(winning_num)
+
+    def remove(self, index):
+        # Takes all of a participant's tickets out of the draw.
+        tickets = self._tickets[index]
+        if tickets == 0:
+            return
+        self._tickets[index] = 0
+        self._update(index, -tickets)
+
+    def restore(self, index, tickets):
+        # Puts a removed participant's tickets back, lets one draw be reused for many simulated raffles.
+        if self._tickets[index] != 0:
+            raise ValueError("Participant " + str(index) + " is still in the draw")
+        self._tickets[index] = tickets
+        self._update(index, tickets)
+
+    def _update(self, index, delta):
+        self.total += delta
+        tree = self._tree
+        size = len(self.participants)
+        i = index + 1
+        while i <= size:
+            tree[i] += delta
+            i += i & -i
+
+
+def from_dict(eligible_participants, rng=random):
+    return TicketDraw(eligible_participants.keys(), eligible_participants.values(), rng)
+
+
+def batch_win_counts(tickets, number_draws, seed=None):
+    # Draws number_draws non-unique winners at once and returns how many times each participant
+    # won. Uses one vectorized NumPy draw over the cumulative tickets when NumPy is installed,
+    # otherwise a bisect over the same cumulative array.
+    tickets = [int(t) for t in tickets]
+    total = sum(tickets)
+    if total <= 0:
+        raise ValueError("No tickets to draw from")
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if numpy is not None and total < 2 ** 63:
+        cumulative = numpy.cumsum(numpy.asarray(tickets, dtype=numpy.int64))
+        generator = numpy.random.default_rng(seed)
+        counts = numpy.zeros(len(tickets), dtype=numpy.int64)
+        for start in range(0, number_draws, BATCH_CHUNK):
+            size = min(BATCH_CHUNK, number_draws - start)
+            winning_nums = generator.integers(1, total, size=size, endpoint=True)
+            counts += numpy.bincount(numpy.searchsorted(cumulative, winning_nums, side="left"),
+                                     minlength=len(tickets))
+        return counts.tolist()
+    rng = random.Random(seed)
+    cumulative = list(itertools.accumulate(tickets))
+    counts = [0] * len(tickets)
+    randint = rng.randint
+    for _ in range(number_draws):
+        counts[bisect.bisect_left(cumulative, randint(1, total))] += 1
+    return counts
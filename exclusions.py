@@ -0,0 +1,117 @@
+#!/bin/env python3
+# Exclusion lists for the raffles.
+#
+# Entries can be given on the command line or in files (one per line, '#' starts a comment) as hex
+# key/script hashes, hex addresses or bech32 addr.../stake... addresses. They are normalized into
+# hashed sets of credentials and addresses, so every lookup is O(1). Excluding a Shelley address
+# also excludes its payment and stake credentials, i.e. the wallet behind it. Anything else is
+# rejected with a ValueError naming the entry (and its line, for lists and files).
+import cardanoaddress
+
+HASH_HEX_SIZE = 56
+# hex sizes of the fixed size addresses by header type: base, enterprise and stake addresses
+_ADDRESS_HEX_SIZES = {0: 114, 1: 114, 2: 114, 3: 114, 6: 58, 7: 58,
+                      cardanoaddress.STAKE_KEY_TYPE: 58, cardanoaddress.STAKE_SCRIPT_TYPE: 58}
+# pointer addresses end with three variable length integers, of at least a byte each
+_POINTER_MIN_HEX_SIZE = 64
+
+
+def address_credentials(hex_address):
+    # (payment credential, stake credential) hashes of a hex address, None where there is none.
+    # Works on the hex string directly, without decoding the address.
+    address_type = int(hex_address[0], 16)
+    if address_type <= 3:
+        return hex_address[2:58], hex_address[58:114]
+    if address_type <= 7:
+        return hex_address[2:58], None
+    if address_type in (cardanoaddress.STAKE_KEY_TYPE, cardanoaddress.STAKE_SCRIPT_TYPE):
+        return None, hex_address[2:58]
+    return None, None
+
+
+def check_address(hex_address):
+    # Raises ValueError unless the header type and size are those of a Cardano address.
+    address_type = int(hex_address[0], 16) if hex_address else None
+    if address_type in _ADDRESS_HEX_SIZES:
+        valid = len(hex_address) == _ADDRESS_HEX_SIZES[address_type]
+    elif address_type in (4, 5):
+        valid = len(hex_address) >= _POINTER_MIN_HEX_SIZE
+    else:
+        valid = address_type == cardanoaddress.BYRON_TYPE and hex_address.startswith("82")
+    if not valid:
+        raise ValueError("Not a key/script hash or an address: " + hex_address)
+
+
+class ExclusionSet:
+    def __init__(self, entries=()):
+        self.credentials = set()
+        self.addresses = set()
+        # the credentials and addresses given, without the credentials derived from the addresses
+        self.entries = set()
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entry):
+        entry = entry.strip().lower()
+        if not entry:
+            return
+        if entry.startswith(("addr", "stake")):
+            self.add_address(cardanoaddress.bech32_decode(entry)[1].hex())
+            return
+        try:
+            bytes.fromhex(entry)
+        except ValueError:
+            raise ValueError("Not a key/script hash or an address: " + entry)
+        if len(entry) == HASH_HEX_SIZE:
+            self.credentials.add(entry)
+            self.entries.add(entry)
+        else:
+            self.add_address(entry)
+
+    def add_address(self, hex_address):
+        check_address(hex_address)
+        self.addresses.add(hex_address)
+        self.entries.add(hex_address)
+        for credential in address_credentials(hex_address):
+            if credential:
+                self.credentials.add(credential)
+
+    def add_list(self, text, source="exclusion list"):
+        # comma and/or newline separated entries, '#' starts a comment
+        for line_number, line in enumerate(text.splitlines(), 1):
+            for entry in line.split("#", 1)[0].split(","):
+                try:
+                    self.add(entry)
+                except ValueError as error:
+                    raise ValueError(source + ", line " + str(line_number) + ": " + str(error))
+
+    def add_file(self, path):
+        with open(path) as exclude_file:
+            self.add_list(exclude_file.read(), path)
+
+    def excludes_credential(self, credential):
+        return credential in self.credentials
+
+    def excludes_address(self, hex_address):
+        if hex_address in self.addresses:
+            return True
+        payment, stake = address_credentials(hex_address)
+        return payment in self.credentials or stake in self.credentials
+
+    def excludes_stake_address(self, stake_address):
+        # bech32 stake1... address, as returned by Blockfrost
+        if not self:
+            return False
+        return self.excludes_address(cardanoaddress.bech32_decode(stake_address)[1].hex())
+
+
+def load_exclusions(exclude_list=None, exclude_files=()):
+    exclusions = ExclusionSet()
+    if exclude_list:
+        exclusions.add_list(exclude_list)
+    for path in exclude_files or ():
+        exclusions.add_file(path)
+    return exclusions
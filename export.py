@@ -0,0 +1,97 @@
+#!/bin/env python3
+# Streaming CSV/JSONL writers for the raffles' participants and results.
+#
+# The format follows the file name: .jsonl/.ndjson write one JSON object per line, anything else CSV,
+# and a trailing .gz or .zst compresses the stream (zstd needs Python 3.14 or the zstandard package).
+# Rows are written as they are produced, nothing is buffered beyond the file object's own buffer.
+import csv
+import gzip
+import io
+import json
+import os
+
+JSONL_EXTENSIONS = (".jsonl", ".ndjson")
+
+
+def _split_compression(path):
+    root, extension = os.path.splitext(path)
+    if extension in (".gz", ".zst"):
+        return root, extension
+    return path, ""
+
+
+def _zstd_module():
+    try:
+        from compression import zstd
+        return zstd
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+def check_path(path):
+    # Raises ValueError for a file that can't be written in this environment, meant to be called
+    # before any lengthy work rather than failing at the end of it.
+    if _split_compression(path)[1] == ".zst" and _zstd_module() is None:
+        raise ValueError("Writing " + path + " needs Python 3.14 or the zstandard package (pip3 install zstandard)")
+
+
+def _open_zstd(path):
+    check_path(path)
+    zstd = _zstd_module()
+    if zstd.__name__ == "compression.zstd":
+        return zstd.open(path, "wt", encoding="utf-8", newline="")
+    raw = open(path, "wb")
+    return io.TextIOWrapper(zstd.ZstdCompressor().stream_writer(raw), encoding="utf-8", newline="")
+
+
+def open_text(path):
+    compression = _split_compression(path)[1]
+    if compression == ".gz":
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    if compression == ".zst":
+        return _open_zstd(path)
+    return open(path, "w", newline="")
+
+
+def suffixed(path, suffix):
+    # winners.csv.gz, "-pool" -> winners-pool.csv.gz
+    root, compression = _split_compression(path)
+    root, extension = os.path.splitext(root)
+    return root + suffix + extension + compression
+
+
+class RowWriter:
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = list(fields)
+        self.jsonl = _split_compression(path)[0].endswith(JSONL_EXTENSIONS)
+        self.rows = 0
+        self._out = open_text(path)
+        if not self.jsonl:
+            self._csv = csv.writer(self._out)
+            self._csv.writerow(self.fields)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, row):
+        if self.jsonl:
+            self._out.write(json.dumps(dict(zip(self.fields, row))) + "\n")
+        else:
+            self._csv.writerow(row)
+        self.rows += 1
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def close(self):
+        self._out.close()
@@ -0,0 +1,240 @@
+#!/bin/env python3
+# Monte Carlo check that the odds the picker prints are the odds the draw engine actually gives.
+#
+# The same eligible set is drawn from a great many times and the number of prizes each participant
+# wins is compared with what its tickets promise, using Pearson's chi-square test. Draws are
+# simulated in vectorized batches with NumPy when it is installed, otherwise with the draw engine
+# itself (same results, slower). --unique raffles are simulated prize by prize with every winner
+# leaving the draw, and the expected wins add up each prize's odds given the winners before it.
+#
+# The simulation maps winning numbers to winners with a binary search over the cumulative tickets,
+# so the engine's own Fenwick tree lookup is checked separately, exactly, for every participant.
+# The report also shows how far the printed numbers are from the exact ones: chances are rounded
+# to 0.01%, ticket counts to whole ADA/tokens and --sqrt tickets are truncated square roots.
+import math
+import random
+
+import drawengine
+import giveaway
+
+# simulated --unique raffles held in memory at once
+UNIQUE_CHUNK = 1 << 16
+# participants expected to win fewer prizes than this are pooled into one chi-square bin
+MIN_EXPECTED = 5
+# p-values below this fail the check
+SIGNIFICANCE = 0.001
+
+
+def _gamma_q(a, x):
+    # Regularized upper incomplete gamma function, Q(dof / 2, statistic / 2) is the chi-square p-value.
+    if x <= 0:
+        return 1.0
+    log_prefix = -x + a * math.log(x) - math.lgamma(a)
+    if x < a + 1:
+        term = total = 1.0 / a
+        n = a
+        for _ in range(100000):
+            n += 1
+            term *= x / n
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return max(0.0, 1.0 - total * math.exp(log_prefix))
+    # continued fraction, modified Lentz's method
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    fraction = d
+    for i in range(1, 100000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        fraction *= d * c
+        if abs(d * c - 1) < 1e-15:
+            break
+    return math.exp(log_prefix) * fraction
+
+
+def chi_square(observed, expected, min_expected=MIN_EXPECTED):
+    # Pearson's goodness-of-fit test, returns (statistic, degrees of freedom, p-value). Participants
+    # expected to win less than min_expected prizes are pooled, smallest first, so that the
+    # chi-square approximation holds.
+    bins = []
+    pooled_observed = pooled_expected = 0
+    for wins, expected_wins in sorted(zip(observed, expected), key=lambda pair: pair[1]):
+        pooled_observed += wins
+        pooled_expected += expected_wins
+        if pooled_expected >= min_expected:
+            bins.append((pooled_observed, pooled_expected))
+            pooled_observed = pooled_expected = 0
+    if pooled_observed or pooled_expected:
+        if bins:
+            wins, expected_wins = bins.pop()
+            bins.append((wins + pooled_observed, expected_wins + pooled_expected))
+        else:
+            bins.append((pooled_observed, pooled_expected))
+    if any(wins and expected_wins <= 0 for wins, expected_wins in bins):
+        return math.inf, len(bins) - 1, 0.0
+    statistic = sum((wins - expected_wins) ** 2 / expected_wins for wins, expected_wins in bins if expected_wins > 0)
+    dof = len(bins) - 1
+    return statistic, dof, _gamma_q(dof / 2, statistic / 2) if dof > 0 else 1.0
+
+
+def mapping_errors(draw):
+    # Number of participants whose first or last ticket number the engine doesn't map back to them,
+    # plus one if the engine's total is off. Checks every ticket boundary, no sampling involved.
+    errors = 0
+    first = 1
+    for i in range(len(draw)):
+        tickets = draw.tickets(i)
+        if tickets:
+            if draw.ticket_holder(first) != i or draw.ticket_holder(first + tickets - 1) != i:
+                errors += 1
+            first += tickets
+    if first - 1 != draw.total:
+        errors += 1
+    return errors
+
+
+def _numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+def simulate_draws(tickets, number_draws, seed=None):
+    # (observed wins, expected wins) per participant over number_draws draws with replacement.
+    total = sum(tickets)
+    return drawengine.batch_win_counts(tickets, number_draws, seed), [number_draws * t / total for t in tickets]
+
+
+def _unique_wins_numpy(numpy, tickets, number_winners, number_raffles, seed):
+    t = numpy.asarray(tickets, dtype=numpy.int64)
+    cumulative = numpy.cumsum(t)
+    starts = cumulative - t + 1
+    total = int(cumulative[-1])
+    generator = numpy.random.default_rng(seed)
+    observed = numpy.zeros(len(t), dtype=numpy.int64)
+    expected = numpy.zeros(len(t), dtype=numpy.float64)
+    for chunk_start in range(0, number_raffles, UNIQUE_CHUNK):
+        size = min(UNIQUE_CHUNK, number_raffles - chunk_start)
+        winners = numpy.empty((size, number_winners), dtype=numpy.int64)
+        # running sum of 1 / remaining tickets, a participant still in the draw at prize k expects
+        # its tickets times that sum in wins
+        odds_sums = numpy.empty((size, number_winners), dtype=numpy.float64)
+        remaining = numpy.full(size, total, dtype=numpy.int64)
+        odds_sum = numpy.zeros(size, dtype=numpy.float64)
+        for k in range(number_winners):
+            odds_sum = odds_sum + 1.0 / remaining
+            odds_sums[:, k] = odds_sum
+            winning_nums = generator.integers(1, remaining, endpoint=True)
+            # the winning number counts the remaining tickets only, skip over the previous winners'
+            # tickets (in ticket order) to find it among all of them
+            previous = numpy.sort(winners[:, :k], axis=1)
+            for j in range(k):
+                won = previous[:, j]
+                winning_nums += numpy.where(starts[won] <= winning_nums, t[won], 0)
+            winner = numpy.searchsorted(cumulative, winning_nums, side="left")
+            winners[:, k] = winner
+            remaining -= t[winner]
+        observed += numpy.bincount(winners.ravel(), minlength=len(t))
+        final_sums = odds_sums[:, -1:]
+        expected += t * final_sums.sum()
+        # winners stop collecting odds once they are out of the draw
+        numpy.subtract.at(expected, winners.ravel(), (t[winners] * (final_sums - odds_sums)).ravel())
+    return observed.tolist(), expected.tolist()
+
+
+def _unique_wins_engine(tickets, number_winners, number_raffles, seed):
+    draw = drawengine.TicketDraw(range(len(tickets)), tickets, rng=random.Random(seed))
+    observed = [0] * len(tickets)
+    expected_removed = [0.0] * len(tickets)
+    total_odds = 0.0
+    for _ in range(number_raffles):
+        odds_sum = 0.0
+        won = []
+        for _ in range(number_winners):
+            odds_sum += 1.0 / draw.total
+            _, winner = draw.draw()
+            won.append((winner, odds_sum))
+            draw.remove(winner)
+        total_odds += odds_sum
+        for winner, winner_odds in won:
+            observed[winner] += 1
+            expected_removed[winner] += tickets[winner] * (odds_sum - winner_odds)
+            draw.restore(winner, tickets[winner])
+    return observed, [t * total_odds - removed for t, removed in zip(tickets, expected_removed)]
+
+
+def simulate_unique(tickets, number_winners, number_raffles, seed=None):
+    # (observed wins, expected wins) per participant over number_raffles raffles of number_winners
+    # unique prizes each.
+    numpy = _numpy()
+    if numpy is not None and sum(tickets) < 2 ** 63:
+        return _unique_wins_numpy(numpy, tickets, number_winners, number_raffles, seed)
+    return _unique_wins_engine(tickets, number_winners, number_raffles, seed)
+
+
+def printed_odds_errors(raffle):
+    # Largest differences between what get_congrats_message prints and the exact odds, in percentage
+    # points: (rounded chance, rounded "x out of y tickets"), and with --sqrt the largest relative
+    # shortfall of the truncated tickets against the exact square roots.
+    weights = raffle.eligible_participants
+    total = sum(weights.values())
+    printed_total = round(total / raffle.ticket_unit)
+    chance_error = ratio_error = sqrt_error = 0.0
+    for participant, weight in weights.items():
+        exact = weight / total * 100
+        chance_error = max(chance_error, abs(float(giveaway.calculate_chance(weight, total)) - exact))
+        if printed_total:
+            ratio_error = max(ratio_error, abs(round(weight / raffle.ticket_unit) / printed_total * 100 - exact))
+        if raffle.use_sqrt:
+            amount = raffle.participant_amounts[participant]
+            if raffle.giveaway_type == giveaway.delegator_str:
+                amount = round(amount * giveaway.million)
+            exact_weight = math.sqrt(amount * raffle.sqrt_scale)
+            if exact_weight:
+                sqrt_error = max(sqrt_error, (exact_weight - weight) / exact_weight)
+    return chance_error, ratio_error, sqrt_error
+
+
+def verify(raffle, number_draws, seed=None):
+    # Replays the raffle's eligible set over number_draws simulated prizes and returns a report.
+    tickets = list(raffle.eligible_participants.values())
+    if sum(tickets) <= 0:
+        raise ValueError("No tickets to draw from")
+    draw = drawengine.TicketDraw(range(len(tickets)), tickets, rng=random.Random(seed))
+    errors = mapping_errors(draw)
+    report = {"participants": len(tickets), "draws": number_draws, "vectorized": _numpy() is not None}
+    if raffle.unique:
+        number_winners = min(raffle.number_winners, sum(1 for t in tickets if t > 0))
+        # the engine must keep mapping tickets right once winners leave the draw
+        for _ in range(number_winners):
+            draw.remove(draw.draw()[1])
+        errors += mapping_errors(draw)
+        number_raffles = max(1, number_draws // number_winners)
+        report["raffles"] = number_raffles
+        report["draws"] = number_raffles * number_winners
+        observed, expected = simulate_unique(tickets, number_winners, number_raffles, seed)
+    else:
+        observed, expected = simulate_draws(tickets, number_draws, seed)
+    statistic, dof, p_value = chi_square(observed, expected)
+    chance_error, ratio_error, sqrt_error = printed_odds_errors(raffle)
+    report.update({
+        "mapping_errors": errors,
+        "chi_square": statistic,
+        "dof": dof,
+        "p_value": p_value,
+        "passed": errors == 0 and p_value >= SIGNIFICANCE,
+        "max_chance_error": chance_error,
+        "max_ticket_ratio_error": ratio_error,
+        "max_sqrt_truncation": sqrt_error,
+    })
+    return report
@@ -0,0 +1,244 @@
+#!/bin/env python3
+# First reward epoch and delegation length of every current delegator of a pool, for "loyal since"
+# rewards.
+#
+# Histories come from Blockfrost through the on-disk history cache (see historycache.py), fetched
+# concurrently a batch of delegators at a time. Every finished batch is saved to a state database,
+# so an interrupted run picks up where it stopped without fetching anything again. First reward
+# epochs never change once found and are kept across --refresh runs.
+#
+# --history-store computes the report offline from archived ledger snapshots (see loyaltystore.py)
+# instead. Those carry no rewards, so the first reward epoch is left empty and first_epoch (the
+# first stored epoch the delegator's stake counted for the pool) is the closest there is.
+import argparse
+import asyncio
+import os
+import sqlite3
+
+import blockfrost
+import cardanoaddress
+import export
+import historycache
+import loyaltystore
+
+DEFAULT_STATE = "firstrewards.db"
+BATCH_SIZE = 500
+million = 1000000
+FIELDS = ["stake_address", "first_epoch", "delegated_since", "epochs_delegated", "first_reward_epoch", "live_ada"]
+
+
+class ReportState:
+    def __init__(self, path=DEFAULT_STATE):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS delegators ("
+            " pool_id TEXT NOT NULL, stake_address TEXT NOT NULL, live_stake INTEGER NOT NULL,"
+            " PRIMARY KEY (pool_id, stake_address)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS report ("
+            " pool_id TEXT NOT NULL, stake_address TEXT NOT NULL, first_epoch INTEGER, delegated_since INTEGER,"
+            " epochs_delegated INTEGER NOT NULL, PRIMARY KEY (pool_id, stake_address)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS first_rewards ("
+            " pool_id TEXT NOT NULL, stake_address TEXT NOT NULL, epoch INTEGER NOT NULL,"
+            " PRIMARY KEY (pool_id, stake_address)) WITHOUT ROWID;"
+        )
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def delegator_count(self, pool_id):
+        return self.db.execute("SELECT COUNT(*) FROM delegators WHERE pool_id = ?", (pool_id,)).fetchone()[0]
+
+    def set_delegators(self, pool_id, delegators):
+        # Starts a new run: the pool's delegator list is replaced and its report rows recomputed.
+        self.db.execute("DELETE FROM delegators WHERE pool_id = ?", (pool_id,))
+        self.db.execute("DELETE FROM report WHERE pool_id = ?", (pool_id,))
+        self.db.executemany("INSERT INTO delegators (pool_id, stake_address, live_stake) VALUES (?, ?, ?)",
+                            [(pool_id, stake_address, live_stake) for stake_address, live_stake in delegators])
+        self.db.commit()
+
+    def pending(self, pool_id):
+        return [row[0] for row in self.db.execute(
+            "SELECT d.stake_address FROM delegators d LEFT JOIN report r"
+            " ON r.pool_id = d.pool_id AND r.stake_address = d.stake_address"
+            " WHERE d.pool_id = ? AND r.stake_address IS NULL ORDER BY d.stake_address", (pool_id,))]
+
+    def first_rewards(self, pool_id, stake_addresses):
+        found = {}
+        for stake_address in stake_addresses:
+            row = self.db.execute("SELECT epoch FROM first_rewards WHERE pool_id = ? AND stake_address = ?",
+                                  (pool_id, stake_address)).fetchone()
+            if row is not None:
+                found[stake_address] = row[0]
+        return found
+
+    def save(self, pool_id, rows, first_rewards):
+        # rows: (stake address, first epoch, delegated since, epochs delegated), one batch at a time
+        self.db.executemany(
+            "INSERT OR REPLACE INTO report (pool_id, stake_address, first_epoch, delegated_since, epochs_delegated)"
+            " VALUES (?, ?, ?, ?, ?)", [(pool_id,) + tuple(row) for row in rows])
+        self.db.executemany("INSERT OR REPLACE INTO first_rewards (pool_id, stake_address, epoch) VALUES (?, ?, ?)",
+                            [(pool_id, stake_address, epoch) for stake_address, epoch in first_rewards.items()])
+        self.db.commit()
+
+    def report(self, pool_id):
+        # Report rows in FIELDS order, earliest first reward first.
+        return self.db.execute(
+            "SELECT d.stake_address, r.first_epoch, r.delegated_since, r.epochs_delegated, f.epoch, d.live_stake"
+            " FROM delegators d JOIN report r ON r.pool_id = d.pool_id AND r.stake_address = d.stake_address"
+            " LEFT JOIN first_rewards f ON f.pool_id = d.pool_id AND f.stake_address = d.stake_address"
+            " WHERE d.pool_id = ? ORDER BY f.epoch IS NULL, f.epoch, d.stake_address", (pool_id,))
+
+
+def delegation_epochs(epochs_with_pool):
+    # (first epoch, start of the current unbroken delegation, number of epochs) from an oldest first
+    # sequence of (epoch, delegated to the pool) pairs. The current delegation is None when the
+    # latest epoch isn't with the pool yet.
+    first = since = last = None
+    count = 0
+    for epoch, with_pool in epochs_with_pool:
+        if not with_pool:
+            since = None
+            continue
+        count += 1
+        if first is None:
+            first = epoch
+        if since is None or epoch != last + 1:
+            since = epoch
+        last = epoch
+    return first, since, count
+
+
+async def first_reward_epoch(client, stake_address, pool_id):
+    # Earliest epoch the account earned rewards from the pool, going through its rewards oldest
+    # first and stopping at the first page with one.
+    path = f"/api/v0/accounts/{stake_address}/rewards"
+    page = 1
+    while True:
+        rows = await client.fetch_page(path, page)
+        for row in rows:
+            if row["pool_id"] == pool_id:
+                return row["epoch"]
+        if len(rows) < blockfrost.PAGE_SIZE:
+            return None
+        page += 1
+
+
+async def fetch_report(state, pool_id, project_id, base_url=blockfrost.BLOCKFROST_URL, concurrency=10,
+                       cache_path=historycache.DEFAULT_CACHE, batch_size=BATCH_SIZE, refresh=False):
+    async with blockfrost.BlockfrostClient(project_id, base_url=base_url, concurrency=concurrency) as client:
+        if refresh or not state.delegator_count(pool_id):
+            delegs = await client.fetch_list(f"/api/v0/pools/{pool_id}/delegators")
+            state.set_delegators(pool_id, [(deleg["address"], int(deleg["live_stake"])) for deleg in delegs])
+        pending = state.pending(pool_id)
+        print(str(len(pending)) + " of " + str(state.delegator_count(pool_id)) + " delegators left to fetch")
+        cache = historycache.HistoryCache(cache_path)
+        try:
+            for start in range(0, len(pending), batch_size):
+                batch = pending[start:start + batch_size]
+                histories = await historycache.fetch_histories(client, cache, batch)
+                first_rewards = state.first_rewards(pool_id, batch)
+                missing = [stake_address for stake_address in batch if stake_address not in first_rewards]
+                found = await asyncio.gather(*(first_reward_epoch(client, stake_address, pool_id)
+                                               for stake_address in missing))
+                rows = [(stake_address,) + delegation_epochs((row["active_epoch"], row["pool_id"] == pool_id)
+                                                             for row in history)
+                        for stake_address, history in zip(batch, histories)]
+                state.save(pool_id, rows, {stake_address: epoch for stake_address, epoch in zip(missing, found)
+                                           if epoch is not None})
+                print("Fetched " + str(min(start + batch_size, len(pending))) + "/" + str(len(pending)))
+            print("History cache hits: " + str(cache.hits))
+        finally:
+            cache.close()
+        print("Blockfrost requests: " + str(client.requests) + ", retries: " + str(client.retries))
+
+
+def store_report(store_dir, pool_id):
+    # Report rows in FIELDS order from the snapshot store, for the delegators of its latest epoch.
+    pool_epochs = loyaltystore.epochs(store_dir, pool_id)
+    if not pool_epochs:
+        raise ValueError("Pool " + pool_id + " has no epochs in the history store " + store_dir)
+    current = loyaltystore.read_snapshot(store_dir, pool_id, pool_epochs[-1])
+    # consecutive stored epochs count as an unbroken delegation
+    present = {delegator: [] for delegator in current}
+    for i, epoch in enumerate(pool_epochs):
+        for delegator, _ in loyaltystore.iter_snapshot(store_dir, pool_id, epoch):
+            epochs = present.get(delegator)
+            if epochs is not None:
+                epochs.append(i)
+    delegators = sorted(current)
+    stake_addresses = cardanoaddress.encode_stake_addresses(delegators)
+    rows = []
+    for stake_address, delegator in zip(stake_addresses, delegators):
+        first, since, count = delegation_epochs((i, True) for i in present[delegator])
+        rows.append((stake_address, pool_epochs[first], pool_epochs[since], count, None, current[delegator]))
+    return rows
+
+
+def write_report(rows, out_path):
+    # Writes the report and returns (delegators, delegators with a first reward, earliest first reward).
+    delegators = rewarded = 0
+    earliest = None
+    with export.RowWriter(out_path, FIELDS) as writer:
+        for stake_address, first, since, count, first_reward, live_stake in rows:
+            delegators += 1
+            if first_reward is not None:
+                rewarded += 1
+                earliest = first_reward if earliest is None else min(earliest, first_reward)
+            writer.write((stake_address, "" if first is None else first, "" if since is None else since, count,
+                          "" if first_reward is None else first_reward, live_stake / million))
+    return delegators, rewarded, earliest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report the first reward epoch and the number of epochs delegated of every current delegator "
+                    + "of a pool.")
+    parser.add_argument('-i', "--pool-id", dest="id", required=True, help="the pool ID")
+    parser.add_argument('-o', "--output", dest="output", default="firstrewards.csv",
+                        help="the report file (default: firstrewards.csv), .jsonl and .gz/.zst work too")
+    parser.add_argument("--state", dest="state", default=DEFAULT_STATE,
+                        help="the SQLite file keeping the progress of a run, for resuming it (default: "
+                             + DEFAULT_STATE + ")")
+    parser.add_argument("--refresh", action="store_true",
+                        help="if used, starts a new run from the pool's current delegators instead of resuming")
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=BATCH_SIZE,
+                        help="delegators fetched and saved at a time (default: " + str(BATCH_SIZE) + ")")
+    parser.add_argument("--blockfrost-url", dest="blockfrost_url", default=blockfrost.BLOCKFROST_URL,
+                        help="the Blockfrost API base URL")
+    parser.add_argument("--concurrency", type=int, default=10,
+                        help="the maximum number of Blockfrost requests in flight (default: 10)")
+    parser.add_argument("--cache", default=historycache.DEFAULT_CACHE,
+                        help="the SQLite file caching delegators' history between runs (default: "
+                             + historycache.DEFAULT_CACHE + ")")
+    parser.add_argument("--history-store", dest="history_store",
+                        help="if specified will compute the report offline from this stake snapshot store "
+                             + "(see loyaltystore.py), without first reward epochs")
+    args = parser.parse_args()
+
+    try:
+        export.check_path(args.output)
+        if args.history_store is not None:
+            report_rows = store_report(args.history_store, loyaltystore.pool_hex(args.id))
+            totals = write_report(report_rows, args.output)
+        else:
+            pool = loyaltystore.pool_bech32(args.id)
+            report_state = ReportState(args.state)
+            try:
+                asyncio.run(fetch_report(report_state, pool,
+                                         os.environ.get("BLOCKFROST_PROJECT_ID", blockfrost.DEFAULT_PROJECT_ID),
+                                         args.blockfrost_url, args.concurrency, args.cache, args.batch_size,
+                                         args.refresh))
+                totals = write_report(report_state.report(pool), args.output)
+            finally:
+                report_state.close()
+    except ValueError as error:
+        print(error)
+        exit()
+
+    delegators_total, rewarded_total, earliest_reward = totals
+    print("Total # of delegators: " + str(delegators_total))
+    if args.history_store is None:
+        print("Delegators rewarded by the pool: " + str(rewarded_total)
+              + ("" if earliest_reward is None else ", the earliest since epoch " + str(earliest_reward)))
+    print("Report written to " + args.output)
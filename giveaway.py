@@ -0,0 +1,453 @@
+#!/bin/env python3
+# Raffle library: participant sources, eligibility, ticket weighting and prize draws.
+#
+# Shared by the pickers (randomdelegatorpicker.py, randomdelegatorpicker2.py) and the raffle server
+# (raffleserver.py), and importable by any long-lived process (e.g. a chat bot) that wants to load
+# participants once and draw many times. Importing it has no side effects and stays cheap: the
+# ledger readers, Blockfrost client and snapshot store are only imported when a source first needs
+# them. Nothing here prints, functions return their totals for the caller to report.
+#
+# A raffle goes through four steps:
+#   1. a participant source (LedgerSource, BlockfrostLoyaltySource or StoreLoyaltySource, or
+#      ledger_participants over an already read ledger extract) gives the Participants,
+#   2. the raffle's Eligibility rules keep the eligible ones,
+#   3. its Weighting turns their amounts into tickets (linear or square rooted),
+#   4. the draw engine (drawengine.py) draws the prizes, see draw_winners.
+#
+#   source = giveaway.LedgerSource("ledger.json")
+#   raffle = giveaway.Raffle("nft", policy_id="0e14...", number_winners=3, unique=True)
+#   source.collect(raffle)
+#   prizes = giveaway.draw_winners(raffle)["prizes"]
+import itertools
+import math
+import os
+import random
+
+import cardanoaddress
+import drawengine
+import exclusions
+import phasemetrics
+
+million = 1000000
+delegator_str = "delegator"
+token_hodler_str = "token_hodler"
+loyalty_str = "loyalty"
+# addresses encoded at a time when streaming participant lists
+ENCODE_CHUNK = 10000
+
+
+class Participants:
+    # What a participant source hands to the eligibility rules: every participant's amount, in
+    # lovelace for delegators (unit turns it into ADA), tokens for token holders and ADA for loyalty
+    # raffles, in the source's order. Delegators are keyed by stake key hash, token holders by raw
+    # address and loyalty participants by stake address. Loyalty sources also give the tickets,
+    # which add up every epoch delegated.
+    def __init__(self, giveaway_type, amounts, epoch=None, unit=1, weights=None, pool_owners=(),
+                 recorded_stake=None):
+        self.giveaway_type = giveaway_type
+        self.amounts = amounts
+        self.epoch = epoch
+        self.unit = unit
+        self.weights = weights
+        self.pool_owners = list(pool_owners)
+        self.recorded_stake = recorded_stake
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def shown(self, amount):
+        # the amount in ADA/tokens, as displayed and compared with the minimum
+        return amount / self.unit if self.unit != 1 else amount
+
+
+def _also_excluding(owners, excludes):
+    return lambda participant: participant in owners or excludes(participant)
+
+
+class Eligibility:
+    # A raffle's eligibility rules. Delegators with exactly min_amount ADA stay eligible, token
+    # holders and loyalty participants need more than min_amount, as the pickers always did.
+    # allowed (stake key hashes, see stakediff.py) restricts pool raffles, None allows everyone.
+    # With group_by_stake token holders are wallets: excluded addresses leave first, then the
+    # addresses sharing a stake key are summed and the rules apply to the totals.
+    _EXCLUDES = {delegator_str: "excludes_credential", token_hodler_str: "excludes_address",
+                 loyalty_str: "excludes_stake_address"}
+
+    def __init__(self, min_amount=0, excluded=None, allowed=None, group_by_stake=False):
+        self.min_amount = min_amount
+        self.excluded = excluded if excluded is not None else exclusions.ExclusionSet()
+        self.allowed = allowed
+        self.group_by_stake = group_by_stake
+
+    def apply(self, participants):
+        # Returns ({participant: amount} of the eligible participants, totals). The pool's owners
+        # and reward account are excluded as well, without adding them to the exclusion set, which
+        # may be shared with other raffles.
+        excluded = self.excluded
+        owners = {owner.lower() for owner in participants.pool_owners} - excluded.credentials
+        excludes = getattr(excluded, self._EXCLUDES[participants.giveaway_type])
+        if owners:
+            excludes = _also_excluding(owners, excludes)
+        amounts = participants.amounts
+        eligible = {}
+        ineligible_participants_total = 0
+        eligible_tokens_total = 0
+        ineligible_tokens_total = 0
+        if self.group_by_stake and participants.giveaway_type == token_hodler_str:
+            included = {}
+            for address, amount in amounts.items():
+                if excludes(address):
+                    ineligible_tokens_total += amount
+                    ineligible_participants_total += 1
+                else:
+                    included[address] = amount
+            amounts = cardanoaddress.group_by_stake(included)
+        inclusive = participants.giveaway_type == delegator_str
+        for participant, amount in amounts.items():
+            shown = participants.shown(amount)
+            below = shown < self.min_amount if inclusive else shown <= self.min_amount
+            if below or excludes(participant) or (self.allowed is not None and participant not in self.allowed):
+                ineligible_tokens_total += shown
+                ineligible_participants_total += 1
+            else:
+                eligible_tokens_total += shown
+                eligible[participant] = amount
+        return eligible, {
+            "epoch": participants.epoch,
+            "excluded": len(excluded) + len(owners),
+            "eligible": len(eligible),
+            "ineligible": ineligible_participants_total,
+            "eligible_amount": eligible_tokens_total,
+            "ineligible_amount": ineligible_tokens_total,
+        }
+
+
+class Weighting:
+    # Turns amounts into tickets, linearly or square rooted. Tickets are kept as exact integers,
+    # scale keeps enough precision for the square roots of small balances and unit turns tickets
+    # back into ADA/tokens for display.
+    def __init__(self, use_sqrt=False, scale=1, unit=1):
+        self.use_sqrt = use_sqrt
+        self.scale = scale
+        self.unit = unit
+
+    def tickets(self, amount):
+        if self.use_sqrt:
+            return math.isqrt(amount * self.scale)
+        return amount
+
+
+class Raffle:
+    def __init__(self, name, pool_id=None, policy_id=None, number_winners=1, min_tokens=0, unique=False,
+                 use_sqrt=False, group_by_stake=False, excluded=None, allowed=None, history_filter=None, batch=False,
+                 batch_out="winners.csv", output=None, export_path=None, verify_draws=None, metrics=None,
+                 loyalty=False):
+        self.name = name
+        self.pool_id = pool_id
+        self.policy_id = policy_id
+        self.number_winners = number_winners
+        self.min_tokens = min_tokens
+        self.unique = unique
+        self.use_sqrt = use_sqrt
+        self.group_by_stake = group_by_stake
+        self.excluded = excluded if excluded is not None else exclusions.ExclusionSet()
+        # stake key hashes allowed in a pool raffle, None allows every delegator. A history filter
+        # (stakediff.HistoryFilter) further restricts them once the ledger's delegators are known.
+        self.allowed = allowed
+        self.history_filter = history_filter
+        self.batch = batch
+        self.batch_out = batch_out
+        self.output = output
+        self.export_path = export_path
+        self.verify_draws = verify_draws
+        self.metrics = metrics if metrics is not None else phasemetrics.Metrics()
+        if loyalty:
+            self.giveaway_type = loyalty_str
+        else:
+            self.giveaway_type = delegator_str if pool_id is not None else token_hodler_str
+        # tickets are counted in lovelace/tokens, or their square roots scaled by sqrt_scale with --sqrt;
+        # ticket_unit turns them back into ADA/tokens for display. Loyalty tickets come from the
+        # source, in ADA, already square rooted epoch by epoch with --sqrt.
+        if self.giveaway_type == delegator_str:
+            self.amount_unit = "ADA"
+            self.sqrt_scale = 1
+            self.ticket_unit = math.isqrt(million) if use_sqrt else million
+        elif self.giveaway_type == loyalty_str:
+            self.amount_unit = "ADA"
+            self.sqrt_scale = 1
+            self.ticket_unit = 1
+        else:
+            self.amount_unit = "tokens"
+            self.sqrt_scale = million
+            self.ticket_unit = math.isqrt(million) if use_sqrt else 1
+        self.weighting = Weighting(use_sqrt and self.giveaway_type != loyalty_str, self.sqrt_scale, self.ticket_unit)
+        self.eligible_participants = {}
+        self.participant_amounts = {}
+        self.address_cache = {}
+
+    def eligibility(self, participants=None):
+        allowed = self.allowed
+        if self.history_filter is not None and participants is not None \
+                and participants.giveaway_type == delegator_str:
+            history_allowed = self.history_filter.allowed(self.pool_id, participants.epoch, participants.amounts)
+            allowed = history_allowed if allowed is None else allowed & history_allowed
+        return Eligibility(self.min_tokens, self.excluded, allowed, self.group_by_stake)
+
+    def maybe_apply_sqrt(self, num):
+        return self.weighting.tickets(num)
+
+    def encode_participants(self, participants):
+        # delegators are stake key hashes, token holders are raw addresses, loyalty participants
+        # are stake addresses already
+        if self.giveaway_type == loyalty_str:
+            return list(participants)
+        with self.metrics.phase("address_encoding"):
+            if self.giveaway_type == delegator_str:
+                return cardanoaddress.encode_stake_addresses(participants, cache=self.address_cache)
+            return cardanoaddress.encode_addresses(participants, cache=self.address_cache)
+
+    def iter_encoded(self, participants):
+        # Encodes any number of participants ENCODE_CHUNK at a time, without growing the address cache.
+        participants = iter(participants)
+        while True:
+            chunk = list(itertools.islice(participants, ENCODE_CHUNK))
+            if not chunk:
+                return
+            if self.giveaway_type == loyalty_str:
+                yield from chunk
+                continue
+            with self.metrics.phase("address_encoding"):
+                if self.giveaway_type == delegator_str:
+                    yield from cardanoaddress.encode_stake_addresses(chunk)
+                else:
+                    yield from cardanoaddress.encode_addresses(chunk)
+
+
+def calculate_chance(tickets, total_tickets):
+    return str(round(tickets / total_tickets * 100, 2))
+
+
+def ledger_participants(raffle, ledger_extract):
+    # The raffle's pool delegators or policy holders in a ledger extract (ledgerreader's, the
+    # index's or a LedgerSource), None if the pool isn't in the ledger.
+    if raffle.giveaway_type == delegator_str:
+        pool = ledger_extract.pools[raffle.pool_id]
+        if pool.recorded_stake is None or pool.reward_account is None:
+            return None
+        stake = pool.stake
+        return Participants(delegator_str, {delegator: stake[delegator] for delegator in pool.delegators
+                                            if delegator in stake},
+                            ledger_extract.epoch, unit=million, pool_owners=list(pool.owners) + [pool.reward_account],
+                            recorded_stake=pool.recorded_stake)
+    return Participants(token_hodler_str, ledger_extract.policies[raffle.policy_id], ledger_extract.epoch)
+
+
+def collect_participants(raffle, participants):
+    # Fills the raffle's eligible participants and their tickets from a source's participants,
+    # replacing those of an earlier collection. Returns the totals, or None if there are no
+    # participants (the pool wasn't found).
+    raffle.eligible_participants = {}
+    raffle.participant_amounts = {}
+    if participants is None:
+        return None
+    eligible, totals = raffle.eligibility(participants).apply(participants)
+    weights = participants.weights
+    for participant, amount in eligible.items():
+        raffle.participant_amounts[participant] = participants.shown(amount)
+        raffle.eligible_participants[participant] = raffle.maybe_apply_sqrt(amount) if weights is None \
+            else weights[participant]
+    # per raffle, a run can draw several raffles
+    raffle.metrics.set_in("raffles", raffle.name, "eligible_participants", len(raffle.eligible_participants))
+    raffle.metrics.set_in("raffles", raffle.name, "ineligible_participants", totals["ineligible"])
+    if participants.giveaway_type == delegator_str:
+        totals["recorded_stake"] = participants.recorded_stake / million
+        totals["pool_owners"] = participants.pool_owners
+    return totals
+
+
+def collect_delegators(raffle, ledger_extract):
+    # Fills the raffle's eligible participants with the pool's delegators. Returns the totals, or
+    # None if the pool isn't in the ledger.
+    return collect_participants(raffle, ledger_participants(raffle, ledger_extract))
+
+
+def collect_token_holders(raffle, ledger_extract):
+    # Fills the raffle's eligible participants with the policy's token holders, returns the totals.
+    # With group_by_stake the holders are wallets (stake credentials) rather than addresses, and
+    # --min-tokens and the tickets apply to a wallet's total.
+    return collect_participants(raffle, ledger_participants(raffle, ledger_extract))
+
+
+def collect(raffle, ledger_extract):
+    if raffle.giveaway_type == delegator_str:
+        return collect_delegators(raffle, ledger_extract)
+    return collect_token_holders(raffle, ledger_extract)
+
+
+def draw_prize(raffle, draw):
+    # Draws one prize. Returns (winning number, participant, participant's tickets, total tickets),
+    # the tickets being those at the time of the draw; with --unique the winner then leaves the draw.
+    winning_num, index = draw.draw()
+    participant = draw.participants[index]
+    participant_tickets = draw.tickets(index)
+    total_tickets = draw.total
+    if raffle.unique:
+        draw.remove(index)
+    return winning_num, participant, participant_tickets, total_tickets
+
+
+def draw_winners(raffle, rng=None):
+    # Draws the raffle's number_winners prizes over a new draw of its eligible participants, so a
+    # raffle collected once can be drawn again and again. Returns the total tickets and the prizes
+    # (as the raffle server answers them), raises ValueError when the raffle can't be drawn.
+    if raffle.unique and len(raffle.eligible_participants) < raffle.number_winners:
+        raise ValueError("Too few eligible participants for " + str(raffle.number_winners) + " unique winners")
+    draw = drawengine.from_dict(raffle.eligible_participants, rng if rng is not None else random)
+    if draw.total <= 0:
+        raise ValueError("No eligible participants")
+    total_tickets = draw.total
+    prizes = [draw_prize(raffle, draw) for _ in range(raffle.number_winners)]
+    addresses = raffle.encode_participants([participant for (_, participant, _, _) in prizes])
+    return {
+        "total_tickets": round(total_tickets / raffle.ticket_unit),
+        "prizes": [{
+            "prize": prize_num + 1,
+            "winning_number": winning_num,
+            "address": address,
+            raffle.amount_unit.lower(): raffle.participant_amounts[participant],
+            "tickets": round(tickets / raffle.ticket_unit),
+            "chance": calculate_chance(tickets, prize_total),
+        } for prize_num, (address, (winning_num, participant, tickets, prize_total))
+            in enumerate(zip(addresses, prizes))],
+    }
+
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class LedgerSource:
+    # Pool delegators and policy holders from a ledger-state file, for processes drawing many
+    # raffles. Pools and policies are read on first use (or together, in one pass, with load()) and
+    # kept until the file changes. An up to date index (see ledgerindex.py) is used when there is one.
+    def __init__(self, ledger_path, use_index=True, workers=1, ledger_format="auto", json_backend="auto",
+                 metrics=None):
+        self.ledger_path = ledger_path
+        self.use_index = use_index
+        self.workers = workers
+        self.ledger_format = ledger_format
+        self.json_backend = json_backend
+        self.metrics = metrics
+        self.epoch = None
+        self.pools = {}
+        self.policies = {}
+        self._stat = None
+
+    def load(self, pool_ids=(), policy_ids=()):
+        import ledgerindex
+        stat = _file_stat(self.ledger_path)
+        if stat != self._stat:
+            # a new ledger, nothing read from the previous one is valid any more
+            self.epoch = None
+            self.pools = {}
+            self.policies = {}
+            self._stat = stat
+        pool_ids = [pool_id for pool_id in pool_ids if pool_id not in self.pools]
+        policy_ids = [policy_id for policy_id in policy_ids if policy_id not in self.policies]
+        if not pool_ids and not policy_ids:
+            return self
+        read_ledger = ledgerindex.read_ledger if self.use_index else ledgerindex.read_ledger_file
+        extract = read_ledger(self.ledger_path, pool_ids=pool_ids, policy_ids=policy_ids, workers=self.workers,
+                              metrics=self.metrics, ledger_format=self.ledger_format, json_backend=self.json_backend)
+        self.epoch = extract.epoch
+        self.pools.update(extract.pools)
+        self.policies.update(extract.policies)
+        return self
+
+    def participants(self, raffle):
+        if raffle.giveaway_type == delegator_str:
+            self.load(pool_ids=[raffle.pool_id])
+        else:
+            self.load(policy_ids=[raffle.policy_id])
+        return ledger_participants(raffle, self)
+
+    def collect(self, raffle):
+        return collect_participants(raffle, self.participants(raffle))
+
+
+def _loyalty_participants(rows):
+    # rows: (stake address, tickets, last staked ADA)
+    return Participants(loyalty_str, {stake_address: last_staked for stake_address, _, last_staked in rows},
+                        weights={stake_address: tickets for stake_address, tickets, _ in rows})
+
+
+class StoreLoyaltySource:
+    # Loyalty raffle participants computed offline from the stake snapshot store (see loyaltystore.py).
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+    def participants(self, raffle):
+        import loyaltystore
+        with raffle.metrics.phase("stake_aggregation"):
+            rows = loyaltystore.loyalty_participants(self.store_dir, raffle.pool_id, raffle.use_sqrt)
+        with raffle.metrics.phase("address_encoding"):
+            stake_addresses = cardanoaddress.encode_stake_addresses([delegator for (delegator, _, _) in rows])
+        return _loyalty_participants([(stake_address, tickets, last_staked)
+                                      for stake_address, (_, tickets, last_staked) in zip(stake_addresses, rows)])
+
+    def collect(self, raffle):
+        return collect_participants(raffle, self.participants(raffle))
+
+
+class BlockfrostLoyaltySource:
+    # Loyalty raffle participants from the delegators' account histories on Blockfrost, through the
+    # history cache unless use_cache is False. The raffle's pool id has to be the pool1... form.
+    # Blockfrost requests, retries and cache hits are counted in the raffle's metrics.
+    def __init__(self, project_id=None, base_url=None, concurrency=10, cache_path="", use_cache=True):
+        self.project_id = project_id
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.cache_path = cache_path
+        self.use_cache = use_cache
+
+    async def fetch_participants(self, raffle):
+        # For callers already running an event loop, participants() runs its own.
+        import blockfrost
+        import historycache
+        import loyaltystore
+        project_id = self.project_id
+        if project_id is None:
+            project_id = os.environ.get("BLOCKFROST_PROJECT_ID", blockfrost.DEFAULT_PROJECT_ID)
+        metrics = raffle.metrics
+        with metrics.phase("history_fetch"):
+            async with blockfrost.BlockfrostClient(project_id, base_url=self.base_url or blockfrost.BLOCKFROST_URL,
+                                                   concurrency=self.concurrency) as client:
+                delegs = await client.fetch_list(f"/api/v0/pools/{raffle.pool_id}/delegators")
+                stake_addresses = [deleg['address'] for deleg in delegs]
+                if not self.use_cache:
+                    histories = await client.fetch_lists([f"/api/v0/accounts/{address}/history"
+                                                          for address in stake_addresses])
+                else:
+                    cache = historycache.HistoryCache(self.cache_path or historycache.DEFAULT_CACHE)
+                    try:
+                        histories = await historycache.fetch_histories(client, cache, stake_addresses)
+                        metrics.set("cache_hits", cache.hits)
+                    finally:
+                        cache.close()
+                metrics.set("http_requests", client.requests)
+                metrics.set("http_retries", client.retries)
+        rows = []
+        with metrics.phase("stake_aggregation"):
+            for stake_address, history in zip(stake_addresses, histories):
+                tickets, last_staked = loyaltystore.loyalty_amounts(
+                    [int(row['amount']) for row in history if row['pool_id'] == raffle.pool_id], raffle.use_sqrt)
+                rows.append((stake_address, tickets, last_staked))
+        return _loyalty_participants(rows)
+
+    def participants(self, raffle):
+        import asyncio
+        return asyncio.run(self.fetch_participants(raffle))
+
+    def collect(self, raffle):
+        return collect_participants(raffle, self.participants(raffle))
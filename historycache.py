@@ -0,0 +1,65 @@
+#!/bin/env python3
+# On-disk SQLite cache of Blockfrost account histories.
+#
+# Past epochs never change, so once a delegator's history is cached later runs only ask Blockfrost
+# for the newest epochs, newest first, and stop paginating as soon as they reach cached rows.
+import asyncio
+import sqlite3
+
+DEFAULT_CACHE = "blockfrost-history.db"
+# the newest cached epochs are fetched again, they may not have been final when they were cached
+REFRESH_EPOCHS = 2
+
+
+class HistoryCache:
+    def __init__(self, path=DEFAULT_CACHE):
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS account_history ("
+            " stake_address TEXT NOT NULL, active_epoch INTEGER NOT NULL, amount TEXT NOT NULL,"
+            " pool_id TEXT NOT NULL, PRIMARY KEY (stake_address, active_epoch)) WITHOUT ROWID"
+        )
+        self.hits = 0
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def last_epoch(self, stake_address):
+        row = self.db.execute("SELECT MAX(active_epoch) FROM account_history WHERE stake_address = ?",
+                              (stake_address,)).fetchone()
+        return row[0]
+
+    def history(self, stake_address):
+        # Same shape as Blockfrost's /accounts/{stake_address}/history, oldest epoch first.
+        return [{"active_epoch": epoch, "amount": amount, "pool_id": pool_id}
+                for epoch, amount, pool_id in self.db.execute(
+                    "SELECT active_epoch, amount, pool_id FROM account_history"
+                    " WHERE stake_address = ? ORDER BY active_epoch", (stake_address,))]
+
+    def store(self, stake_address, rows):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO account_history (stake_address, active_epoch, amount, pool_id)"
+            " VALUES (?, ?, ?, ?)",
+            [(stake_address, row["active_epoch"], row["amount"], row["pool_id"]) for row in rows])
+
+
+async def fetch_history(client, cache, stake_address):
+    path = f"/api/v0/accounts/{stake_address}/history"
+    last_epoch = cache.last_epoch(stake_address)
+    if last_epoch is None:
+        rows = await client.fetch_list(path)
+    else:
+        cache.hits += 1
+        refresh_from = last_epoch - REFRESH_EPOCHS + 1
+        rows = await client.fetch_list_until(path, lambda row: row["active_epoch"] < refresh_from,
+                                             {"order": "desc"})
+    cache.store(stake_address, rows)
+    return cache.history(stake_address)
+
+
+async def fetch_histories(client, cache, stake_addresses):
+    histories = await asyncio.gather(*(fetch_history(client, cache, stake_address)
+                                       for stake_address in stake_addresses))
+    cache.db.commit()
+    return histories
@@ -0,0 +1,96 @@
+#!/bin/env python3
+# Interchangeable JSON decoders for the streaming ledger reader.
+#
+# ledgerreader.py skips over most of the ledger and only decodes the small values it needs: pool
+# parameters, delegation/stake pairs and the UTxO entries carrying a requested policy. Those go
+# through one of these backends. orjson and simdjson (pip3 install orjson / pysimdjson) decode
+# them several times faster than the standard library, "auto" picks the first one installed.
+# simdjson's UTxO entries are also lazy: only the address and the policies looked at become Python
+# objects.
+#
+# Neither handles integers beyond 64 bits like json does (orjson turns them into floats, simdjson
+# fails on them), so text with a run of 20 or more digits is always left to the standard library.
+# Every backend thus decodes to the same values.
+import json
+import re
+
+BACKENDS = ("auto", "stdlib", "orjson", "simdjson")
+# tried in this order by "auto"
+AUTO_ORDER = ("orjson", "simdjson", "stdlib")
+PACKAGES = {"orjson": "orjson", "simdjson": "pysimdjson"}
+
+_LONG_NUMBER = re.compile(r"[0-9]{20}")
+
+
+class StdlibBackend:
+    name = "stdlib"
+
+    def loads(self, text):
+        return json.loads(text)
+
+    def loads_lazy(self, text):
+        return json.loads(text)
+
+
+class OrjsonBackend:
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._loads = orjson.loads
+
+    def loads(self, text):
+        if _LONG_NUMBER.search(text):
+            return json.loads(text)
+        return self._loads(text)
+
+    def loads_lazy(self, text):
+        return self.loads(text)
+
+
+class SimdjsonBackend:
+    name = "simdjson"
+
+    def __init__(self):
+        import simdjson
+        self._parser = simdjson.Parser()
+
+    def loads(self, text):
+        if _LONG_NUMBER.search(text):
+            return json.loads(text)
+        return self._parser.parse(text, True)
+
+    def loads_lazy(self, text):
+        # The returned objects read from the parser's buffer: they have to be dropped before the
+        # next call, nothing may keep a reference to them.
+        if _LONG_NUMBER.search(text):
+            return json.loads(text)
+        return self._parser.parse(text)
+
+
+_CLASSES = {"stdlib": StdlibBackend, "orjson": OrjsonBackend, "simdjson": SimdjsonBackend}
+
+
+def available():
+    # names of the backends that can be used here
+    names = []
+    for name in AUTO_ORDER:
+        try:
+            _CLASSES[name]()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_backend(name="auto"):
+    # A new decoder (simdjson's parser can't be shared between readers), "auto" falls back to the
+    # standard library when neither orjson nor simdjson is installed.
+    if name == "auto":
+        return _CLASSES[available()[0]]()
+    if name not in _CLASSES:
+        raise ValueError("Unknown JSON backend " + str(name) + ", expected one of " + ", ".join(BACKENDS))
+    try:
+        return _CLASSES[name]()
+    except ImportError:
+        raise ValueError("The " + name + " JSON backend is not installed, use: pip3 install " + PACKAGES[name])
@@ -0,0 +1,450 @@
+#!/bin/env python3
+# Incremental reader for the binary (CBOR) ledger-state, the node's own serialization of the
+# NewEpochState, which is much smaller than the JSON dump and faster to produce.
+#
+# The file is memory-mapped and decoded in place. The reader follows the positional layout of the
+# ledger's encoding down to the parts the raffles need and only decodes those: the pool stake
+# distribution, the pool parameters, the "set" stake snapshot and the UTxO map. Everything else is
+# skipped over. The result is the same LedgerExtract the JSON reader (ledgerreader.py) returns.
+#
+#   NewEpochState  [epoch, blocks before, blocks current, EpochState, reward update, PoolDistr, ...]
+#   EpochState     [account state, LedgerState, SnapShots, non myopic]
+#   LedgerState    [CertState, UTxOState]
+#   CertState      [DState, PState] (Babbage) or [VState, PState, DState] (Conway), PState is [pool params, ...]
+#   UTxOState      [utxo, deposited, fees, ...]
+#   SnapShots      [mark, set, go, fee], every SnapShot being [stake, delegations, pool params]
+#   PoolDistr      {pool id: [stake fraction, vrf]}, or [that map, total active stake] on newer nodes
+import bisect
+import mmap
+from array import array
+
+import ledgerreader
+import phasemetrics
+
+FORMATS = ("auto", "json", "cbor")
+
+NES_EPOCH = 0
+NES_EPOCH_STATE = 3
+NES_POOL_DISTR = 5
+ES_LEDGER_STATE = 1
+ES_SNAPSHOTS = 2
+LS_CERT_STATE = 0
+LS_UTXO_STATE = 1
+CERT_PSTATE = 1
+PSTATE_POOL_PARAMS = 0
+UTXO_STATE_UTXO = 0
+SNAPSHOTS_SET = 1
+SNAPSHOT_STAKE = 0
+SNAPSHOT_DELEGATIONS = 1
+POOL_PARAMS_REWARD_ACCOUNT = 5
+POOL_PARAMS_OWNERS = 6
+TXOUT_ADDRESS = 0
+TXOUT_VALUE = 1
+KEY_HASH_CREDENTIAL = 0
+
+_BREAK = 0xff
+# UTxO entries located per bulk step, bounds the memory used for their offsets
+UTXO_WINDOW = 1 << 16
+
+
+def detect_format(ledger_path):
+    # A JSON ledger starts with '{' (possibly after whitespace), a CBOR one with an array header.
+    with open(ledger_path, "rb") as ledger_file:
+        head = ledger_file.read(64).lstrip()
+    return "json" if head[:1] in (b"{", b"[", b"") else "cbor"
+
+
+class CborReader:
+    # Decodes CBOR items from a buffer (bytes, mmap) one at a time, pos is the offset of the next item.
+    def __init__(self, buf, pos=0):
+        self.buf = buf
+        self.pos = pos
+
+    def head(self):
+        # Returns (major type, argument) and moves past the item's header. The argument is the
+        # length of strings/arrays/maps, None for indefinite lengths.
+        buf = self.buf
+        initial = buf[self.pos]
+        self.pos += 1
+        major = initial >> 5
+        info = initial & 0x1f
+        if info < 24:
+            return major, info
+        if info == 31:
+            return major, None
+        if info > 27:
+            raise ValueError("Invalid CBOR item at offset " + str(self.pos - 1))
+        size = 1 << (info - 24)
+        arg = int.from_bytes(buf[self.pos:self.pos + size], "big")
+        self.pos += size
+        return major, arg
+
+    def at_break(self):
+        if self.buf[self.pos] == _BREAK:
+            self.pos += 1
+            return True
+        return False
+
+    def _items(self, count):
+        # yields once per item, the caller reads or skips it (map entries are two items)
+        if count is None:
+            while not self.at_break():
+                yield
+        else:
+            for _ in range(count):
+                yield
+
+    def skip(self, count=1, starts=None, stride=1):
+        # Skips the next count items. Iterative rather than recursive: nested items only add to the
+        # number of items left, which keeps skipping the UTxO map cheap. With a starts array, the
+        # offset of every stride-th item (every entry of a map with stride 2) and the end offset are
+        # appended to it: the items left only drop to a multiple of stride between entries.
+        buf = self.buf
+        pos = self.pos
+        boundary = -1
+        if starts is not None:
+            starts.append(pos)
+            boundary = count - stride
+        while count:
+            if count == boundary:
+                starts.append(pos)
+                boundary -= stride
+            count -= 1
+            initial = buf[pos]
+            pos += 1
+            if initial < 0x58:
+                # integers and short byte strings, the bulk of the ledger
+                if initial >= 0x40:
+                    pos += initial - 0x40
+                elif initial & 0x1f >= 24:
+                    info = initial & 0x1f
+                    if info > 27:
+                        # integers have no indefinite length and 28-30 are reserved
+                        raise ValueError("Invalid CBOR item at offset " + str(pos - 1))
+                    pos += 1 << (info - 24)
+                continue
+            info = initial & 0x1f
+            if info < 24:
+                arg = info
+            elif info < 28:
+                size = 1 << (info - 24)
+                arg = int.from_bytes(buf[pos:pos + size], "big")
+                pos += size
+            elif info == 31:
+                self.pos = pos - 1
+                self._skip_indefinite()
+                pos = self.pos
+                continue
+            else:
+                raise ValueError("Invalid CBOR item at offset " + str(pos - 1))
+            major = initial >> 5
+            if major == 2 or major == 3:
+                pos += arg
+            elif major == 4:
+                count += arg
+            elif major == 5:
+                count += 2 * arg
+            elif major == 6:
+                count += 1
+        if starts is not None and boundary == 0:
+            starts.append(pos)
+        self.pos = pos
+
+    def _skip_indefinite(self):
+        # indefinite length strings, arrays and maps end with a break, each part being an item
+        self.head()
+        while not self.at_break():
+            self.skip()
+
+    def read_raw(self):
+        start = self.pos
+        self.skip()
+        return self.buf[start:self.pos]
+
+    def read(self):
+        # Fully decodes the next item. Maps become dicts (with list keys turned into tuples), tags
+        # are dropped in favour of their content.
+        major, arg = self.head()
+        if major == 0:
+            return arg
+        if major == 1:
+            return -1 - arg
+        if major in (2, 3):
+            if arg is None:
+                chunks = []
+                while not self.at_break():
+                    chunks.append(self.read())
+                value = b"".join(chunks) if major == 2 else "".join(chunks)
+            else:
+                value = bytes(self.buf[self.pos:self.pos + arg])
+                self.pos += arg
+                if major == 3:
+                    value = value.decode("utf-8")
+            return value
+        if major == 4:
+            return [self.read() for _ in self._items(arg)]
+        if major == 5:
+            value = {}
+            for _ in self._items(arg):
+                key = self.read()
+                value[tuple(key) if isinstance(key, list) else key] = self.read()
+            return value
+        if major == 6:
+            return self.read()
+        if arg == 20:
+            return False
+        if arg == 21:
+            return True
+        if arg in (22, 23):
+            return None
+        # floats: the ledger doesn't use them in the parts read here
+        return arg
+
+    def array(self):
+        # reads an array header, returns its length (None if indefinite)
+        major, arg = self.head()
+        if major != 4:
+            raise ValueError("Expected a CBOR array at offset " + str(self.pos))
+        return arg
+
+    def map(self):
+        major, arg = self.head()
+        if major != 5:
+            raise ValueError("Expected a CBOR map at offset " + str(self.pos))
+        return arg
+
+    def iter_array(self):
+        return self._items(self.array())
+
+    def iter_map(self):
+        return self._items(self.map())
+
+    def enter(self, index):
+        # Moves into the array at pos, to its index-th item. Returns the array's length for leave().
+        count = self.array()
+        self.skip(index)
+        return count
+
+    def leave(self, count, index):
+        # Once item index of an array entered with enter() has been read, skips the rest of it.
+        if count is None:
+            while not self.at_break():
+                self.skip()
+        else:
+            self.skip(count - index - 1)
+
+    def skip_tag(self):
+        if self.buf[self.pos] >> 5 == 6:
+            self.head()
+
+
+def _credential_key_hash(credential):
+    # [0, key hash] or [1, script hash], only key hashes count as delegators, like in the JSON reader
+    if credential[0] == KEY_HASH_CREDENTIAL:
+        return credential[1].hex()
+    return None
+
+
+class _CborLedger:
+    def __init__(self, extract, buf, metrics):
+        self.extract = extract
+        self.reader = CborReader(buf)
+        self.metrics = metrics
+
+    def new_epoch_state(self):
+        # The NewEpochState may be wrapped with its era, as [era index, state].
+        reader = self.reader
+        while True:
+            start = reader.pos
+            count = reader.array()
+            first = reader.buf[reader.pos]
+            if count == 2 and first < 0x18 and reader.buf[reader.pos + 1] >> 5 == 4:
+                reader.head()
+                continue
+            reader.pos = start
+            return
+
+    def read(self):
+        reader = self.reader
+        extract = self.extract
+        self.new_epoch_state()
+        reader.array()
+        for index in range(NES_POOL_DISTR + 1):
+            if index == NES_EPOCH:
+                extract.epoch = reader.read()
+            elif index == NES_EPOCH_STATE:
+                self.epoch_state()
+            elif index == NES_POOL_DISTR and extract.wants_pools():
+                self.pool_distr()
+            else:
+                reader.skip()
+
+    def epoch_state(self):
+        reader = self.reader
+        count = reader.array()
+        for index in range(count):
+            if index == ES_LEDGER_STATE:
+                self.ledger_state()
+            elif index == ES_SNAPSHOTS and self.extract.wants_pools():
+                self.snapshots()
+            else:
+                reader.skip()
+
+    def ledger_state(self):
+        reader = self.reader
+        count = reader.array()
+        for index in range(count):
+            if index == LS_CERT_STATE and self.extract.wants_pools():
+                cert_state = reader.enter(CERT_PSTATE)
+                pstate = reader.enter(PSTATE_POOL_PARAMS)
+                self.pool_params()
+                reader.leave(pstate, PSTATE_POOL_PARAMS)
+                reader.leave(cert_state, CERT_PSTATE)
+            elif index == LS_UTXO_STATE and self.extract.wants_policies():
+                utxo_state = reader.enter(UTXO_STATE_UTXO)
+                utxo_start = reader.pos
+                with self.metrics.phase("utxo_scan"):
+                    self.utxo()
+                self.metrics.count("utxo_bytes_scanned", reader.pos - utxo_start)
+                reader.leave(utxo_state, UTXO_STATE_UTXO)
+            else:
+                reader.skip()
+
+    def pool_params(self):
+        reader = self.reader
+        for _ in reader.iter_map():
+            pool = self.extract.pool(reader.read().hex())
+            if pool is None:
+                reader.skip()
+                continue
+            params = reader.read()
+            reward_account = params[POOL_PARAMS_REWARD_ACCOUNT]
+            pool.reward_account = reward_account[1:].hex()
+            pool.owners = [owner.hex() for owner in params[POOL_PARAMS_OWNERS]]
+
+    def snapshots(self):
+        reader = self.reader
+        snapshots = reader.enter(SNAPSHOTS_SET)
+        snapshot_start = reader.pos
+        # delegations come after the stake map, read them first to know whose stake to keep
+        snapshot = reader.enter(SNAPSHOT_DELEGATIONS)
+        with self.metrics.phase("delegation_join"):
+            delegator_pools = self.delegations()
+        delegations_end = reader.pos
+        reader.pos = snapshot_start
+        reader.enter(SNAPSHOT_STAKE)
+        with self.metrics.phase("stake_aggregation"):
+            self.stake(delegator_pools)
+        reader.pos = delegations_end
+        reader.leave(snapshot, SNAPSHOT_DELEGATIONS)
+        reader.leave(snapshots, SNAPSHOTS_SET)
+
+    def delegations(self):
+        reader = self.reader
+        delegator_pools = {}
+        for _ in reader.iter_map():
+            self.metrics.count("delegations_seen")
+            delegator = _credential_key_hash(reader.read())
+            pool = self.extract.pool(reader.read().hex())
+            if pool is not None and delegator is not None:
+                pool.delegators.append(delegator)
+                delegator_pools[delegator] = pool
+                self.metrics.count("delegators_seen")
+        return delegator_pools
+
+    def stake(self, delegator_pools):
+        reader = self.reader
+        for _ in reader.iter_map():
+            self.metrics.count("stake_entries_seen")
+            delegator = _credential_key_hash(reader.read())
+            pool = delegator_pools.get(delegator)
+            if pool is None:
+                reader.skip()
+                continue
+            pool.stake[delegator] = pool.stake.get(delegator, 0) + reader.read()
+
+    def pool_distr(self):
+        reader = self.reader
+        if reader.buf[reader.pos] >> 5 == 4:
+            # [distribution, total active stake]
+            reader.array()
+        for _ in reader.iter_map():
+            pool = self.extract.pool(reader.read().hex())
+            if pool is None:
+                reader.skip()
+                continue
+            # [stake fraction, vrf key hash], newer nodes add the pool's absolute stake in between
+            items = reader.iter_array()
+            next(items)
+            reader.skip_tag()
+            # the JSON dump's individualPoolStake numerator
+            pool.recorded_stake = reader.read()[0]
+            for _ in items:
+                reader.skip()
+
+    def utxo(self):
+        # Unless every policy is wanted, the map is processed in bulk: a window of entries is skipped
+        # in one go while recording where each entry starts, the requested policy ids are looked up
+        # in that window with plain substring searches and only the entries containing them are
+        # decoded.
+        reader = self.reader
+        entries = reader.map()
+        if entries is None or self.extract.all_policies:
+            for _ in reader._items(entries):
+                self.metrics.count("utxos_scanned")
+                reader.skip()
+                self._add_txout(reader.read())
+            return
+        buf = reader.buf
+        needles = [bytes.fromhex(policy_id) for policy_id in self.extract.policies]
+        while entries:
+            window = min(entries, UTXO_WINDOW)
+            entries -= window
+            starts = array("q")
+            reader.skip(2 * window, starts, 2)
+            self.metrics.count("utxos_scanned", window)
+            hit_entries = set()
+            for needle in needles:
+                hit = buf.find(needle, starts[0], starts[-1])
+                while hit != -1:
+                    hit_entries.add(bisect.bisect_right(starts, hit) - 1)
+                    hit = buf.find(needle, hit + len(needle), starts[-1])
+            for entry in sorted(hit_entries):
+                entry_reader = CborReader(buf, starts[entry])
+                entry_reader.skip()
+                self._add_txout(entry_reader.read())
+
+    def _add_txout(self, txout):
+        policies = self.extract.policies
+        all_policies = self.extract.all_policies
+        address, multi_asset = _txout_assets(txout)
+        if multi_asset is None:
+            return
+        for policy_id, assets in multi_asset.items():
+            policy_id = policy_id.hex()
+            if all_policies or policy_id in policies:
+                holders = policies.setdefault(policy_id, {})
+                holders[address] = holders.get(address, 0) + sum(assets.values())
+
+
+def _txout_assets(txout):
+    # (hex address, {policy id: {asset name: quantity}} or None) of a legacy (array) or
+    # post-Alonzo (map) transaction output
+    address = txout[TXOUT_ADDRESS]
+    value = txout[TXOUT_VALUE]
+    if isinstance(value, int):
+        return address.hex(), None
+    return address.hex(), value[1]
+
+
+def read_ledger(ledger_path, pool_ids=(), policy_ids=(), workers=1, metrics=None):
+    # Same result as ledgerreader.read_ledger for a CBOR ledger-state. The file is decoded in a
+    # single process, workers is accepted for compatibility.
+    extract = ledgerreader.LedgerExtract(pool_ids, policy_ids)
+    metrics = metrics if metrics is not None else phasemetrics.Metrics()
+    with open(ledger_path, "rb") as ledger_file, \
+            mmap.mmap(ledger_file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        _CborLedger(extract, buf, metrics).read()
+        metrics.set("ledger_bytes", len(buf))
+    metrics.count("token_holders", sum(len(holders) for holders in extract.policies.values()))
+    return extract
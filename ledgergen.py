@@ -0,0 +1,408 @@
+#!/bin/env python3
+# Synthetic ledger-state generator, for benchmarking without a multi-GB mainnet download.
+#
+# Writes the parts of the ledger-state the raffles read, in the same layout as the real files: the
+# pstakeSet delegations/stake pairs (plus mark and go snapshots of the same size to skip over),
+# "pParams pState", stakeDistrib and the utxoState.utxo map with multi-asset policies. JSON follows
+# the cardano-cli dump read by ledgerreader.py, CBOR the NewEpochState read by ledgercbor.py.
+#
+# Everything is derived from the seed, the same options always give the same file. Pools get a
+# skewed share of the delegators, policies a skewed share of the token-carrying UTxOs, so a few
+# pools and policies are much bigger than the rest, as on mainnet. Base addresses share the stake
+# keys of the delegators, several addresses per key. A manifest (<ledger>.manifest.json) records
+# the options, the biggest pool and the most held policy.
+import argparse
+import bisect
+import hashlib
+import itertools
+import json
+import math
+import random
+from array import array
+
+# roughly mainnet sized
+DEFAULTS = {
+    "pools": 3000,
+    "delegators": 1300000,
+    "utxos": 11000000,
+    "addresses": 4000000,
+    "holders": 1000000,
+    "policies": 50000,
+    "token_share": 0.4,
+    "epoch": 400,
+    "seed": 1,
+}
+# one delegation in SCRIPT_EVERY is a script credential, one address in ENTERPRISE_EVERY has no stake key
+SCRIPT_EVERY = 200
+ENTERPRISE_EVERY = 10
+MAX_POLICIES_PER_UTXO = 3
+WRITE_CHUNK = 1 << 20
+million = 1000000
+
+
+def scaled(delegators, seed=1):
+    # Options for a ledger of the given number of delegators, with mainnet's proportions.
+    return {
+        "pools": max(5, delegators // 430),
+        "delegators": delegators,
+        "utxos": delegators * 8,
+        "addresses": delegators * 3,
+        "holders": max(1, delegators * 3 // 4),
+        "policies": max(3, delegators // 26),
+        "token_share": DEFAULTS["token_share"],
+        "epoch": DEFAULTS["epoch"],
+        "seed": seed,
+    }
+
+
+def _hash(tag, i, size=28):
+    return hashlib.blake2b(tag + i.to_bytes(8, "little"), digest_size=size).digest()
+
+
+def _skewed_cumulative(count, rng, alpha=1.2):
+    # cumulative Pareto weights, bisected to pick pools/policies with a long tail
+    weights = [rng.paretovariate(alpha) for _ in range(count)]
+    weights.sort(reverse=True)
+    return list(itertools.accumulate(weights))
+
+
+class LedgerModel:
+    # The content of the synthetic ledger. Only the per-delegator pool and stake are kept in
+    # memory, hashes, UTxOs and their tokens are recomputed from the seed whenever they are written.
+    def __init__(self, pools, delegators, utxos, addresses, holders, policies, token_share, epoch, seed):
+        if delegators and not pools:
+            raise ValueError("Delegators need at least one pool to delegate to")
+        self.n_pools = pools
+        self.n_delegators = delegators
+        self.n_utxos = utxos
+        self.n_addresses = max(addresses, 1)
+        self.n_holders = max(1, min(holders, self.n_addresses))
+        self.n_policies = policies
+        self.token_share = token_share
+        self.epoch = epoch
+        self.seed = seed
+        rng = random.Random(seed)
+        pool_weights = _skewed_cumulative(pools, rng)
+        self.policy_weights = _skewed_cumulative(policies, rng) if policies else []
+        self.delegator_pools = array("I")
+        self.stakes = array("q")
+        total_weight = pool_weights[-1] if pool_weights else 0
+        for _ in range(delegators):
+            self.delegator_pools.append(bisect.bisect_left(pool_weights, rng.random() * total_weight))
+            # a few hundred ADA for most, whales in the tail
+            self.stakes.append(min(int(rng.lognormvariate(math.log(800 * million), 2.0)), 10 ** 16))
+        self.pool_stake = [0] * pools
+        self.pool_delegators = [0] * pools
+        self.pool_owner = [None] * pools
+        for i, (pool, stake) in enumerate(zip(self.delegator_pools, self.stakes)):
+            if self.is_script(i):
+                continue
+            self.pool_delegators[pool] += 1
+            self.pool_stake[pool] += stake
+            if self.pool_owner[pool] is None:
+                # the owner pledges, i.e. delegates to its own pool
+                self.pool_owner[pool] = i
+
+    def is_script(self, i):
+        return i % SCRIPT_EVERY == SCRIPT_EVERY - 1
+
+    def pool_id(self, pool):
+        return _hash(b"pool", pool)
+
+    def delegator(self, i):
+        return _hash(b"stake", i)
+
+    def owner(self, pool):
+        owner = self.pool_owner[pool]
+        return self.delegator(owner) if owner is not None else _hash(b"owner", pool)
+
+    def reward_account(self, pool):
+        return _hash(b"reward", pool)
+
+    def vrf(self, pool):
+        return _hash(b"vrf", pool, 32)
+
+    def iter_delegations(self):
+        # (credential hash, is a script, pool index, lovelace)
+        for i, (pool, stake) in enumerate(zip(self.delegator_pools, self.stakes)):
+            yield self.delegator(i), self.is_script(i), pool, stake
+
+    def address(self, a):
+        payment = _hash(b"pay", a)
+        if a % ENTERPRISE_EVERY == ENTERPRISE_EVERY - 1 or not self.n_delegators:
+            return b"\x61" + payment
+        return b"\x01" + payment + self.delegator(a % self.n_delegators)
+
+    def iter_utxos(self):
+        # (tx id, output index, address, lovelace, {policy id: {asset name: quantity}})
+        rng = random.Random(self.seed * 7919 + 1)
+        total_weight = self.policy_weights[-1] if self.policy_weights else 0
+        for j in range(self.n_utxos):
+            coin = int(rng.lognormvariate(math.log(20 * million), 1.5)) + million
+            policies = {}
+            if total_weight and rng.random() < self.token_share:
+                address = self.address(rng.randrange(self.n_holders))
+                for _ in range(rng.randint(1, MAX_POLICIES_PER_UTXO)):
+                    policy = bisect.bisect_left(self.policy_weights, rng.random() * total_weight)
+                    if policy % 2 == 0:
+                        # NFT collection, one of a kind assets
+                        asset = b"NFT%d" % rng.randrange(10000)
+                        policies.setdefault(_hash(b"policy", policy), {})[asset] = 1
+                    else:
+                        policies.setdefault(_hash(b"policy", policy), {})[b"TOKEN"] = rng.randint(1, 10 ** 9)
+            else:
+                address = self.address(rng.randrange(self.n_addresses))
+            yield _hash(b"tx", j, 32), j % 3, address, coin, policies
+
+    def manifest(self):
+        biggest_pool = max(range(self.n_pools), key=lambda pool: self.pool_delegators[pool]) if self.n_pools else None
+        return {
+            "pools": self.n_pools,
+            "delegators": self.n_delegators,
+            "utxos": self.n_utxos,
+            "addresses": self.n_addresses,
+            "holders": self.n_holders,
+            "policies": self.n_policies,
+            "token_share": self.token_share,
+            "epoch": self.epoch,
+            "seed": self.seed,
+            "biggest_pool": self.pool_id(biggest_pool).hex() if biggest_pool is not None else None,
+            "biggest_pool_delegators": self.pool_delegators[biggest_pool] if biggest_pool is not None else 0,
+            # policies are ranked by weight, the first is the most held
+            "top_policy": _hash(b"policy", 0).hex() if self.n_policies else None,
+        }
+
+
+class _Writer:
+    # Buffers small writes into WRITE_CHUNK sized ones.
+    def __init__(self, out):
+        self.out = out
+        self.parts = []
+        self.size = 0
+
+    def write(self, part):
+        self.parts.append(part)
+        self.size += len(part)
+        if self.size >= WRITE_CHUNK:
+            self.flush()
+
+    def flush(self):
+        if not self.parts:
+            return
+        self.out.write(self.parts[0][:0].join(self.parts))
+        self.parts = []
+        self.size = 0
+
+
+def _json_list(writer, items):
+    writer.write("[")
+    for i, item in enumerate(items):
+        writer.write(item if i == 0 else ", " + item)
+    writer.write("]")
+
+
+def _json_snapshot(writer, model):
+    def credential(key_hash, is_script):
+        return ('{"script hash": "' if is_script else '{"key hash": "') + key_hash.hex() + '"}'
+
+    writer.write('{"stake": ')
+    _json_list(writer, ("[" + credential(key_hash, is_script) + ", " + str(stake) + "]"
+                        for key_hash, is_script, _, stake in model.iter_delegations()))
+    writer.write(', "delegations": ')
+    _json_list(writer, ("[" + credential(key_hash, is_script) + ', "' + model.pool_id(pool).hex() + '"]'
+                        for key_hash, is_script, pool, _ in model.iter_delegations()))
+    writer.write(', "poolParams": {}}')
+
+
+def _json_utxo(model):
+    for tx_id, index, address, coin, policies in model.iter_utxos():
+        value = '{"coin": ' + str(coin) + ', "policies": {' + ", ".join(
+            '"' + policy.hex() + '": {' + ", ".join('"' + asset.hex() + '": ' + str(quantity)
+                                                  for asset, quantity in assets.items()) + "}"
+            for policy, assets in policies.items()) + "}}"
+        yield '"' + tx_id.hex() + "#" + str(index) + '": {"address": "' + address.hex() + '", "amount": ' + value + "}"
+
+
+def write_json(model, out):
+    writer = _Writer(out)
+    writer.write('{"lastEpoch": ' + str(model.epoch) + ', "blocksBefore": {}, "blocksCurrent": {}, "stateBefore": {')
+    writer.write('"esAccountState": {"reserves": 0, "treasury": 0}, "esSnapshots": {')
+    for i, name in enumerate(("pstakeMark", "pstakeSet", "pstakeGo")):
+        writer.write((", " if i else "") + '"' + name + '": ')
+        _json_snapshot(writer, model)
+    writer.write(', "feeSS": 0}, "esLState": {"utxoState": {"utxo": {')
+    for i, entry in enumerate(_json_utxo(model)):
+        writer.write(entry if i == 0 else ", " + entry)
+    writer.write('}, "deposited": 0, "fees": 0, "ppups": {}}, "delegationState": {"dstate": {}, "pstate": {')
+    writer.write('"fPParams pState": {}, "pParams pState": {')
+    for pool in range(model.n_pools):
+        pool_id = model.pool_id(pool).hex()
+        writer.write((", " if pool else "") + '"' + pool_id + '": {"publicKey": "' + pool_id + '", "vrf": "'
+                     + model.vrf(pool).hex() + '", "pledge": 0, "cost": 340000000, "margin": 0.01, '
+                     + '"rewardAccount": {"network": "Mainnet", "credential": {"key hash": "'
+                     + model.reward_account(pool).hex() + '"}}, "owners": ["' + model.owner(pool).hex()
+                     + '"], "relays": [], "metadata": null}')
+    writer.write('}, "retiring pState": {}}}}, "esPrevPp": {}, "esPp": {}, "esNonMyopic": {}}, ')
+    writer.write('"possibleRewardUpdate": null, "stakeDistrib": {')
+    for pool in range(model.n_pools):
+        writer.write((", " if pool else "") + '"' + model.pool_id(pool).hex() + '": {"individualPoolStake": '
+                     + '{"numerator": ' + str(model.pool_stake[pool]) + ', "denominator": 1}, '
+                     + '"individualPoolStakeVrf": "' + model.vrf(pool).hex() + '"}')
+    writer.write("}}\n")
+    writer.flush()
+
+
+def _cbor_head(major, n):
+    if n < 24:
+        return bytes([major << 5 | n])
+    for info, size in ((24, 1), (25, 2), (26, 4), (27, 8)):
+        if n < 1 << (8 * size):
+            return bytes([major << 5 | info]) + n.to_bytes(size, "big")
+    raise ValueError("CBOR length too large: " + str(n))
+
+
+def _cbor_uint(n):
+    return _cbor_head(0, n)
+
+
+def _cbor_bytes(data):
+    return _cbor_head(2, len(data)) + data
+
+
+def _cbor_array(count):
+    return _cbor_head(4, count)
+
+
+def _cbor_map(count):
+    return _cbor_head(5, count)
+
+
+_CBOR_NULL = b"\xf6"
+_CBOR_EMPTY_MAP = _cbor_map(0)
+_CBOR_EMPTY_ARRAY = _cbor_array(0)
+
+
+def _cbor_rational(numerator, denominator):
+    return _cbor_head(6, 30) + _cbor_array(2) + _cbor_uint(numerator) + _cbor_uint(denominator)
+
+
+def _cbor_snapshot(writer, model):
+    # [stake, delegations, pool params]
+    writer.write(_cbor_array(3))
+    writer.write(_cbor_map(model.n_delegators))
+    for key_hash, is_script, _, stake in model.iter_delegations():
+        writer.write(_cbor_array(2) + _cbor_uint(1 if is_script else 0) + _cbor_bytes(key_hash) + _cbor_uint(stake))
+    writer.write(_cbor_map(model.n_delegators))
+    for key_hash, is_script, pool, _ in model.iter_delegations():
+        writer.write(_cbor_array(2) + _cbor_uint(1 if is_script else 0) + _cbor_bytes(key_hash)
+                     + _cbor_bytes(model.pool_id(pool)))
+    writer.write(_CBOR_EMPTY_MAP)
+
+
+def _cbor_txout(index, address, coin, policies):
+    if policies:
+        value = _cbor_array(2) + _cbor_uint(coin) + _cbor_map(len(policies)) + b"".join(
+            _cbor_bytes(policy) + _cbor_map(len(assets))
+            + b"".join(_cbor_bytes(asset) + _cbor_uint(quantity) for asset, quantity in assets.items())
+            for policy, assets in policies.items())
+    else:
+        value = _cbor_uint(coin)
+    # legacy array outputs and post-Alonzo map outputs, both occur in a real UTxO set
+    if index % 2:
+        return _cbor_map(2) + _cbor_uint(0) + _cbor_bytes(address) + _cbor_uint(1) + value
+    return _cbor_array(2) + _cbor_bytes(address) + value
+
+
+def write_cbor(model, out):
+    # Babbage NewEpochState, see the layout at the top of ledgercbor.py
+    writer = _Writer(out)
+    writer.write(_cbor_array(7) + _cbor_uint(model.epoch) + _CBOR_EMPTY_MAP + _CBOR_EMPTY_MAP)
+    # EpochState [account state, LedgerState, SnapShots, non myopic]
+    writer.write(_cbor_array(4) + _cbor_array(2) + _cbor_uint(0) + _cbor_uint(0))
+    # LedgerState [CertState [DState, PState], UTxOState]
+    writer.write(_cbor_array(2) + _cbor_array(2) + _CBOR_EMPTY_ARRAY + _cbor_array(4) + _cbor_map(model.n_pools))
+    for pool in range(model.n_pools):
+        pool_id = model.pool_id(pool)
+        writer.write(_cbor_bytes(pool_id) + _cbor_array(9) + _cbor_bytes(pool_id) + _cbor_bytes(model.vrf(pool))
+                     + _cbor_uint(0) + _cbor_uint(340000000) + _cbor_rational(1, 100)
+                     + _cbor_bytes(b"\xe1" + model.reward_account(pool))
+                     + _cbor_head(6, 258) + _cbor_array(1) + _cbor_bytes(model.owner(pool))
+                     + _CBOR_EMPTY_ARRAY + _CBOR_NULL)
+    writer.write(_CBOR_EMPTY_MAP * 3)
+    # UTxOState [utxo, deposited, fees, ppups, stake distribution, donation]
+    writer.write(_cbor_array(6) + _cbor_map(model.n_utxos))
+    for tx_id, index, address, coin, policies in model.iter_utxos():
+        writer.write(_cbor_array(2) + _cbor_bytes(tx_id) + _cbor_uint(index)
+                     + _cbor_txout(index, address, coin, policies))
+    writer.write(_cbor_uint(0) + _cbor_uint(0) + _CBOR_EMPTY_ARRAY + _CBOR_EMPTY_MAP + _cbor_uint(0))
+    # SnapShots [mark, set, go, fees]
+    writer.write(_cbor_array(4))
+    for _ in range(3):
+        _cbor_snapshot(writer, model)
+    writer.write(_cbor_uint(0) + _CBOR_EMPTY_ARRAY)
+    # reward update, PoolDistr, stashed AVVM addresses
+    writer.write(_CBOR_NULL + _cbor_map(model.n_pools))
+    for pool in range(model.n_pools):
+        writer.write(_cbor_bytes(model.pool_id(pool)) + _cbor_array(2)
+                     + _cbor_rational(model.pool_stake[pool], 1) + _cbor_bytes(model.vrf(pool)))
+    writer.write(_CBOR_NULL)
+    writer.flush()
+
+
+def manifest_path(ledger_path):
+    return ledger_path + ".manifest.json"
+
+
+def generate(out_path, ledger_format="json", **options):
+    # Writes a synthetic ledger-state and its manifest, returns the manifest. options default to
+    # DEFAULTS.
+    settings = dict(DEFAULTS)
+    settings.update(options)
+    model = LedgerModel(**settings)
+    if ledger_format == "cbor":
+        with open(out_path, "wb") as out:
+            write_cbor(model, out)
+    else:
+        with open(out_path, "w") as out:
+            write_json(model, out)
+    manifest = model.manifest()
+    manifest["format"] = ledger_format
+    with open(manifest_path(out_path), "w") as out:
+        json.dump(manifest, out, indent=2)
+        out.write("\n")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic ledger-state file for benchmarking.")
+    parser.add_argument('-o', "--out", dest="out", default="synthetic-ledger.json", help="the file to write")
+    parser.add_argument("--format", dest="ledger_format", choices=("json", "cbor"), default="json",
+                        help="JSON like cardano-cli's dump or the binary CBOR ledger-state (default: json)")
+    parser.add_argument("--scale", type=int,
+                        help="if specified, sets every count from this number of delegators, with mainnet's "
+                             + "proportions (the other count options are ignored)")
+    for name, help_text in (("pools", "number of pools"), ("delegators", "number of delegators"),
+                            ("utxos", "number of UTxO entries"),
+                            ("addresses", "number of distinct addresses the UTxOs are spread over"),
+                            ("holders", "number of distinct addresses holding tokens"),
+                            ("policies", "number of token policies")):
+        parser.add_argument("--" + name, dest=name, type=int, default=DEFAULTS[name],
+                            help=help_text + " (default: " + str(DEFAULTS[name]) + ")")
+    parser.add_argument("--token-share", dest="token_share", type=float, default=DEFAULTS["token_share"],
+                        help="share of the UTxOs carrying tokens (default: " + str(DEFAULTS["token_share"]) + ")")
+    parser.add_argument("--epoch", type=int, default=DEFAULTS["epoch"], help="the ledger's epoch")
+    parser.add_argument("--seed", type=int, default=DEFAULTS["seed"], help="the random seed (default: 1)")
+    args = parser.parse_args()
+
+    if args.scale is not None:
+        ledger_options = scaled(args.scale, args.seed)
+        ledger_options["epoch"] = args.epoch
+    else:
+        ledger_options = {name: getattr(args, name) for name in DEFAULTS}
+    try:
+        written = generate(args.out, args.ledger_format, **ledger_options)
+    except ValueError as error:
+        print(error)
+        exit()
+    print("Ledger written to " + args.out + ", biggest pool " + str(written["biggest_pool"]) + " ("
+          + str(written["biggest_pool_delegators"]) + " delegators), most held policy " + str(written["top_policy"]))
@@ -0,0 +1,307 @@
+#!/bin/env python3
+# Precomputed per-epoch index of a ledger-state file.
+#
+# Building the index streams the ledger (JSON or CBOR) once and writes a compact binary file next to it holding,
+# for every pool, its delegators with their stake, owners and reward account, and for every policy
+# its (address, quantity) postings. Later runs memory-map that file and answer a pool or policy
+# lookup with a couple of binary searches, without parsing any JSON.
+#
+# Layout (little endian, sections padded to 8 bytes):
+#   header    magic, version, epoch, ledger hash, ledger size and mtime, section counts
+#   pools     sorted 28-byte pool ids
+#   pool rows (delegator start, delegator end, owner start, owner end, recorded stake or -1)
+#   rewards   28-byte reward account key hash per pool (zeroes if unknown)
+#   delegs    28-byte stake key hashes, grouped per pool
+#   stake     signed 64-bit lovelace per delegator, -1 if the key has no stake in the snapshot
+#   owners    28-byte owner key hashes, grouped per pool
+#   policies  sorted 28-byte policy ids
+#   pol rows  (posting start, posting end)
+#   addr offs posting address offsets into the address blob, one extra closing offset
+#   qty       unsigned 64-bit quantity per posting, all ones if it is in the big qty section
+#   big qty   (posting, low 64 bits, high 64 bits) of the quantities that don't fit in 64 bits
+#   addresses raw address bytes
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+from array import array
+
+import jsonbackend
+import ledgercbor
+import ledgerreader
+
+MAGIC = b"CTLIDX01"
+VERSION = 3
+HASH_SIZE = 28
+HASH_CHUNK = 1 << 20
+
+_HEADER = struct.Struct("<8sIq32sQq7Q")
+_POOL_ROW = struct.Struct("<QQQQq")
+_POLICY_ROW = struct.Struct("<QQ")
+_BIG_ROW = struct.Struct("<QQQ")
+_BIG_QUANTITY = (1 << 64) - 1
+_NO_HASH = bytes(HASH_SIZE)
+
+
+def ledger_hash(ledger_path):
+    # blake2b of the whole ledger file, the key the index is built for.
+    digest = hashlib.blake2b(digest_size=32)
+    with open(ledger_path, "rb") as ledger_file:
+        for chunk in iter(lambda: ledger_file.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def ledger_stat(ledger_path):
+    stat = os.stat(ledger_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def index_path(ledger_path):
+    return ledger_path + ".idx"
+
+
+def _pad(blob):
+    return blob + bytes(-len(blob) % 8)
+
+
+def _hash_bytes(hex_hash):
+    return bytes.fromhex(hex_hash) if hex_hash else _NO_HASH
+
+
+def read_ledger_file(ledger_path, pool_ids=(), policy_ids=(), workers=1, metrics=None, ledger_format="auto",
+                     json_backend="auto"):
+    # Reads the ledger-state file itself, with the JSON or the CBOR reader. ledger_format is one of
+    # ledgercbor.FORMATS, "auto" looks at the start of the file. json_backend (one of
+    # jsonbackend.BACKENDS) decodes the values the JSON reader keeps.
+    if ledger_format == "auto":
+        ledger_format = ledgercbor.detect_format(ledger_path)
+    if metrics is not None:
+        metrics.set("ledger_source", ledger_format)
+    if ledger_format == "cbor":
+        return ledgercbor.read_ledger(ledger_path, pool_ids, policy_ids, workers, metrics)
+    return ledgerreader.read_ledger(ledger_path, pool_ids, policy_ids, workers, metrics, json_backend)
+
+
+def build_index(ledger_path, out_path=None, workers=1, ledger_format="auto", json_backend="auto"):
+    # The index records the hash of the file it was built from, along with its size and mtime. A
+    # ledger that changes while it is being read raises ValueError.
+    stat = ledger_stat(ledger_path)
+    file_hash = ledger_hash(ledger_path)
+    extract = read_ledger_file(ledger_path, pool_ids=ledgerreader.ALL, policy_ids=ledgerreader.ALL, workers=workers,
+                               ledger_format=ledger_format, json_backend=json_backend)
+    if ledger_stat(ledger_path) != stat:
+        raise ValueError(ledger_path + " changed while it was being indexed")
+    return write_index(extract, file_hash, stat, out_path or index_path(ledger_path))
+
+
+def write_index(extract, file_hash, stat, out_path):
+    pool_ids = sorted(extract.pools)
+    pool_rows = bytearray()
+    rewards = bytearray()
+    delegs = bytearray()
+    stake = array("q")
+    owners = bytearray()
+    for pool_id in pool_ids:
+        pool = extract.pools[pool_id]
+        deleg_start = len(stake)
+        for delegator in pool.delegators:
+            delegs += bytes.fromhex(delegator)
+            stake.append(pool.stake.get(delegator, -1))
+        owner_start = len(owners) // HASH_SIZE
+        for owner in pool.owners:
+            owners += bytes.fromhex(owner)
+        recorded_stake = -1 if pool.recorded_stake is None else pool.recorded_stake
+        pool_rows += _POOL_ROW.pack(deleg_start, len(stake), owner_start, len(owners) // HASH_SIZE, recorded_stake)
+        rewards += _hash_bytes(pool.reward_account)
+
+    policy_ids = sorted(extract.policies)
+    policy_rows = bytearray()
+    addr_offsets = array("Q", [0])
+    quantities = array("Q")
+    big_rows = bytearray()
+    addresses = bytearray()
+    for policy_id in policy_ids:
+        posting_start = len(quantities)
+        for address, quantity in extract.policies[policy_id].items():
+            addresses += bytes.fromhex(address)
+            addr_offsets.append(len(addresses))
+            if quantity >= _BIG_QUANTITY:
+                # an address holding several UTxOs can add up to more than a single one can carry
+                if quantity >> 128:
+                    raise ValueError("Policy " + policy_id + ": " + str(quantity) + " tokens held by " + address
+                                     + " do not fit in the index")
+                big_rows += _BIG_ROW.pack(len(quantities), quantity & _BIG_QUANTITY, quantity >> 64)
+                quantity = _BIG_QUANTITY
+            quantities.append(quantity)
+        policy_rows += _POLICY_ROW.pack(posting_start, len(quantities))
+
+    header = _HEADER.pack(MAGIC, VERSION, extract.epoch or 0, file_hash, stat[0], stat[1], len(pool_ids),
+                          len(stake), len(owners) // HASH_SIZE, len(policy_ids), len(quantities),
+                          len(big_rows) // _BIG_ROW.size, len(addresses))
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as out:
+        for section in (header, b"".join(bytes.fromhex(p) for p in pool_ids), pool_rows, rewards, delegs,
+                        stake.tobytes(), owners, b"".join(bytes.fromhex(p) for p in policy_ids), policy_rows,
+                        addr_offsets.tobytes(), quantities.tobytes(), big_rows, addresses):
+            out.write(_pad(bytes(section)))
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+class LedgerIndex:
+    def __init__(self, path):
+        with open(path, "rb") as index_file:
+            self.mm = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.epoch, self.ledger_hash, ledger_size, ledger_mtime_ns, self.n_pools, n_delegs, n_owners,
+         self.n_policies, n_postings, n_big, n_address_bytes) = _HEADER.unpack_from(self.mm, 0)
+        self.ledger_stat = (ledger_size, ledger_mtime_ns)
+        if magic != MAGIC or version != VERSION:
+            self.mm.close()
+            raise ValueError(path + " is not a ledger index this version can read")
+        sizes = [
+            self.n_pools * HASH_SIZE, self.n_pools * _POOL_ROW.size, self.n_pools * HASH_SIZE,
+            n_delegs * HASH_SIZE, n_delegs * 8, n_owners * HASH_SIZE,
+            self.n_policies * HASH_SIZE, self.n_policies * _POLICY_ROW.size,
+            (n_postings + 1) * 8, n_postings * 8, n_big * _BIG_ROW.size, n_address_bytes,
+        ]
+        offsets = []
+        offset = _HEADER.size + (-_HEADER.size % 8)
+        for size in sizes:
+            offsets.append(offset)
+            offset += size + (-size % 8)
+        (self._pools, self._pool_rows, self._rewards, self._delegs, self._stake, self._owners, self._policies,
+         self._policy_rows, self._addr_offsets, self._quantities, big_rows, self._addresses) = offsets
+        self._big_quantities = {posting: high << 64 | low for posting, low, high
+                                in _BIG_ROW.iter_unpack(self.mm[big_rows:big_rows + n_big * _BIG_ROW.size])}
+
+    def close(self):
+        self.mm.close()
+
+    def _hash_at(self, section, i):
+        start = section + i * HASH_SIZE
+        return self.mm[start:start + HASH_SIZE]
+
+    def _find(self, section, count, hex_id):
+        try:
+            wanted = bytes.fromhex(hex_id)
+        except ValueError:
+            return None
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._hash_at(section, mid) < wanted:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < count and self._hash_at(section, lo) == wanted:
+            return lo
+        return None
+
+    def _int64s(self, section, start, end, typecode):
+        values = array(typecode)
+        values.frombytes(self.mm[section + start * 8:section + end * 8])
+        return values
+
+    def pool(self, pool_id):
+        pool = ledgerreader.PoolExtract(pool_id)
+        i = self._find(self._pools, self.n_pools, pool_id)
+        if i is None:
+            return pool
+        deleg_start, deleg_end, owner_start, owner_end, recorded_stake = \
+            _POOL_ROW.unpack_from(self.mm, self._pool_rows + i * _POOL_ROW.size)
+        pool.recorded_stake = None if recorded_stake < 0 else recorded_stake
+        reward_account = self._hash_at(self._rewards, i)
+        pool.reward_account = None if reward_account == _NO_HASH else reward_account.hex()
+        pool.owners = [self._hash_at(self._owners, j).hex() for j in range(owner_start, owner_end)]
+        stakes = self._int64s(self._stake, deleg_start, deleg_end, "q")
+        delegs = self.mm[self._delegs + deleg_start * HASH_SIZE:self._delegs + deleg_end * HASH_SIZE]
+        for j, amount in enumerate(stakes):
+            delegator = delegs[j * HASH_SIZE:(j + 1) * HASH_SIZE].hex()
+            pool.delegators.append(delegator)
+            if amount >= 0:
+                pool.stake[delegator] = amount
+        return pool
+
+    def policy(self, policy_id):
+        holders = {}
+        i = self._find(self._policies, self.n_policies, policy_id)
+        if i is None:
+            return holders
+        start, end = _POLICY_ROW.unpack_from(self.mm, self._policy_rows + i * _POLICY_ROW.size)
+        offsets = self._int64s(self._addr_offsets, start, end + 1, "Q")
+        quantities = self._int64s(self._quantities, start, end, "Q")
+        blob = self.mm[self._addresses + offsets[0]:self._addresses + offsets[-1]]
+        base = offsets[0]
+        for j, quantity in enumerate(quantities):
+            if quantity == _BIG_QUANTITY:
+                quantity = self._big_quantities[start + j]
+            holders[blob[offsets[j] - base:offsets[j + 1] - base].hex()] = quantity
+        return holders
+
+    def extract(self, pool_ids=(), policy_ids=()):
+        extract = ledgerreader.LedgerExtract()
+        extract.epoch = self.epoch
+        for pool_id in pool_ids:
+            extract.pools[pool_id] = self.pool(pool_id)
+        for policy_id in policy_ids:
+            extract.policies[policy_id] = self.policy(policy_id)
+        return extract
+
+
+def open_index(ledger_path):
+    # Returns the index built from the ledger file's current content, or None if there is none (or it
+    # is stale). A file with the size and mtime the index recorded is taken as unchanged, any other
+    # one is hashed in full and must match the hash the index was built for.
+    path = index_path(ledger_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        index = LedgerIndex(path)
+    except ValueError:
+        return None
+    if index.ledger_stat != ledger_stat(ledger_path) and index.ledger_hash != ledger_hash(ledger_path):
+        index.close()
+        return None
+    return index
+
+
+def read_ledger(ledger_path, pool_ids=(), policy_ids=(), workers=1, metrics=None, ledger_format="auto",
+                json_backend="auto"):
+    # Same as read_ledger_file, but answered from the index when there is an up to date one.
+    index = open_index(ledger_path)
+    if index is None:
+        return read_ledger_file(ledger_path, pool_ids, policy_ids, workers, metrics, ledger_format, json_backend)
+    try:
+        if metrics is None:
+            return index.extract(pool_ids, policy_ids)
+        metrics.set("ledger_source", "index")
+        with metrics.phase("index_lookup"):
+            extract = index.extract(pool_ids, policy_ids)
+        metrics.count("delegators_seen", sum(len(pool.delegators) for pool in extract.pools.values()))
+        metrics.count("token_holders", sum(len(holders) for holders in extract.policies.values()))
+        return extract
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the ledger index used to speed up repeated raffles.")
+    parser.add_argument('-l', "--ledger", dest="ledger", default="ledger.json",
+                        help="the path to a current ledger-state file (JSON or CBOR)")
+    parser.add_argument('-j', "--workers", dest="workers", type=int, default=1,
+                        help="number of processes used to scan the UTxO set")
+    parser.add_argument("--format", dest="ledger_format", choices=ledgercbor.FORMATS, default="auto",
+                        help="the ledger-state file format (default: auto)")
+    parser.add_argument("--json-backend", dest="json_backend", choices=jsonbackend.BACKENDS, default="auto",
+                        help="the JSON decoder: orjson or simdjson if installed, else the standard library (default: "
+                             + "auto)")
+    args = parser.parse_args()
+    try:
+        index_file = build_index(args.ledger, workers=args.workers, ledger_format=args.ledger_format,
+                                 json_backend=args.json_backend)
+    except ValueError as error:
+        print(error)
+        exit()
+    print("Index written to " + index_file)
@@ -0,0 +1,572 @@
+#!/bin/env python3
+# Streaming, path-targeted reader for the JSON dumped by `cardano-cli query ledger-state`.
+#
+# The ledger is read once, chunk by chunk. Only the parts needed by the requested pools and
+# policies are materialized, everything else is skipped as it goes by, so memory grows with the
+# selected pools/policies rather than with the ledger. The values that are materialized are
+# decoded by a pluggable JSON backend (see jsonbackend.py).
+import json
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import jsonbackend
+import phasemetrics
+
+CHUNK_SIZE = 1 << 20
+# UTxO shards handed to each worker process, more shards than workers evens out the load
+SHARDS_PER_WORKER = 4
+
+_SPECIAL = re.compile(r'["\[\]{}]')
+_STRING_TAIL = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_SIMPLE_STRING = re.compile(r'"[^"]*"')
+_NUMBER_CHARS = re.compile(r'[-+0-9.eE]*')
+_MATCHED_PAIR = re.compile(r'\{\}|\[\]')
+_BRACKETS_ONLY = {code: None for code in range(256) if chr(code) not in "[]{}"}
+_UTXO_KEY = re.compile(r'"[0-9a-f]{64}#[0-9]+"[ \t\n\r]*:')
+# the end of a UTxO key, nothing else in the utxo map ends with it
+_UTXO_KEY_END = re.compile(r'#[0-9]+"[ \t\n\r]*:')
+_decoder = json.JSONDecoder()
+
+
+def _bracket_balance(text, start, end):
+    # Bracket balance of text[start:end] without scanning it character by character in Python:
+    # strings are dropped and matched bracket pairs reduced with regexes. Returns (cut, unmatched
+    # closing brackets, unmatched opening brackets) for text[start:cut], where cut stops before a
+    # string left open at the end, or None if the text has escapes and needs a proper scan.
+    segment = text[start:end]
+    if "\\" in segment:
+        return None
+    cut = len(segment) if segment.count('"') % 2 == 0 else segment.rfind('"')
+    brackets = _SIMPLE_STRING.sub("", segment[:cut]).translate(_BRACKETS_ONLY)
+    while True:
+        reduced = _MATCHED_PAIR.sub("", brackets)
+        if len(reduced) == len(brackets):
+            break
+        brackets = reduced
+    closes = len(brackets) - len(brackets.lstrip("]}"))
+    return start + cut, closes, len(brackets) - closes
+
+
+class JsonStream:
+    # The file is decoded as latin-1 so that positions in the buffer map 1:1 to byte offsets in the
+    # file, which lets us seek back into it. Everything we read from the ledger is ASCII (hex
+    # hashes, addresses and numbers).
+
+    def __init__(self, fileobj, offset=0, chunk_size=CHUNK_SIZE, backend=None):
+        self.file = fileobj
+        self.chunk_size = chunk_size
+        self.backend = backend if backend is not None else jsonbackend.StdlibBackend()
+        self.seek(offset)
+
+    def tell(self):
+        return self.base + self.pos
+
+    def seek(self, offset):
+        self.file.seek(offset)
+        self.buf = ""
+        self.pos = 0
+        self.base = offset
+        self.keep = None
+        self.eof = False
+
+    def _fill(self):
+        if self.eof:
+            return False
+        drop = self.pos if self.keep is None else min(self.pos, self.keep - self.base)
+        self.buf = self.buf[drop:]
+        self.base += drop
+        self.pos -= drop
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf += chunk.decode("latin-1")
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError("Expected '" + char + "' at offset " + str(self.tell()) + ", found '" + found + "'")
+        self.pos += 1
+
+    def read_value(self):
+        if self.peek() in "[{":
+            return self.backend.loads(self.read_raw())
+        while True:
+            # a number cut by the end of the buffer may still go on in the next chunk, and its start
+            # alone can be a valid number ("-0." decodes as -0)
+            if _NUMBER_CHARS.match(self.buf, self.pos).end() == len(self.buf) and self._fill():
+                continue
+            try:
+                value, self.pos = _decoder.raw_decode(self.buf, self.pos)
+                return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def read_raw(self):
+        # Returns the JSON text of the next value without decoding it.
+        self.peek()
+        self.keep = self.tell()
+        try:
+            self.skip_value()
+            return self.buf[self.keep - self.base:self.pos]
+        finally:
+            self.keep = None
+
+    def _skip_chunk(self, depth):
+        # Skips the rest of the buffer at once when the value being skipped can't end inside it.
+        # Returns the new depth, or None if it could not skip.
+        balance = _bracket_balance(self.buf, self.pos, len(self.buf))
+        if balance is None:
+            return None
+        cut, closes, opens = balance
+        if closes >= depth:
+            return None
+        self.pos = cut
+        return depth - closes + opens
+
+    def skip_value(self):
+        if self.peek() not in '[{"':
+            self.read_value()
+            return
+        depth = 0
+        filled = False
+        while True:
+            if filled and depth > 0:
+                # the value did not fit in one buffer, it may be big enough to skip whole chunks
+                new_depth = self._skip_chunk(depth)
+                if new_depth is not None:
+                    depth = new_depth
+                    if not self._fill():
+                        raise ValueError("Unexpected end of JSON input")
+                    continue
+                filled = False
+            match = _SPECIAL.search(self.buf, self.pos)
+            if match is None:
+                self.pos = len(self.buf)
+                if not self._fill():
+                    raise ValueError("Unexpected end of JSON input")
+                filled = True
+                continue
+            char = match.group()
+            if char == '"':
+                tail = _STRING_TAIL.match(self.buf, match.end())
+                if tail is None:
+                    # string continues in the next chunk, retry from its opening quote
+                    self.pos = match.start()
+                    if not self._fill():
+                        raise ValueError("Unterminated string in JSON input")
+                    filled = True
+                    continue
+                self.pos = tail.end()
+            else:
+                self.pos = match.end()
+                depth += 1 if char in "[{" else -1
+            if depth == 0:
+                return
+
+    def iter_object(self):
+        # Yields the keys of the next object. The caller has to consume each value
+        # (read_value/read_raw/skip_value/iter_*) before asking for the next key.
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(":")
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == "}":
+                return
+            if char != ",":
+                raise ValueError("Malformed JSON object at offset " + str(self.tell() - 1))
+
+    def iter_array(self):
+        # Same contract as iter_object, yields element indexes.
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            char = self.peek()
+            self.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError("Malformed JSON array at offset " + str(self.tell() - 1))
+
+
+def walk(stream, spec):
+    # spec maps object keys to either a nested spec or a handler(stream) consuming the value.
+    for key in stream.iter_object():
+        target = spec.get(key)
+        if target is None:
+            stream.skip_value()
+        elif callable(target):
+            target(stream)
+        else:
+            walk(stream, target)
+
+
+class PoolExtract:
+    def __init__(self, pool_id):
+        self.pool_id = pool_id
+        self.recorded_stake = None
+        self.owners = []
+        self.reward_account = None
+        self.delegators = []
+        self.stake = {}
+
+
+# pass as pool_ids/policy_ids to collect every pool/policy in the ledger
+ALL = None
+
+
+class LedgerExtract:
+    def __init__(self, pool_ids=(), policy_ids=()):
+        self.epoch = None
+        self.all_pools = pool_ids is ALL
+        self.all_policies = policy_ids is ALL
+        self.pools = {} if self.all_pools else {pool_id: PoolExtract(pool_id) for pool_id in pool_ids}
+        self.policies = {} if self.all_policies else {policy_id: {} for policy_id in policy_ids}
+
+    def wants_pools(self):
+        return self.all_pools or bool(self.pools)
+
+    def wants_policies(self):
+        return self.all_policies or bool(self.policies)
+
+    def pool(self, pool_id):
+        pool = self.pools.get(pool_id)
+        if pool is None and self.all_pools and pool_id is not None:
+            pool = self.pools[pool_id] = PoolExtract(pool_id)
+        return pool
+
+
+def _add_utxo_entry(policies, all_policies, entry):
+    entry_policies = entry['amount']['policies']
+    for policy_id in (entry_policies if all_policies else policies):
+        assets = entry_policies.get(policy_id)
+        if assets:
+            holders = policies.setdefault(policy_id, {})
+            address = entry['address']
+            holders[address] = holders.get(address, 0) + sum(assets.values())
+
+
+def _add_utxo(policies, all_policies, raw, backend):
+    # cheap substring test first, most UTxOs don't carry any of the requested policies
+    if not all_policies and not any(policy_id in raw for policy_id in policies):
+        return
+    _add_utxo_entry(policies, all_policies, backend.loads_lazy(raw))
+
+
+def _last_utxo_key(text, start, end):
+    # Start of the last complete UTxO key in text[start:end], or -1. UTxO keys
+    # ("<64 hex tx id>#<index>":) are the only keys of that shape inside the utxo map, which is
+    # also what makes it safe to start reading the map from the middle. Other parts of the ledger
+    # have keys that look the same (Conway's governance action ids), so shards never reach past
+    # the map.
+    i = text.rfind("#", start, end)
+    while i != -1:
+        key_start = text.rfind('"', start, i)
+        if key_start == -1:
+            return -1
+        match = _UTXO_KEY.match(text, key_start)
+        if match is not None and match.end() <= end:
+            return key_start
+        i = text.rfind("#", start, key_start)
+    return -1
+
+
+def _seek_utxo_key(stream, end):
+    # Moves the stream to the first UTxO entry key at or after its position, returns False if the
+    # next entry starts at or after end.
+    while True:
+        match = _UTXO_KEY.search(stream.buf, stream.pos)
+        if match is not None:
+            if stream.base + match.start() >= end:
+                return False
+            stream.pos = match.start()
+            return True
+        if stream.base + len(stream.buf) >= end:
+            return False
+        # keep a possible partial key at the end of the buffer
+        stream.pos = max(stream.pos, len(stream.buf) - 128)
+        if not stream._fill():
+            return False
+
+
+def _scan_utxo_slowly(stream, policies, all_policies, end, metrics):
+    # Entry by entry, until the map closes (returns True) or the next key starts at or after end.
+    while True:
+        if stream.peek() == "}":
+            stream.pos += 1
+            return True
+        if end is not None and stream.tell() >= end:
+            return False
+        metrics.count("utxos_scanned")
+        stream.read_value()
+        stream.expect(":")
+        _add_utxo(policies, all_policies, stream.read_raw(), stream.backend)
+        if stream.peek() == ",":
+            stream.pos += 1
+
+
+def scan_utxo_entries(stream, policies, metrics, all_policies=False, end=None):
+    # Aggregates the utxo map entries starting at the stream's position, which has to be an entry
+    # key or the closing brace of the map, until the map closes (returns True) or the next key
+    # starts at or after the end offset (returns False). The entries are counted in the metrics'
+    # utxos_scanned.
+    #
+    # Unless every policy is wanted, the buffer is processed in bulk: the requested policy ids are
+    # looked up with plain substring searches and only the entries containing them are decoded.
+    if all_policies:
+        return _scan_utxo_slowly(stream, policies, all_policies, end, metrics)
+    while True:
+        stream.peek()
+        buf = stream.buf
+        pos = stream.pos
+        stop = False
+        cut = _last_utxo_key(buf, pos, len(buf))
+        if end is not None and end - stream.base < len(buf):
+            match = _UTXO_KEY.search(buf, max(pos, end - stream.base))
+            if match is not None:
+                cut = match.start()
+                stop = True
+        if cut <= pos:
+            if stop:
+                return False
+            cut = len(buf)
+        balance = _bracket_balance(buf, pos, cut)
+        if balance is None:
+            # escaped strings, go through this part entry by entry
+            slow_end = stream.base + cut if end is None else min(end, stream.base + cut)
+            if _scan_utxo_slowly(stream, policies, all_policies, slow_end, metrics):
+                return True
+            if stop or (end is not None and stream.tell() >= end):
+                return False
+            continue
+        if balance[1] > 0:
+            # the map closes in this buffer
+            return _scan_utxo_slowly(stream, policies, all_policies, end, metrics)
+        if cut < len(buf):
+            metrics.count("utxos_scanned", len(_UTXO_KEY_END.findall(buf, pos, cut)))
+            entry_starts = set()
+            for policy_id in policies:
+                # policy ids show up as quoted keys, which can't be mistaken for part of a tx id
+                # or an address
+                needle = '"' + policy_id + '"'
+                hit = buf.find(needle, pos, cut)
+                while hit != -1:
+                    entry_starts.add(_last_utxo_key(buf, pos, hit))
+                    hit = buf.find(needle, hit + len(needle), cut)
+            entry_starts.discard(-1)
+            for entry_start in sorted(entry_starts):
+                value_start = _WHITESPACE.match(buf, _UTXO_KEY.match(buf, entry_start).end()).end()
+                # the entry ends at the comma before the next key, there is one at cut at the latest
+                next_key = _UTXO_KEY.search(buf, value_start)
+                value_end = buf.rindex(",", value_start, next_key.start())
+                _add_utxo_entry(policies, all_policies, stream.backend.loads_lazy(buf[value_start:value_end]))
+            stream.pos = cut
+            if stop:
+                return False
+            continue
+        if not stream._fill():
+            raise ValueError("Unexpected end of JSON input in the utxo map")
+
+
+def scan_utxo_shard(ledger_path, start, end, policy_ids, json_backend="stdlib", chunk_size=CHUNK_SIZE):
+    # Aggregates the UTxO entries whose key starts in the [start, end) byte range of the ledger.
+    # Returns ({policy id: holders}, number of entries).
+    policies = {} if policy_ids is ALL else {policy_id: {} for policy_id in policy_ids}
+    metrics = phasemetrics.Metrics()
+    with open(ledger_path, "rb") as ledger_file:
+        stream = JsonStream(ledger_file, start, chunk_size, jsonbackend.get_backend(json_backend))
+        if _seek_utxo_key(stream, end):
+            scan_utxo_entries(stream, policies, metrics, policy_ids is ALL, end)
+    return policies, metrics.counters.get("utxos_scanned", 0)
+
+
+def _merge_holders(policies, shard_policies):
+    for policy_id, shard_holders in shard_policies.items():
+        holders = policies.setdefault(policy_id, {})
+        for address, quantity in shard_holders.items():
+            holders[address] = holders.get(address, 0) + quantity
+
+
+class _LedgerHandlers:
+    def __init__(self, extract, ledger_path=None, executor=None, workers=1, metrics=None):
+        self.extract = extract
+        self.metrics = metrics if metrics is not None else phasemetrics.Metrics()
+        self.delegator_pools = None
+        self.deferred_stake = None
+        self.ledger_path = ledger_path
+        self.executor = executor
+        self.workers = workers
+        self.utxo_shards = []
+
+    def spec(self):
+        spec = {
+            "lastEpoch": self.last_epoch,
+        }
+        if self.extract.wants_pools():
+            spec["stakeDistrib"] = self.stake_distrib
+            spec["stateBefore"] = {
+                "esSnapshots": {"pstakeSet": {"stake": self.stake, "delegations": self.delegations}},
+                "esLState": {"delegationState": {"pstate": {"pParams pState": self.pool_params}}},
+            }
+        if self.extract.wants_policies():
+            state_before = spec.setdefault("stateBefore", {})
+            state_before.setdefault("esLState", {})["utxoState"] = {"utxo": self.utxo}
+        return spec
+
+    def last_epoch(self, stream):
+        self.extract.epoch = stream.read_value()
+
+    def stake_distrib(self, stream):
+        for pool_id in stream.iter_object():
+            pool = self.extract.pool(pool_id)
+            if pool is not None:
+                distrib = stream.read_value()
+                pool.recorded_stake = int(distrib['individualPoolStake']['numerator'])
+            else:
+                stream.skip_value()
+
+    def pool_params(self, stream):
+        for pool_id in stream.iter_object():
+            pool = self.extract.pool(pool_id)
+            if pool is not None:
+                pool_data = stream.read_value()
+                pool.owners = pool_data['owners']
+                pool.reward_account = pool_data['rewardAccount']['credential']['key hash']
+            else:
+                stream.skip_value()
+
+    def delegations(self, stream):
+        with self.metrics.phase("delegation_join"):
+            self._delegations(stream)
+
+    def _delegations(self, stream):
+        self.delegator_pools = {}
+        for _ in stream.iter_array():
+            self.metrics.count("delegations_seen")
+            keyhashobj = []
+            pool_id = None
+            for itemsmall in stream.read_value():
+                if "key hash" in itemsmall:
+                    keyhashobj.append(itemsmall["key hash"])
+                elif isinstance(itemsmall, str):
+                    pool_id = itemsmall
+            pool = self.extract.pool(pool_id)
+            if pool is not None:
+                pool.delegators.extend(keyhashobj)
+                self.metrics.count("delegators_seen", len(keyhashobj))
+                for delegator in keyhashobj:
+                    self.delegator_pools[delegator] = pool
+
+    def stake(self, stream):
+        if self.delegator_pools is None:
+            # stake comes before delegations in this dump, come back to it once we know the delegators
+            self.deferred_stake = stream.tell()
+            stream.skip_value()
+            return
+        with self.metrics.phase("stake_aggregation"):
+            self._stake(stream)
+
+    def _stake(self, stream):
+        for _ in stream.iter_array():
+            self.metrics.count("stake_entries_seen")
+            delegatorid = None
+            snapstake = 0
+            for itemsmall in stream.read_value():
+                if isinstance(itemsmall, int):
+                    snapstake = itemsmall
+                else:
+                    delegatorid = itemsmall.get("key hash")
+            pool = self.delegator_pools.get(delegatorid)
+            if pool is not None:
+                pool.stake[delegatorid] = pool.stake.get(delegatorid, 0) + snapstake
+
+    def utxo(self, stream):
+        policies = self.extract.policies
+        all_policies = self.extract.all_policies
+        start = stream.tell()
+        with self.metrics.phase("utxo_scan"):
+            if self.executor is not None:
+                # skipped once first, so that the shards cover the map and nothing past it
+                stream.skip_value()
+                self.submit_utxo_shards(start, stream.tell(), stream.backend.name, stream.chunk_size)
+            else:
+                stream.expect("{")
+                scan_utxo_entries(stream, policies, self.metrics, all_policies)
+        self.metrics.count("utxo_bytes_scanned", stream.tell() - start)
+
+    def submit_utxo_shards(self, start, end, json_backend, chunk_size):
+        # Splits the utxo map, the [start, end) byte range of the file, between the workers, which
+        # parse it while this process reads the rest of the ledger.
+        shards = self.workers * SHARDS_PER_WORKER
+        bounds = [start + (end - start) * i // shards for i in range(shards + 1)]
+        policy_ids = ALL if self.extract.all_policies else list(self.extract.policies)
+        self.metrics.count("utxo_shards", shards)
+        self.utxo_shards = [self.executor.submit(scan_utxo_shard, self.ledger_path, shard_start, shard_end, policy_ids,
+                                                 json_backend, chunk_size)
+                            for shard_start, shard_end in zip(bounds, bounds[1:])]
+
+    def merge_utxo_shards(self):
+        # merged in file order, so holders come out in the same order as a single-process scan
+        if not self.utxo_shards:
+            return
+        with self.metrics.phase("utxo_scan"):
+            for shard in self.utxo_shards:
+                shard_policies, utxos = shard.result()
+                _merge_holders(self.extract.policies, shard_policies)
+                self.metrics.count("utxos_scanned", utxos)
+
+
+def read_ledger(ledger_path, pool_ids=(), policy_ids=(), workers=1, metrics=None, json_backend="auto",
+                chunk_size=CHUNK_SIZE):
+    # workers > 1 aggregates the UTxO set in that many processes. Pass a phasemetrics.Metrics to
+    # record the time spent in each part of the ledger. json_backend is one of jsonbackend.BACKENDS.
+    # chunk_size is how much of the file is read at a time, by this process and by each worker.
+    backend = jsonbackend.get_backend(json_backend)
+    extract = LedgerExtract(pool_ids, policy_ids)
+    executor = None
+    if workers > 1 and extract.wants_policies():
+        # Not forked: the raffle server reads ledgers from a thread next to its request threads. The
+        # workers re-import the calling script, so it has to keep its work under a __main__ guard.
+        context = multiprocessing.get_context("spawn")
+        executor = ProcessPoolExecutor(workers, mp_context=context)
+    try:
+        handlers = _LedgerHandlers(extract, ledger_path, executor, workers, metrics)
+        with open(ledger_path, "rb") as ledger_file:
+            stream = JsonStream(ledger_file, chunk_size=chunk_size, backend=backend)
+            walk(stream, handlers.spec())
+            if handlers.deferred_stake is not None and handlers.delegator_pools is not None:
+                stream.seek(handlers.deferred_stake)
+                handlers.stake(stream)
+        handlers.merge_utxo_shards()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    handlers.metrics.set("ledger_bytes", os.path.getsize(ledger_path))
+    handlers.metrics.set("json_backend", backend.name)
+    handlers.metrics.count("token_holders", sum(len(holders) for holders in extract.policies.values()))
+    return extract
@@ -0,0 +1,139 @@
+#!/bin/env python3
+# Columnar store of per-epoch pool stake snapshots, built from archived ledger-state files.
+#
+# Only the pstakeSet delegations/stake join of the pools we care about is kept: one file per pool
+# and epoch (<store>/<pool id>/<epoch>.snap) with the delegators' 28-byte stake key hashes sorted
+# ascending, followed by their stake as int64 lovelace. The loyalty raffle of
+# randomdelegatorpicker2.py can then be computed offline from it, without calling Blockfrost.
+import argparse
+import math
+import mmap
+import os
+import struct
+from array import array
+
+import cardanoaddress
+import ledgerindex
+
+MAGIC = b"CTSNAP01"
+HASH_SIZE = 28
+million = 1000000
+
+_HEADER = struct.Struct("<8sQ")
+
+
+def pool_hex(pool_id):
+    # accepts both the hex and the bech32 (pool1...) form of a pool id
+    if pool_id.startswith("pool1"):
+        return cardanoaddress.bech32_decode(pool_id)[1].hex()
+    return pool_id
+
+
+def pool_bech32(pool_id):
+    # the pool1... form Blockfrost uses, from either form of a pool id
+    if pool_id.startswith("pool1"):
+        return pool_id
+    return cardanoaddress.bech32_encode("pool", bytes.fromhex(pool_id))
+
+
+def snapshot_path(store_dir, pool_id, epoch):
+    return os.path.join(store_dir, pool_hex(pool_id), str(epoch) + ".snap")
+
+
+def write_snapshot(store_dir, pool_id, epoch, stakes):
+    # stakes maps stake key hashes (hex) to lovelace
+    path = snapshot_path(store_dir, pool_id, epoch)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    delegators = sorted(stakes)
+    amounts = array("q", (stakes[delegator] for delegator in delegators))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(_HEADER.pack(MAGIC, len(delegators)))
+        out.write(b"".join(bytes.fromhex(delegator) for delegator in delegators))
+        out.write(amounts.tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+def iter_snapshot(store_dir, pool_id, epoch):
+    # Yields (stake key hash, lovelace) sorted by key hash, straight from the memory-mapped file.
+    path = snapshot_path(store_dir, pool_id, epoch)
+    with open(path, "rb") as snapshot_file, \
+            mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        magic, count = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise ValueError(path + " is not a stake snapshot")
+        hashes_end = _HEADER.size + count * HASH_SIZE
+        stakes = array("q")
+        stakes.frombytes(mm[hashes_end:hashes_end + count * 8])
+        for i, stake in enumerate(stakes):
+            start = _HEADER.size + i * HASH_SIZE
+            yield mm[start:start + HASH_SIZE].hex(), stake
+
+
+def read_snapshot(store_dir, pool_id, epoch):
+    return dict(iter_snapshot(store_dir, pool_id, epoch))
+
+
+def epochs(store_dir, pool_id):
+    pool_dir = os.path.join(store_dir, pool_hex(pool_id))
+    if not os.path.isdir(pool_dir):
+        return []
+    return sorted(int(name[:-len(".snap")]) for name in os.listdir(pool_dir) if name.endswith(".snap"))
+
+
+def ingest(store_dir, ledger_path, pool_ids):
+    # Adds the ledger's pstakeSet snapshot of every given pool to the store, returns its epoch.
+    pool_ids = [pool_hex(pool_id) for pool_id in pool_ids]
+    extract = ledgerindex.read_ledger(ledger_path, pool_ids=pool_ids)
+    for pool_id in pool_ids:
+        pool = extract.pools[pool_id]
+        stakes = {delegator: pool.stake[delegator] for delegator in pool.delegators if delegator in pool.stake}
+        write_snapshot(store_dir, pool_id, extract.epoch, stakes)
+    return extract.epoch
+
+
+def loyalty_amounts(stakes, use_sqrt=False):
+    # stakes: a delegator's lovelace with the pool, one entry per epoch, oldest first.
+    # Returns (tickets, last staked ADA): tickets add up the (square rooted) ADA of every epoch.
+    if not stakes:
+        return 0, 0
+    tickets = 0
+    for stake in stakes:
+        amount = stake / million
+        tickets += round(math.sqrt(amount) if use_sqrt else amount)
+    return tickets, round(stakes[-1] / million)
+
+
+def loyalty_participants(store_dir, pool_id, use_sqrt=False, until_epoch=None):
+    # (stake key hash, tickets, last staked ADA) for every delegator of the pool's latest stored
+    # epoch (or until_epoch), computed over every stored epoch up to it.
+    pool_epochs = [epoch for epoch in epochs(store_dir, pool_id) if until_epoch is None or epoch <= until_epoch]
+    if not pool_epochs:
+        return []
+    current = read_snapshot(store_dir, pool_id, pool_epochs[-1])
+    history = {delegator: [] for delegator in current}
+    for epoch in pool_epochs[:-1]:
+        for delegator, stake in iter_snapshot(store_dir, pool_id, epoch):
+            stakes = history.get(delegator)
+            if stakes is not None:
+                stakes.append(stake)
+    participants = []
+    for delegator, stake in current.items():
+        history[delegator].append(stake)
+        tickets, last_staked_amount = loyalty_amounts(history[delegator], use_sqrt)
+        participants.append((delegator, tickets, last_staked_amount))
+    return participants
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add archived ledger-state snapshots to a loyalty history store.")
+    parser.add_argument('-l', "--ledger", dest="ledgers", action="append", required=True,
+                        help="a ledger-state file (JSON or CBOR), can be repeated for several epochs")
+    parser.add_argument('-i', "--pool-id", dest="pool_ids", action="append", required=True,
+                        help="a pool ID to keep, can be repeated")
+    parser.add_argument('-d', "--store", dest="store", default="history",
+                        help="the history store directory (default: history)")
+    args = parser.parse_args()
+    for ledger in args.ledgers:
+        print(ledger + ": epoch " + str(ingest(args.store, ledger, args.pool_ids)) + " stored")
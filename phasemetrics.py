@@ -0,0 +1,100 @@
+#!/bin/env python3
+# Per-phase timing, memory and counter instrumentation.
+#
+# A run records the wall and CPU time of its phases (ledger load, delegation join, UTxO scan, draw,
+# ...) and counters (UTxO entries, delegators, HTTP requests, ...), and writes them as JSON with
+# --metrics so they can be tracked from epoch to epoch. Peak RSS is always recorded, tracemalloc
+# peaks only with trace_memory since tracing slows the run down considerably. The OS only keeps the
+# process's lifetime peak RSS, so a phase records how much that peak grew while it ran
+# (rss_peak_delta_bytes, 0 when an earlier phase had already gone higher).
+import contextlib
+import datetime
+import json
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss(who="self"):
+    # peak resident set size in bytes, None where the resource module is missing (Windows)
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    # Linux reports kilobytes, macOS bytes
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+
+class Metrics:
+    def __init__(self, trace_memory=False):
+        self.phases = {}
+        self.counters = {}
+        self.trace_memory = trace_memory
+        self.started = datetime.datetime.now()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._memory_peaks = []
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # Phases can be nested and entered several times, their times and calls add up.
+        if self.trace_memory:
+            self._enter_memory()
+        rss = peak_rss()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            record = self.phases.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0})
+            record["calls"] += 1
+            record["wall_s"] += time.perf_counter() - wall
+            record["cpu_s"] += time.process_time() - cpu
+            if rss is not None:
+                record["rss_peak_delta_bytes"] = record.get("rss_peak_delta_bytes", 0) + peak_rss() - rss
+            if self.trace_memory:
+                record["tracemalloc_peak_bytes"] = max(record.get("tracemalloc_peak_bytes", 0), self._exit_memory())
+
+    def _enter_memory(self):
+        # tracemalloc has a single peak, fold it into the enclosing phases before resetting it
+        peak = tracemalloc.get_traced_memory()[1]
+        self._memory_peaks = [max(outer, peak) for outer in self._memory_peaks]
+        tracemalloc.reset_peak()
+        self._memory_peaks.append(0)
+
+    def _exit_memory(self):
+        peak = max(self._memory_peaks.pop(), tracemalloc.get_traced_memory()[1])
+        self._memory_peaks = [max(outer, peak) for outer in self._memory_peaks]
+        return peak
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set(self, name, value):
+        self.counters[name] = value
+
+    def set_in(self, group, key, name, value):
+        # counters of one of several things in the run, e.g. of each raffle: counters[group][key][name]
+        self.counters.setdefault(group, {}).setdefault(key, {})[name] = value
+
+    def as_dict(self):
+        return {
+            "started": self.started.isoformat(),
+            "wall_s": time.perf_counter() - self._wall,
+            "cpu_s": time.process_time() - self._cpu,
+            "peak_rss_bytes": peak_rss(),
+            "peak_rss_children_bytes": peak_rss("children"),
+            "phases": self.phases,
+            "counters": self.counters,
+        }
+
+    def write(self, out_path):
+        with open(out_path, "w") as out:
+            json.dump(self.as_dict(), out, indent=2)
+            out.write("\n")
@@ -0,0 +1,262 @@
+#!/bin/env python3
+# Long-running raffle server: indexes the ledger once and serves draws over local HTTP or a Unix socket.
+#
+#   POST /draw    {"pool_id" or "policy_id": ..., "winners": 1, "min_tokens": 0, "sqrt": false,
+#                  "unique": false, "group_by_stake": false, "exclude": ["..."]}
+#   GET  /status
+#
+# Draws are answered from the memory-mapped ledger index (see ledgerindex.py), so a request costs a
+# couple of lookups rather than a pass over the ledger. The ledger file is watched: once a new one
+# has stopped changing, its index is built in a background thread and swapped in. Requests that
+# are in flight keep the snapshot they started with.
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import exclusions
+import giveaway
+import jsonbackend
+import ledgercbor
+import ledgerindex
+
+POLL_INTERVAL = 5
+# seconds a new ledger file must stay unchanged before it is indexed, cardano-cli writes it gradually
+SETTLE_TIME = 10
+# pools/policies kept extracted per snapshot
+EXTRACT_CACHE = 64
+MAX_WINNERS = 10000
+
+
+class LedgerSnapshot:
+    # An opened ledger index, with the pools and policies already extracted from it.
+    def __init__(self, ledger_path, stat, index):
+        self.ledger_path = ledger_path
+        self.stat = stat
+        self.index = index
+        self.epoch = index.epoch
+        self.loaded = time.time()
+        self._extracts = {}
+        self._lock = threading.Lock()
+
+    def extract(self, pool_id=None, policy_id=None):
+        key = (pool_id, policy_id)
+        with self._lock:
+            extract = self._extracts.get(key)
+        if extract is None:
+            extract = self.index.extract([pool_id] if pool_id is not None else [],
+                                         [policy_id] if policy_id is not None else [])
+            with self._lock:
+                if len(self._extracts) >= EXTRACT_CACHE:
+                    self._extracts.pop(next(iter(self._extracts)))
+                self._extracts[key] = extract
+        return extract
+
+
+def _file_stat(ledger_path):
+    stat = os.stat(ledger_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class RaffleServer:
+    def __init__(self, ledger_path, workers=1, ledger_format="auto", poll_interval=POLL_INTERVAL,
+                 settle_time=SETTLE_TIME, json_backend="auto"):
+        self.ledger_path = ledger_path
+        self.workers = workers
+        self.ledger_format = ledger_format
+        self.json_backend = json_backend
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.snapshot = None
+        self.reloads = 0
+        self.draws = 0
+        self.last_error = None
+        # guards the snapshot swap and the counters, which request threads update concurrently
+        self._lock = threading.Lock()
+
+    def load(self):
+        # Opens the ledger's index, building it first if there is none or it is stale.
+        stat = _file_stat(self.ledger_path)
+        index = ledgerindex.open_index(self.ledger_path)
+        if index is None:
+            ledgerindex.build_index(self.ledger_path, workers=self.workers, ledger_format=self.ledger_format,
+                                    json_backend=self.json_backend)
+            index = ledgerindex.open_index(self.ledger_path)
+            if index is None:
+                raise ValueError(self.ledger_path + " changed while it was being indexed")
+        return LedgerSnapshot(self.ledger_path, stat, index)
+
+    def watch(self):
+        # Runs in a background thread, swaps in a new snapshot whenever the ledger file changes.
+        # The old index is released once the last request holding it is done.
+        changed_at = None
+        seen = self.snapshot.stat
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                stat = _file_stat(self.ledger_path)
+            except OSError:
+                continue
+            if stat == self.snapshot.stat:
+                changed_at = None
+                continue
+            if stat != seen or changed_at is None:
+                seen = stat
+                changed_at = time.time()
+                continue
+            if time.time() - changed_at < self.settle_time:
+                continue
+            try:
+                snapshot = self.load()
+            except (OSError, ValueError) as error:
+                self.last_error = str(error)
+                print("Reloading " + self.ledger_path + " failed: " + self.last_error)
+                changed_at = None
+                continue
+            with self._lock:
+                self.snapshot = snapshot
+                self.reloads += 1
+            changed_at = None
+            print("Ledger reloaded, now serving epoch " + str(snapshot.epoch))
+
+    def start_watching(self):
+        thread = threading.Thread(target=self.watch, name="ledger-watch", daemon=True)
+        thread.start()
+        return thread
+
+    def status(self):
+        with self._lock:
+            snapshot = self.snapshot
+            reloads = self.reloads
+            draws = self.draws
+        return {
+            "ledger": self.ledger_path,
+            "epoch": snapshot.epoch,
+            "loaded": snapshot.loaded,
+            "reloads": reloads,
+            "draws": draws,
+            "last_error": self.last_error,
+        }
+
+    def draw(self, request):
+        # Draws the prizes described by a request, raises ValueError for bad requests and
+        # LookupError for a pool that isn't in the ledger.
+        snapshot = self.snapshot
+        pool_id = request.get("pool_id")
+        policy_id = request.get("policy_id")
+        if (pool_id is None) == (policy_id is None):
+            raise ValueError("A draw needs exactly one of pool_id or policy_id")
+        number_winners = abs(int(request.get("winners", 1)))
+        if number_winners > MAX_WINNERS:
+            raise ValueError("At most " + str(MAX_WINNERS) + " winners per draw")
+        exclude = request.get("exclude") or []
+        if isinstance(exclude, str):
+            exclude = exclude.split(",")
+        raffle = giveaway.Raffle("pool " + pool_id if pool_id is not None else "policy " + policy_id,
+                                 pool_id=pool_id, policy_id=policy_id, number_winners=number_winners,
+                                 min_tokens=abs(int(request.get("min_tokens", 0))),
+                                 unique=bool(request.get("unique", False)), use_sqrt=bool(request.get("sqrt", False)),
+                                 group_by_stake=bool(request.get("group_by_stake", False)),
+                                 excluded=exclusions.ExclusionSet(exclude))
+        totals = giveaway.collect(raffle, snapshot.extract(pool_id, policy_id))
+        if totals is None:
+            raise LookupError("Pool " + pool_id + " is not in the ledger")
+        result = giveaway.draw_winners(raffle)
+        with self._lock:
+            self.draws += 1
+        return dict({"epoch": snapshot.epoch, "eligible": totals["eligible"]}, **result)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "raffleserver"
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._reply(200, self.server.raffles.status())
+        else:
+            self._reply(404, {"error": "Unknown path " + self.path})
+
+    def do_POST(self):
+        if self.path != "/draw":
+            self._reply(404, {"error": "Unknown path " + self.path})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("The request body must be a JSON object")
+            self._reply(200, self.server.raffles.draw(request))
+        except LookupError as error:
+            self._reply(404, {"error": str(error)})
+        except (ValueError, TypeError) as error:
+            self._reply(400, {"error": str(error)})
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_http_server(raffles, host="127.0.0.1", port=8080, socket_path=None):
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        httpd = _UnixHTTPServer(socket_path, _Handler)
+    else:
+        httpd = ThreadingHTTPServer((host, port), _Handler)
+    httpd.raffles = raffles
+    return httpd
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve raffle draws from a ledger-state file that is indexed once.")
+    parser.add_argument('-l', "--ledger", dest="ledger", default="ledger.json",
+                        help="the path to a current ledger-state file (JSON or CBOR), reloaded when it changes")
+    parser.add_argument("--format", dest="ledger_format", choices=ledgercbor.FORMATS, default="auto",
+                        help="the ledger-state file format (default: auto)")
+    parser.add_argument("--json-backend", dest="json_backend", choices=jsonbackend.BACKENDS, default="auto",
+                        help="the JSON decoder used when indexing: orjson or simdjson if installed, else the "
+                             + "standard library (default: auto)")
+    parser.add_argument('-j', "--workers", dest="workers", type=int, default=1,
+                        help="number of processes used to scan the UTxO set when indexing")
+    parser.add_argument("--host", default="127.0.0.1", help="the address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="the port to listen on (default: 8080)")
+    parser.add_argument("--socket", dest="socket_path",
+                        help="if specified will listen on this Unix socket instead of a TCP port")
+    parser.add_argument("--poll", type=float, default=POLL_INTERVAL,
+                        help="seconds between checks for a new ledger file (default: " + str(POLL_INTERVAL) + ")")
+    args = parser.parse_args()
+
+    raffle_server = RaffleServer(args.ledger, workers=args.workers, ledger_format=args.ledger_format,
+                                 poll_interval=args.poll, json_backend=args.json_backend)
+    print("Loading " + args.ledger + "...")
+    try:
+        jsonbackend.get_backend(args.json_backend)
+        raffle_server.snapshot = raffle_server.load()
+    except ValueError as error:
+        print(error)
+        exit()
+    raffle_server.start_watching()
+    http_server = make_http_server(raffle_server, args.host, args.port, args.socket_path)
+    print("Serving epoch " + str(raffle_server.snapshot.epoch) + " on "
+          + (args.socket_path if args.socket_path is not None else args.host + ":" + str(args.port)))
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
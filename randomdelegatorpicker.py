@@ -1,12 +1,20 @@
 #!/bin/env python3
-import json
 import argparse
-import math
-import random
-import subprocess
+import json
 
 from os import path
 
+import drawengine
+import exclusions
+import export
+import fairness
+import giveaway
+import jsonbackend
+import ledgercbor
+import ledgerindex
+import phasemetrics
+import stakediff
+
 
 def parse_all_args():
     python_cmd = "python3 randomdelegatorpicker.py "
@@ -27,15 +35,37 @@ def parse_all_args():
     parser.add_argument('-l', "--ledger",
                         dest="ledger",
                         default="ledger.json",
-                        help="the path to a current ledger-state JSON file",
+                        help="the path to a current ledger-state file, JSON or CBOR",
                         )
+    parser.add_argument(
+        "--format",
+        dest="ledger_format",
+        choices=ledgercbor.FORMATS,
+        default="auto",
+        help="the ledger-state file format, detected from the file by default"
+    )
+    parser.add_argument(
+        "--json-backend",
+        dest="json_backend",
+        choices=jsonbackend.BACKENDS,
+        default="auto",
+        help="the decoder for the parts of a JSON ledger that are read: orjson or simdjson when installed, "
+             + "else the standard library (default: auto)"
+    )
     parser.add_argument(
         '-e', "--exclude",
         dest="exclude_addresses",
-        help="if specified will exclude provided address(es) from the raffle.\nE.g. --exclude "
+        help="if specified will exclude provided address(es) from the raffle: stake/payment key hashes, "
+             + "hex or bech32 addresses.\nE.g. --exclude "
              + "\"1b9bb7f381fd56c239903b380f44583ce5c43dd51a350497bc0824a4,"
                "002545ccd16d81e202288049d22f0a50c3fbf520cf2a206ccd7765ff\""
     )
+    parser.add_argument(
+        "--exclude-file",
+        dest="exclude_files",
+        action="append",
+        help="a file listing addresses to exclude, one per line ('#' starts a comment), can be repeated"
+    )
     parser.add_argument(
         '-w', "--winners",
         dest="number_winners",
@@ -52,67 +82,185 @@ def parse_all_args():
         help="if used, the winners will be unique (max 1 prize per address). "
              + "Only makes sense to use if --winners is specified."
     )
+    parser.add_argument(
+        '-b', "--batch",
+        action="store_true",
+        help="if used, draws all --winners at once and writes the number of prizes won by each address "
+             + "to --batch-out instead of announcing every prize. Can't be combined with --unique."
+    )
+    parser.add_argument(
+        "--batch-out",
+        dest="batch_out",
+        default="winners.csv",
+        help="the file written by --batch (default: winners.csv), .jsonl and .gz/.zst work too"
+    )
+    parser.add_argument(
+        '-o', "--output",
+        dest="output",
+        help="if specified will write every prize's winning number and winner to this file, as they are drawn "
+             + "(.csv or .jsonl, optionally .gz/.zst compressed)"
+    )
+    parser.add_argument(
+        "--export",
+        dest="export",
+        help="if specified will write every eligible participant with their tickets to this file "
+             + "(.csv or .jsonl, optionally .gz/.zst compressed)"
+    )
+    parser.add_argument(
+        '-c', "--config",
+        dest="config",
+        help="a JSON file listing several raffles (pools and/or policies) to draw from a single pass over the ledger"
+    )
+    parser.add_argument(
+        '-j', "--workers",
+        dest="workers",
+        type=int,
+        default=1,
+        help="if specified will scan the ledger's UTxO set for token holders in that many processes"
+    )
+    parser.add_argument(
+        "--build-index",
+        action="store_true",
+        help="if used, (re)builds the ledger index next to the ledger-state file, "
+             + "which makes every later raffle on the same ledger skip parsing it."
+    )
+    parser.add_argument(
+        "--no-index",
+        action="store_true",
+        help="if used, ignores an existing ledger index and reads the ledger-state file directly."
+    )
     parser.add_argument(
         '-s', "--sqrt",
         action="store_true",
         help="if used, the participants' number of tickets will be square rooted, "
              + "giving smaller guys a greater chance of winning."
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--new-since",
+        dest="new_since",
+        type=int,
+        help="if specified with --pool-id, only delegators of the ledger who weren't delegated to the pool in that "
+             + "epoch can win (see stakediff.py, needs the epoch in --history-store)"
+    )
+    parser.add_argument(
+        "--stayed-since",
+        dest="stayed_since",
+        type=int,
+        help="if specified with --pool-id, only delegators of the ledger who were delegated to the pool in every "
+             + "stored epoch since that one can win"
+    )
+    parser.add_argument(
+        "--history-store",
+        dest="history_store",
+        default="history",
+        help="the per-epoch stake snapshots used by --new-since/--stayed-since "
+             + "(see loyaltystore.py, default: history)"
+    )
+    parser.add_argument(
+        "--group-by-stake",
+        action="store_true",
+        help="if used with --policy-id, a holder's addresses sharing a stake key count as one wallet: "
+             + "--min-tokens and the tickets apply to the wallet's total and the winner is its stake address"
+    )
+    parser.add_argument(
+        "--verify",
+        dest="verify_draws",
+        type=int,
+        nargs="?",
+        const=1000000,
+        help="if used, draws no prizes but checks the printed odds against that many simulated draws "
+             + "(default: 1000000) with a chi-square test, including --sqrt and --unique"
+    )
+    parser.add_argument(
+        "--metrics",
+        dest="metrics",
+        help="if specified will write the time, memory and counters of every phase of the run to this JSON file"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="if used, --metrics also records tracemalloc peaks per phase (slows the run down)"
+    )
+    args = parser.parse_args()
+    if args.batch and args.unique:
+        parser.error("--batch draws winners with replacement, it can't be combined with --unique")
+    return args
 
 
-def maybe_run_bech32(addr):
-    global try_bech32
-    if try_bech32:
-        try:
-            p1 = subprocess.p1 = subprocess.Popen(["./runbech32.sh", addr], stdout=subprocess.PIPE)
-            decoded_address = p1.stdout.readline().decode("utf-8").rstrip()
-            p1.stdout.close()
-            return decoded_address
-        except:
-            try_bech32 = False
-    return addr
-
-
-def process_winner(winning_num, prize_num, _total_tickets):
-    accum = 0
-    eligible_participants_length = len(eligible_participants)
+def process_winner(raffle, draw, prize_num):
+    winning_num, participant, participant_tickets, total_tickets = giveaway.draw_prize(raffle, draw)
     print("Prize #" + str(prize_num) + " Winning number: " + str(winning_num))
-    for participant in eligible_participants:
-        participant_tickets = eligible_participants[participant]
-        if participant_tickets == 0:
-            continue
-        accum += participant_tickets
-        if round(accum) >= winning_num and participant_tickets > 0:
-            winner = maybe_run_bech32(participant)
-            print_result(winner, participant_tickets, _total_tickets)
-            if unique:
-                eligible_participants[participant] = 0
-                _total_tickets -= participant_tickets
-            break
-    if round(accum) < winning_num:
-        print("!!! Something probably went wrong. accum < winning_num. " + ": accum =" + str(accum)
-              + ", winning_num = " + str(winning_num))
-    return round(_total_tickets)
-
-
-def calculate_chance(tickets, total_tickets):
-    return str(round(tickets / total_tickets * 100, 2))
-
-
-def print_result(winner, tickets, total_tickets):
-    tickets = round(tickets)
-    congrats = get_congrats_message(winner, tickets, total_tickets)
+    winner = raffle.encode_participants([participant])[0]
+    amount = raffle.participant_amounts[participant]
+    print_result(raffle, winner, amount, participant_tickets, total_tickets)
+    return [prize_num, winning_num, winner, amount, round(participant_tickets / raffle.ticket_unit),
+            giveaway.calculate_chance(participant_tickets, total_tickets)]
+
+
+def print_result(raffle, winner, amount, tickets, total_tickets):
+    congrats = get_congrats_message(raffle, winner, amount, tickets, total_tickets)
     print(congrats)
 
 
-def get_congrats_message(winner, tickets, total_tickets):
-    return "Congrats to " + winner + " (" + str(round(tickets * tickets)) +" ADA) "+ " (" + str(round(tickets)) + " out of " \
-           + str(total_tickets) + " tickets, " \
-           + (calculate_chance(tickets, total_tickets)) + "% chance)!\n"
+def get_congrats_message(raffle, winner, amount, tickets, total_tickets):
+    return "Congrats to " + winner + " (" + str(amount) + " " + raffle.amount_unit + ") " + " (" \
+           + str(round(tickets / raffle.ticket_unit)) + " out of " + str(round(total_tickets / raffle.ticket_unit)) \
+           + " tickets, " + (giveaway.calculate_chance(tickets, total_tickets)) + "% chance)!\n"
+
+
+def write_batch_results(raffle, win_counts, out_path):
+    winners = [(participant, tickets, wins)
+               for (participant, tickets), wins in zip(raffle.eligible_participants.items(), win_counts) if wins > 0]
+    addresses = raffle.iter_encoded(participant for (participant, _, _) in winners)
+    with export.RowWriter(out_path, ["address", raffle.amount_unit.lower(), "tickets", "prizes"]) as writer:
+        writer.write_rows(
+            (address, raffle.participant_amounts[participant], round(tickets / raffle.ticket_unit), wins)
+            for address, (participant, tickets, wins) in zip(addresses, winners)
+        )
+
+
+def write_participants(raffle, total_tickets, out_path):
+    # weight is the exact number of tickets the draw uses, tickets the rounded ADA/token equivalent
+    participants = raffle.eligible_participants
+    addresses = raffle.iter_encoded(participants)
+    with export.RowWriter(out_path, ["address", raffle.amount_unit.lower(), "tickets", "weight", "chance"]) as writer:
+        writer.write_rows(
+            (address, raffle.participant_amounts[participant], round(weight / raffle.ticket_unit), weight,
+             giveaway.calculate_chance(weight, total_tickets))
+            for address, (participant, weight) in zip(addresses, participants.items())
+        )
+    return writer.rows
+
+
+def print_verification(raffle):
+    print("Verifying the odds over " + str(raffle.verify_draws) + " simulated draws...")
+    report = fairness.verify(raffle, raffle.verify_draws)
+    raffle.metrics.count("simulated_draws", report["draws"])
+    if raffle.unique:
+        print(str(report["raffles"]) + " raffles of " + str(report["draws"] // report["raffles"])
+              + " unique prizes simulated")
+    if report["mapping_errors"]:
+        print("Ticket mapping: " + str(report["mapping_errors"]) + " participants don't get exactly their tickets!")
+    else:
+        print("Ticket mapping: OK, every ticket number maps to its holder")
+    print("Chi-square: " + str(round(report["chi_square"], 2)) + " on " + str(report["dof"])
+          + " degrees of freedom, p-value " + str(round(report["p_value"], 4))
+          + (" -> OK" if report["p_value"] >= fairness.SIGNIFICANCE else " -> BIASED"))
+    print("Printed chances are off by at most " + str(round(report["max_chance_error"], 6))
+          + " percentage points, printed ticket counts by at most " + str(round(report["max_ticket_ratio_error"], 6)))
+    if raffle.use_sqrt:
+        print("--sqrt tickets are at most " + str(round(report["max_sqrt_truncation"] * 100, 6))
+              + "% below the exact square roots")
+    print("Verification " + ("passed" if report["passed"] else "FAILED") + "\n")
+    return report
+
 
+def open_results(raffle, out_path):
+    return export.RowWriter(out_path,
+                            ["prize", "winning_number", "address", raffle.amount_unit.lower(), "tickets", "chance"])
 
-def get_min_tokens():
+
+def get_min_tokens(min_tokens_arg):
     if min_tokens_arg is None:
         _min_tokens = 0
     else:
@@ -120,210 +268,240 @@ def get_min_tokens():
     return _min_tokens
 
 
-def maybe_apply_sqrt(num):
-    if use_sqrt:
-        return math.sqrt(num)
-        # if more than 1 winners, do sqrt operation when collecting eligible participants
-    else:
-        return num
-
-
-# Parsing Args
-args = parse_all_args()
-
-poolId = args.id
-policyId = args.policyId
-
-exclude_addresses = args.exclude_addresses
-number_winners_arg = args.number_winners
-min_tokens_arg = args.min_tokens
-unique = args.unique
-use_sqrt = args.sqrt
-
-million = 1000000
-delegator_str = "delegator"
-token_hodler_str = "token_hodler"
-
-giveaway_type = ""
-try_bech32 = False
-
-if poolId is None and policyId is None:
-    print("Neither --pool-id nor --policy-id was specified!")
-    exit()
-elif poolId is not None and policyId is not None:
-    print("--pool-id and --policy-id arguments are not supported, please use only one of them.")
-    exit()
-elif poolId is not None:
-    giveaway_type = delegator_str
-elif policyId is not None:
-    giveaway_type = token_hodler_str
-    try_bech32 = True
-
-# TODO:implement --exclude for token giveaways
-if giveaway_type == token_hodler_str and exclude_addresses is not None:
-    print("--exclude ADDRESSES param is not yet supported for token giveaways and will be ignored.")
-
-min_tokens = get_min_tokens()
-
-ledger = args.ledger
-
-if number_winners_arg is not None:
-    number_winners = abs(int(number_winners_arg))
-else:
-    number_winners = 1
-
-problems = 0
-
-if not path.exists(ledger):
-    print("We tried but could not locate your ledger-state JSON file!")
-    print("Use: \033[1;34mcardano-cli query ledger-state --mainnet --out-file ledger.json\033[0m to export one!")
-    exit()
-
-with open(ledger) as ledger_stream:
-    ledger = json.load(ledger_stream)
-
-eligible_participants_total = 0
-eligible_participants = {}
-
-ineligible_participants_total = 0
-eligible_tokens_total = 0
-ineligible_tokens_total = 0
-
-sqrt_eligible_tokens_total = 0
-
-if giveaway_type == delegator_str:
-    stakequery = "pstakeSet"
-    stakeinfo = "active"
-
-    blockstakedelegators = {}
-    blockstake = {}
-    bs = {}
-
-    epoch = ledger['lastEpoch']
-    print("Current Epoch: " + str(epoch))
-    totalRecordedActiveStake = int(ledger['stakeDistrib'][poolId]['individualPoolStake']['numerator']) / million
-    stateBefore = ledger["stateBefore"]
-    # Exclude pool owners and reward accounts
-    poolData = stateBefore['esLState']['delegationState']['pstate']['pParams pState'][poolId]
-    pool_owners = poolData['owners']
-    pool_rewards = poolData['rewardAccount']['credential']['key hash']
-    ledger_set = stateBefore["esSnapshots"][stakequery]
-
-    if exclude_addresses is None:
-        exclude_addresses = ""
-    for po in pool_owners:
-        exclude_addresses += "," + str(po)
-    if not exclude_addresses.__contains__(pool_rewards):
-        exclude_addresses += str(pool_rewards)
-    print("Excluding the following addresses: " + str(exclude_addresses))
-
-    # Retrieve list of delegators
-    for item2 in ledger_set["delegations"]:
-        keyhashobj = []
-        for itemsmall in item2:
-            if "key hash" in itemsmall:
-                keyhashobj.append(itemsmall["key hash"])
-            else:
-                poolid = itemsmall
-        if poolid not in blockstakedelegators:
-            blockstakedelegators[poolid] = keyhashobj
+def get_number_winners(number_winners_arg):
+    if number_winners_arg is not None:
+        return abs(int(number_winners_arg))
+    return 1
+
+
+def collect_delegators(raffle, ledger_extract):
+    try:
+        totals = giveaway.collect_delegators(raffle, ledger_extract)
+    except ValueError as error:
+        # the history filters don't fit the ledger's epoch
+        print(error)
+        return False
+    if totals is None:
+        print("Could not find pool " + raffle.pool_id + " in the ledger-state file!")
+        return False
+
+    print("Current Epoch: " + str(totals["epoch"]))
+    print("Excluding the pool owners and reward account: " + ",".join(totals["pool_owners"]))
+    print("Total # of excluded addresses/credentials: " + str(totals["excluded"]))
+    print("Total pool stake on record: " + str(totals["recorded_stake"]))
+    print("Total calculated pool stake (ADA): " + str((totals["eligible_amount"] + totals["ineligible_amount"])) + "\n")
+    print("Total # of eligible addresses: " + str(totals["eligible"]))
+    print("Total eligible stake (ADA): " + str(totals["eligible_amount"]))
+    return True
+
+
+def collect_token_holders(raffle, ledger_extract):
+    totals = giveaway.collect_token_holders(raffle, ledger_extract)
+    if totals["excluded"]:
+        print("Total # of excluded addresses/credentials: " + str(totals["excluded"]))
+    print("Total # token holders: " + str(totals["ineligible"] + totals["eligible"]))
+    print("Total # tokens minted: " + str(totals["eligible_amount"] + totals["ineligible_amount"]))
+    print("Total # eligible token holders: " + str(totals["eligible"]))
+    print("Total # eligible tokens: " + str(totals["eligible_amount"]))
+    return True
+
+
+def run_raffle(raffle, ledger_extract):
+    print("=== " + raffle.name + " ===")
+    with raffle.metrics.phase("eligibility"):
+        if raffle.giveaway_type == giveaway.delegator_str:
+            collected = collect_delegators(raffle, ledger_extract)
         else:
-            blockstakedelegators[poolid] = (
-                    blockstakedelegators[poolid] + keyhashobj
-            )
-
-    for item2 in ledger_set["stake"]:
-        delegatorid = None
-        for itemsmall in item2:
-            if isinstance(itemsmall, int):
-                snapstake = itemsmall
-            else:
-                delegatorid = itemsmall["key hash"]
-        if delegatorid is not None:
-            if delegatorid not in blockstake:
-                blockstake[delegatorid] = snapstake
-            else:
-                blockstake[delegatorid] = blockstake[delegatorid] + snapstake
-    total_bs = 0
-    for delegator in blockstakedelegators[poolId]:
-        if delegator in blockstake:
-            activestake = blockstake[delegator] / million
-            if exclude_addresses.__contains__(delegator) or min_tokens > activestake:
-                ineligible_tokens_total += activestake
-                ineligible_participants_total += 1
-            else:
-                eligible_tokens_total += activestake
-                # s_activestake = maybe_apply_sqrt(activestake)
-                eligible_participants[delegator] = activestake
-    if use_sqrt:
-        sqrt_eligible_tokens_total = 0
-        for participant in eligible_participants:
-            participant_tickets = eligible_participants[participant]
-            sqrt_tickets = math.sqrt(participant_tickets)
-            eligible_participants[participant] = sqrt_tickets
-            sqrt_eligible_tokens_total += sqrt_tickets
-    eligible_participants_total = len(eligible_participants)
-    print("Total pool stake on record: " + str(totalRecordedActiveStake))
-    print("Total calculated pool stake (ADA): " + str((eligible_tokens_total + ineligible_tokens_total)) + "\n")
-    print("Total # of eligible addresses: " + str(eligible_participants_total))
-    print("Total eligible stake (ADA): " + str(eligible_tokens_total))
-
-elif giveaway_type == token_hodler_str:
-    utxos = ledger["stateBefore"]['esLState']['utxoState']['utxo']
-    for utxo in utxos:
-        numberOfTokens = 0
-        for policy in utxos[utxo]['amount']['policies']:
-            if policy == policyId:
-                address = utxos[utxo]['address']
-                ph_tokens = 0
-                for x in utxos[utxo]['amount']['policies'][policyId]:
-                    ph_tokens += (utxos[utxo]['amount']['policies'][policyId][x])
-                if ph_tokens > min_tokens:
-                    policy_holder_address = eligible_participants.get(address)
-                    eligible_tokens_total += ph_tokens
-                    ph_tokens = maybe_apply_sqrt(ph_tokens)
-                    sqrt_eligible_tokens_total += ph_tokens
-                    if policy_holder_address is not None and policy_holder_address > 0:
-                        eligible_participants[address] += ph_tokens
-                        # discount multiple entries by same address
-                        eligible_participants_total -= 1
-                    else:
-                        eligible_participants[address] = ph_tokens
-                else:
-                    ph_tokens = maybe_apply_sqrt(ph_tokens)
-                    ineligible_tokens_total += ph_tokens
-                    ineligible_participants_total += 1
-
-    eligible_participants_total = len(eligible_participants)
-
-    print("Total # token holders: " + str(ineligible_participants_total + eligible_participants_total))
-    print("Total # tokens minted: " + str(eligible_tokens_total + ineligible_tokens_total))
-    print("Total # eligible token holders: " + str(eligible_participants_total))
-    print("Total # eligible tokens: " + str(eligible_tokens_total))
-
-if use_sqrt:
-    print("Total eligible tickets: " + str(sqrt_eligible_tokens_total))
-    eligible_tokens_total = sqrt_eligible_tokens_total
-
-ledger_stream.close()
-
-print("Full list of eligible participants:\n" + str(eligible_participants))
-# exit()
-# print()
-
-# if number_winners > 1:
-if unique and eligible_participants_total < number_winners:
-    exit("Too few delegators to pick from. Try a lower number of winners or omit --unique flag")
-tickets_total = round(eligible_tokens_total)
-for prize_num in range(number_winners):
+            collected = collect_token_holders(raffle, ledger_extract)
+    if not collected:
+        return
+
+    eligible_participants = raffle.eligible_participants
+    with raffle.metrics.phase("draw"):
+        draw = drawengine.from_dict(eligible_participants)
+    if raffle.use_sqrt:
+        print("Total eligible tickets: " + str(round(draw.total / raffle.ticket_unit)))
+
+    if raffle.export_path is not None and draw.total > 0:
+        with raffle.metrics.phase("export"):
+            exported = write_participants(raffle, draw.total, raffle.export_path)
+        print(str(exported) + " eligible participants written to " + raffle.export_path)
+
+    if raffle.verify_draws is not None:
+        with raffle.metrics.phase("verify"):
+            print_verification(raffle)
+        return
+
+    if raffle.unique and len(eligible_participants) < raffle.number_winners:
+        print("Too few delegators to pick from. Try a lower number of winners or omit --unique flag")
+        return
+    if raffle.batch:
+        with raffle.metrics.phase("draw"):
+            win_counts = drawengine.batch_win_counts(eligible_participants.values(), raffle.number_winners)
+        raffle.metrics.count("draws", raffle.number_winners)
+        write_batch_results(raffle, win_counts, raffle.batch_out)
+        print(str(raffle.number_winners) + " prizes drawn for " + str(sum(1 for wins in win_counts if wins > 0))
+              + " addresses, written to " + raffle.batch_out)
+        return
+
+    problems = 0
+    drawn = 0
+    # every prize is written out as soon as it is drawn
+    results = open_results(raffle, raffle.output) if raffle.output is not None else None
     try:
-        winning_num = random.randint(1, tickets_total)
-        tickets_total = process_winner(winning_num, prize_num + 1, tickets_total)
-    except:
-        problems += 1
-if problems > 0:
-    print("A number of problems occurred:" + str(problems))
-
-if not try_bech32 and giveaway_type == token_hodler_str:
-    print("You may need to use bech32 to convert winning addresses to 'addr...' format.\n")
-print("Done! Well done to the winners, best of luck next time to everyone else!")
+        with raffle.metrics.phase("draw"):
+            for prize_num in range(raffle.number_winners):
+                try:
+                    row = process_winner(raffle, draw, prize_num + 1)
+                except (ValueError, KeyError) as error:
+                    print("Prize #" + str(prize_num + 1) + " could not be drawn: " + str(error))
+                    problems += 1
+                    continue
+                drawn += 1
+                if results is not None:
+                    results.write(row)
+    finally:
+        if results is not None:
+            results.close()
+    raffle.metrics.count("draws", drawn)
+    if problems > 0:
+        print("A number of problems occurred:" + str(problems))
+    if results is not None:
+        print("Results written to " + raffle.output)
+
+
+def history_filter(store_dir, pool_id, new_since_epoch, stayed_since_epoch):
+    # The pool raffle's --new-since/--stayed-since filter, its epochs checked against the store
+    # before the ledger is read. Applied to the ledger's delegators once they are known.
+    raffle_filter = stakediff.history_filter(store_dir, new_since_epoch, stayed_since_epoch)
+    if raffle_filter is None or pool_id is None:
+        return None
+    return raffle_filter.check(pool_id)
+
+
+def raffles_from_args(args, metrics=None):
+    raffles = []
+    # a pool and a policy raffle in the same run get their own output files
+    both = args.id is not None and args.policyId is not None
+    for (name, suffix, pool_id, policy_id) in (("pool " + str(args.id), "-pool", args.id, None),
+                                               ("policy " + str(args.policyId), "-policy", None, args.policyId)):
+        if pool_id is None and policy_id is None:
+            continue
+        output, export_path, batch_out = args.output, args.export, args.batch_out
+        if both:
+            output, export_path, batch_out = (export.suffixed(out_path, suffix) if out_path is not None else None
+                                              for out_path in (output, export_path, batch_out))
+        raffles.append(giveaway.Raffle(name, pool_id=pool_id, policy_id=policy_id,
+                              number_winners=get_number_winners(args.number_winners),
+                              min_tokens=get_min_tokens(args.min_tokens), unique=args.unique, use_sqrt=args.sqrt,
+                              group_by_stake=args.group_by_stake,
+                              excluded=exclusions.load_exclusions(args.exclude_addresses, args.exclude_files),
+                              history_filter=history_filter(args.history_store, pool_id, args.new_since,
+                                                            args.stayed_since),
+                              batch=args.batch, batch_out=batch_out, output=output,
+                              export_path=export_path, verify_draws=args.verify_draws, metrics=metrics))
+    return raffles
+
+
+def raffles_from_config(config_path, metrics=None):
+    # {"raffles": [{"name": ..., "pool_id" or "policy_id": ..., "winners": 3, "min_tokens": 1, "sqrt": false,
+    #               "unique": true, "group_by_stake": false, "exclude": ["..."], "exclude_files": ["..."],
+    #               "new_since": 300, "stayed_since": 290, "history_store": "history",
+    #               "batch": false, "output": "results.csv", "export": "eligible.jsonl.gz", "verify": 1000000}, ...]}
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+    raffles = []
+    for i, entry in enumerate(config["raffles"]):
+        name = entry.get("name", "raffle-" + str(i + 1))
+        pool_id = entry.get("pool_id")
+        policy_id = entry.get("policy_id")
+        if (pool_id is None) == (policy_id is None):
+            print("Raffle " + name + " needs exactly one of pool_id or policy_id, skipping it.")
+            continue
+        if entry.get("batch", False) and entry.get("unique", False):
+            raise ValueError("Raffle " + name + ": batch draws winners with replacement, it can't be unique")
+        exclude = entry.get("exclude")
+        if isinstance(exclude, list):
+            exclude = ",".join(exclude)
+        excluded = exclusions.load_exclusions(exclude, entry.get("exclude_files"))
+        raffles.append(giveaway.Raffle(name, pool_id=pool_id, policy_id=policy_id,
+                              number_winners=get_number_winners(entry.get("winners")),
+                              min_tokens=get_min_tokens(entry.get("min_tokens")),
+                              unique=entry.get("unique", False), use_sqrt=entry.get("sqrt", False),
+                              group_by_stake=entry.get("group_by_stake", False),
+                              excluded=excluded,
+                              history_filter=history_filter(entry.get("history_store", "history"), pool_id,
+                                                            entry.get("new_since"), entry.get("stayed_since")),
+                              batch=entry.get("batch", False),
+                              batch_out=entry.get("batch_out", name + "-prizes.csv"),
+                              output=entry.get("output", name + ".csv"), export_path=entry.get("export"),
+                              verify_draws=entry.get("verify"), metrics=metrics))
+    return raffles
+
+
+def main():
+    args = parse_all_args()
+    run_metrics = phasemetrics.Metrics(trace_memory=args.trace_memory)
+
+    ledger = args.ledger
+
+    try:
+        jsonbackend.get_backend(args.json_backend)
+    except ValueError as error:
+        print(error)
+        exit()
+
+    if not path.exists(ledger):
+        print("We tried but could not locate your ledger-state file " + ledger + "!")
+        print("Use: \033[1;34mcardano-cli query ledger-state --mainnet --out-file ledger.json\033[0m to export one!")
+        exit()
+
+    if args.build_index:
+        print("Building ledger index, this may take a while...")
+        try:
+            print("Index written to " + ledgerindex.build_index(ledger, workers=args.workers,
+                                                                ledger_format=args.ledger_format,
+                                                                json_backend=args.json_backend))
+        except ValueError as error:
+            print(error)
+            exit()
+        if args.id is None and args.policyId is None and args.config is None:
+            exit()
+
+    if args.config is None and args.id is None and args.policyId is None:
+        print("Neither --pool-id nor --policy-id was specified!")
+        exit()
+
+    try:
+        if args.config is not None:
+            raffles = raffles_from_config(args.config, run_metrics)
+        else:
+            raffles = raffles_from_args(args, run_metrics)
+        for raffle in raffles:
+            for out_path in (raffle.output, raffle.export_path, raffle.batch_out if raffle.batch else None):
+                if out_path is not None:
+                    export.check_path(out_path)
+    except ValueError as error:
+        print(error)
+        exit()
+
+    # every raffle is served from the same single pass over the ledger
+    source = giveaway.LedgerSource(ledger, use_index=not args.no_index, workers=args.workers,
+                                   ledger_format=args.ledger_format, json_backend=args.json_backend,
+                                   metrics=run_metrics)
+    with run_metrics.phase("ledger_load"):
+        source.load(pool_ids={raffle.pool_id for raffle in raffles if raffle.pool_id is not None},
+                    policy_ids={raffle.policy_id for raffle in raffles if raffle.policy_id is not None})
+
+    for raffle in raffles:
+        run_raffle(raffle, source)
+
+    if args.metrics is not None:
+        run_metrics.write(args.metrics)
+        print("Metrics written to " + args.metrics)
+
+    print("Done! Well done to the winners, best of luck next time to everyone else!")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,15 @@
 #!/bin/env python3
-import json
+# Loyalty raffle: delegators' tickets add up the stake they kept with the pool, epoch after epoch.
+# A thin command line wrapper around giveaway.py's loyalty sources.
 import argparse
-import math
-import random
-import subprocess
-from os import path
-import requests
-from requests.structures import CaseInsensitiveDict
-import time
-import functools
 import datetime
-# poolId = 'pool1ksrg8a964464las0ymw88slrwxkychjz9lh09lqltu5m7nw3pq0'
-start_time = datetime.datetime.now()
 
-headers = CaseInsensitiveDict()
-headers["project_id"] = "3teoBXL8asW1eHbwNSwM8InJtJmNyFfJ"
-million = 1000000
-blockfrostURL = "https://cardano-mainnet.blockfrost.io"
+import drawengine
+import exclusions
+import export
+import giveaway
+import phasemetrics
 
-fetchFailureError="Fetching pool delegations failed. Trying again"
 
 def parse_all_args():
     python_cmd = "python3 randomdelegatorpicker.py "
@@ -40,10 +31,17 @@ def parse_all_args():
     parser.add_argument(
         '-e', "--exclude",
         dest="exclude_addresses",
-        help="if specified will exclude provided address(es) from the raffle.\nE.g. --exclude "
+        help="if specified will exclude provided address(es) from the raffle: stake key hashes, "
+             + "hex or bech32 addresses.\nE.g. --exclude "
              + "\"1b9bb7f381fd56c239903b380f44583ce5c43dd51a350497bc0824a4,"
                "002545ccd16d81e202288049d22f0a50c3fbf520cf2a206ccd7765ff\""
     )
+    parser.add_argument(
+        "--exclude-file",
+        dest="exclude_files",
+        action="append",
+        help="a file listing addresses to exclude, one per line ('#' starts a comment), can be repeated"
+    )
     parser.add_argument(
         '-w', "--winners",
         dest="number_winners",
@@ -60,67 +58,63 @@ def parse_all_args():
         help="if used, the winners will be unique (max 1 prize per address). "
              + "Only makes sense to use if --winners is specified."
     )
+    parser.add_argument(
+        "--blockfrost-url",
+        dest="blockfrost_url",
+        help="the Blockfrost API base URL (default: Blockfrost's mainnet API)"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=10,
+        help="the maximum number of Blockfrost requests in flight (default: 10)"
+    )
+    parser.add_argument(
+        "--cache",
+        default="",
+        help="the SQLite file caching delegators' history between runs (default: blockfrost-history.db)"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="if used, fetches every delegator's full history from Blockfrost without using the cache"
+    )
+    parser.add_argument(
+        "--history-store",
+        dest="history_store",
+        help="if specified will compute the loyalty tickets offline from this stake snapshot store "
+             + "(see loyaltystore.py) instead of fetching delegators' history from Blockfrost"
+    )
     parser.add_argument(
         '-s', "--sqrt",
         action="store_true",
         help="if used, the participants' number of tickets will be square rooted, "
              + "giving smaller guys a greater chance of winning."
     )
+    parser.add_argument(
+        "--export",
+        dest="export",
+        help="if specified will write every delegator with their stake, tickets and eligibility to this file "
+             + "(.csv or .jsonl, optionally .gz/.zst compressed)"
+    )
+    parser.add_argument(
+        "--metrics",
+        dest="metrics",
+        help="if specified will write the time, memory and counters of every phase of the run to this JSON file"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="if used, --metrics also records tracemalloc peaks per phase (slows the run down)"
+    )
     return parser.parse_args()
 
-def calculate_amount(a):
-    amount = extract_amount(a)
-    return round(maybe_apply_sqrt(amount / million))
-
-def extract_amount(a):
-    return int(a['amount'])
 
-def fetchBlockfrostList(str):
-    pageNum = 1
-    list = []
-    while True:
-        try:
-            response = requests.get(
-                f"{blockfrostURL}{str}?page={pageNum}",
-                # blockfrostURL + str + f"?page=1",
-                headers=headers)
-
-            if response.status_code == 200:
-                if response.content == b'[]':
-                    break
-                respList = response.json()
-                list.extend(respList)
-                pageNum += 1
-            else:
-                print("Retrying. Got response code " + str(response.status_code))
-        except:
-            print(fetchFailureError)
-    return list
-
-def process_winner(winning_num, prize_num, _total_tickets):
-    accum = 0
+def process_winner(raffle, draw, prize_num):
+    winning_num, participant, participant_tickets, total_tickets = giveaway.draw_prize(raffle, draw)
     print("Prize #" + str(prize_num) + " Winning number: " + str(winning_num))
-    for participant in eligible_participants:
-
-        (participant_tickets, participant_stake) = eligible_participants[participant]
-        if participant_tickets == 0:
-            continue
-        accum += participant_tickets
-        if accum >= winning_num:
-            print_result(participant, participant_stake, participant_tickets, _total_tickets)
-            winners.append(participant)
-            if unique:
-                eligible_participants[participant] = (0, 0)
-                _total_tickets -= participant_tickets
-            break
-    if round(accum) < winning_num:
-        print("!!! Something went wrong. accum < winning_num. " + ": accum =" + str(accum)
-              + ", winning_num = " + str(winning_num))
-    return _total_tickets
-
-
-def calculate_chance(tickets, total_tickets):
-    return round(tickets / total_tickets * 100, 2)
+    print_result(participant, raffle.participant_amounts[participant], participant_tickets, total_tickets)
+    return participant
 
 
 def print_result(winner, tokens, tickets, total_tickets):
@@ -132,10 +126,10 @@ def get_congrats_message(winner, tokens, tickets, total_tickets):
     return "Congrats to " + winner + " (~" + str(tokens) +" ADA) " \
            + " (" + str(tickets) + " out of " \
            + str(total_tickets) + " tickets, " \
-           + str(calculate_chance(tickets, total_tickets)) + "% chance)!\n"
+           + giveaway.calculate_chance(tickets, total_tickets) + "% chance)!\n"
 
 
-def get_min_tokens():
+def get_min_tokens(min_tokens_arg):
     if min_tokens_arg is None:
         _min_tokens = 0
     else:
@@ -143,88 +137,85 @@ def get_min_tokens():
     return _min_tokens
 
 
-def maybe_apply_sqrt(num):
-    if use_sqrt:
-        return math.sqrt(num)
-    else:
-        return num
-
-
-# Parsing Args
-args = parse_all_args()
-
-poolId = args.id
-
-exclude_addresses = args.exclude_addresses
-number_winners_arg = args.number_winners
-min_tokens_arg = args.min_tokens
-unique = args.unique
-use_sqrt = args.sqrt
-
-delegator_str = "delegator"
-token_hodler_str = "token_hodler"
-
-giveaway_type = ""
-
-if poolId is None:
-    print("--pool-id was not specified!")
-    exit()
-
-min_tokens = get_min_tokens()
-number_winners = abs(int(number_winners_arg)) if number_winners_arg is not None else 1
-
-fetchSuccessful = False
-delegsList = fetchBlockfrostList(f"/api/v0/pools/{poolId}/delegators")
-totalStakedAmount = 0
-eligible_participants = {}
-eligible_tickets_total = 0
-
-for deleg in delegsList:
-    stake_address = deleg['address']
-    fetchSuccessful = False
-    pageNum = 1
-
-    rewardsList = fetchBlockfrostList(f"/api/v0/accounts/{stake_address}/history")
-    # for rewards in rewardsList:
-    rewardsWithMyPool = list(filter(lambda a: a['pool_id'] == poolId, rewardsList))
-    rewardsLength = len(rewardsWithMyPool)
-    if rewardsLength > 1:
-        totalStakeWithMyPool = functools.reduce(lambda a, b :
-                                                calculate_amount(a) if isinstance(a, dict) else a + calculate_amount(b),
-                                                rewardsWithMyPool)
-        last_staked_amount = round(int(rewardsWithMyPool[len(rewardsWithMyPool) - 1]['amount']) / million)
-    elif rewardsLength == 1:
-        totalStakeWithMyPool = calculate_amount(rewardsList[0])
-        last_staked_amount = round(int(rewardsWithMyPool[len(rewardsWithMyPool) - 1]['amount']) / million)
-    else:
-        totalStakeWithMyPool = 0
-        last_staked_amount = 0
-    totalStakedAmount += last_staked_amount
-    print(stake_address + " : " + str(last_staked_amount) + " : " + str(totalStakeWithMyPool))
-    if last_staked_amount > min_tokens:
-        eligible_tickets_total += totalStakeWithMyPool
-        eligible_participants[stake_address] = (totalStakeWithMyPool,last_staked_amount)
-eligible_participants_total = len(eligible_participants)
-print("total staked amount: " + str(totalStakedAmount))
-print("Total # of eligible addresses: " + str(eligible_participants_total))
-
-if unique and eligible_participants_total < number_winners:
-    exit("Too few delegators to pick from. Try a lower number of winners or omit --unique flag")
-tickets_total = eligible_tickets_total
-errors = 0
-winners = []
-for prize_num in range(number_winners):
+def write_participants(raffle, participants, out_path):
+    # every delegator, eligible or not, with their loyalty tickets
+    with export.RowWriter(out_path, ["address", "ada", "tickets", "eligible"]) as writer:
+        writer.write_rows((stake_address, last_staked_amount, participants.weights[stake_address],
+                           stake_address in raffle.eligible_participants)
+                          for stake_address, last_staked_amount in participants.amounts.items())
+    return writer.rows
+
+
+def main():
+    start_time = datetime.datetime.now()
+    args = parse_all_args()
+    run_metrics = phasemetrics.Metrics(trace_memory=args.trace_memory)
+
+    if args.id is None:
+        print("--pool-id was not specified!")
+        exit()
+
+    if args.export is not None:
+        try:
+            export.check_path(args.export)
+        except ValueError as error:
+            exit(str(error))
+    number_winners = abs(int(args.number_winners)) if args.number_winners is not None else 1
     try:
-        winning_num = random.randint(1, tickets_total)
-        tickets_total = process_winner(winning_num, prize_num, tickets_total)
-    except:
-        errors += 1
-if errors > 0:
-    print("A number of errors occurred:" + str(errors))
-
-print(str(winners))
-print("Done! Well done to the winners, best of luck next time to everyone else!")
-end_time = datetime.datetime.now()
-print("Start time: " + str(start_time))
-print("End time: " + str(end_time))
-print("Total execution time: " + str(end_time - start_time))
+        excluded = exclusions.load_exclusions(args.exclude_addresses, args.exclude_files)
+    except ValueError as error:
+        exit(str(error))
+    raffle = giveaway.Raffle("loyalty " + args.id, pool_id=args.id, number_winners=number_winners,
+                             min_tokens=get_min_tokens(args.min_tokens), unique=args.unique, use_sqrt=args.sqrt,
+                             excluded=excluded, metrics=run_metrics, loyalty=True)
+
+    if args.history_store is not None:
+        # everything comes from the local snapshot store, no network access
+        source = giveaway.StoreLoyaltySource(args.history_store)
+    else:
+        source = giveaway.BlockfrostLoyaltySource(base_url=args.blockfrost_url, concurrency=args.concurrency,
+                                                  cache_path=args.cache, use_cache=not args.no_cache)
+    participants = source.participants(raffle)
+    if "cache_hits" in run_metrics.counters:
+        print("History cache hits: " + str(run_metrics.counters["cache_hits"]))
+    if "http_requests" in run_metrics.counters:
+        print("Blockfrost requests: " + str(run_metrics.counters["http_requests"]) + ", retries: "
+              + str(run_metrics.counters["http_retries"]))
+    run_metrics.set("delegators_seen", len(participants))
+
+    totals = giveaway.collect_participants(raffle, participants)
+    # the full list goes to --export, row by row, the console only gets the totals
+    if args.export is not None:
+        print(str(write_participants(raffle, participants, args.export)) + " delegators written to " + args.export)
+    print("total staked amount: " + str(totals["eligible_amount"] + totals["ineligible_amount"]))
+    print("Total # of eligible addresses: " + str(totals["eligible"]))
+
+    if raffle.unique and totals["eligible"] < number_winners:
+        exit("Too few delegators to pick from. Try a lower number of winners or omit --unique flag")
+    errors = 0
+    winners = []
+    with run_metrics.phase("draw"):
+        draw = drawengine.from_dict(raffle.eligible_participants)
+        for prize_num in range(number_winners):
+            try:
+                winners.append(process_winner(raffle, draw, prize_num))
+            except (ValueError, KeyError) as error:
+                print("Prize #" + str(prize_num) + " could not be drawn: " + str(error))
+                errors += 1
+    run_metrics.set("draws", len(winners))
+    if errors > 0:
+        print("A number of errors occurred:" + str(errors))
+
+    print(str(winners))
+    print("Done! Well done to the winners, best of luck next time to everyone else!")
+    end_time = datetime.datetime.now()
+    print("Start time: " + str(start_time))
+    print("End time: " + str(end_time))
+    print("Total execution time: " + str(end_time - start_time))
+    if args.metrics is not None:
+        run_metrics.write(args.metrics)
+        print("Metrics written to " + args.metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/bin/env python3
+# Epoch-over-epoch delegator diff of a pool, from the loyalty history store (see loyaltystore.py).
+#
+# Stored snapshots are sorted by stake key hash, so two epochs are compared with a single merge
+# over both memory-mapped files: O(pool size), only the current rows held in memory. The same
+# snapshots give randomdelegatorpicker.py its --new-since and --stayed-since eligibility filters.
+import argparse
+
+import cardanoaddress
+import export
+import loyaltystore
+
+JOINED = "joined"
+LEFT = "left"
+GREW = "grew"
+SHRANK = "shrank"
+UNCHANGED = "unchanged"
+CHANGES = (JOINED, LEFT, GREW, SHRANK, UNCHANGED)
+million = 1000000
+
+
+def _stored_epochs(store_dir, pool_id, *wanted):
+    pool_epochs = loyaltystore.epochs(store_dir, pool_id)
+    for epoch in wanted:
+        if epoch not in pool_epochs:
+            raise ValueError("Epoch " + str(epoch) + " of pool " + pool_id + " is not in the history store "
+                             + store_dir + ", add its ledger-state with loyaltystore.py first")
+    return pool_epochs
+
+
+def latest_epoch(store_dir, pool_id):
+    pool_epochs = loyaltystore.epochs(store_dir, pool_id)
+    if not pool_epochs:
+        raise ValueError("Pool " + pool_id + " has no epochs in the history store " + store_dir)
+    return pool_epochs[-1]
+
+
+def iter_diff(store_dir, pool_id, old_epoch, new_epoch):
+    # Yields (stake key hash, change, old lovelace, new lovelace) sorted by key hash, a stake is None
+    # when the delegator isn't in that epoch's snapshot.
+    _stored_epochs(store_dir, pool_id, old_epoch, new_epoch)
+    old = loyaltystore.iter_snapshot(store_dir, pool_id, old_epoch)
+    new = loyaltystore.iter_snapshot(store_dir, pool_id, new_epoch)
+    old_row = next(old, None)
+    new_row = next(new, None)
+    while old_row is not None or new_row is not None:
+        if new_row is None or (old_row is not None and old_row[0] < new_row[0]):
+            yield old_row[0], LEFT, old_row[1], None
+            old_row = next(old, None)
+        elif old_row is None or new_row[0] < old_row[0]:
+            yield new_row[0], JOINED, None, new_row[1]
+            new_row = next(new, None)
+        else:
+            old_stake, new_stake = old_row[1], new_row[1]
+            change = GREW if new_stake > old_stake else SHRANK if new_stake < old_stake else UNCHANGED
+            yield new_row[0], change, old_stake, new_stake
+            old_row = next(old, None)
+            new_row = next(new, None)
+
+
+def new_since(store_dir, pool_id, epoch, ledger_epoch, delegators):
+    # The ledger's delegators (stake key hashes of the pool in the ledger being drawn, at
+    # ledger_epoch) who weren't delegated to the pool in the given stored epoch.
+    if epoch >= ledger_epoch:
+        raise ValueError("--new-since " + str(epoch) + " has to be before the ledger's epoch " + str(ledger_epoch))
+    _stored_epochs(store_dir, pool_id, epoch)
+    before = {delegator for delegator, _ in loyaltystore.iter_snapshot(store_dir, pool_id, epoch)}
+    return {delegator for delegator in delegators if delegator not in before}
+
+
+def stayed_since(store_dir, pool_id, epoch, ledger_epoch, delegators):
+    # The ledger's delegators who were also delegated to the pool in every stored epoch from the
+    # given one up to the ledger's.
+    if epoch > ledger_epoch:
+        raise ValueError("--stayed-since " + str(epoch) + " is after the ledger's epoch " + str(ledger_epoch))
+    stayed = set(delegators)
+    for stored_epoch in _stored_epochs(store_dir, pool_id, epoch):
+        if epoch <= stored_epoch < ledger_epoch:
+            stayed.intersection_update(delegator for delegator, _ in
+                                       loyaltystore.iter_snapshot(store_dir, pool_id, stored_epoch))
+    return stayed
+
+
+class HistoryFilter:
+    # The --new-since/--stayed-since eligibility filters of a pool raffle. They are applied to the
+    # delegators of the ledger being drawn, compared with the snapshots stored before its epoch, so
+    # that delegators who joined after the last stored epoch aren't left out.
+    def __init__(self, store_dir, joined_since=None, kept_since=None):
+        self.store_dir = store_dir
+        self.joined_since = joined_since
+        self.kept_since = kept_since
+
+    def check(self, pool_id):
+        # Raises ValueError when the store lacks an epoch the filters need, before any ledger is read.
+        _stored_epochs(self.store_dir, pool_id, *[epoch for epoch in (self.joined_since, self.kept_since)
+                                                 if epoch is not None])
+        return self
+
+    def allowed(self, pool_id, ledger_epoch, delegators):
+        # The delegators passing the filters, out of the ledger's delegators of the pool.
+        allowed = set(delegators)
+        if self.joined_since is not None:
+            allowed &= new_since(self.store_dir, pool_id, self.joined_since, ledger_epoch, delegators)
+        if self.kept_since is not None:
+            allowed &= stayed_since(self.store_dir, pool_id, self.kept_since, ledger_epoch, delegators)
+        return allowed
+
+
+def history_filter(store_dir, joined_since=None, kept_since=None):
+    # None when neither filter is used.
+    if joined_since is None and kept_since is None:
+        return None
+    return HistoryFilter(store_dir, joined_since, kept_since)
+
+
+def write_diff(store_dir, pool_id, old_epoch, new_epoch, out_path=None, changes=CHANGES):
+    # Streams the diff to out_path (CSV or JSONL, see export.py) if given and returns the totals:
+    # number of delegators per change, plus the net stake change in ADA.
+    totals = dict.fromkeys(CHANGES, 0)
+    net_stake = 0
+    writer = None
+    if out_path is not None:
+        writer = export.RowWriter(out_path, ["stake_address", "change", "old_ada", "new_ada", "delta_ada"])
+    try:
+        for delegator, change, old_stake, new_stake in iter_diff(store_dir, pool_id, old_epoch, new_epoch):
+            totals[change] += 1
+            delta = (new_stake or 0) - (old_stake or 0)
+            net_stake += delta
+            if writer is not None and change in changes:
+                writer.write([cardanoaddress.encode_stake_addresses([delegator])[0], change,
+                              "" if old_stake is None else old_stake / million,
+                              "" if new_stake is None else new_stake / million, delta / million])
+    finally:
+        if writer is not None:
+            writer.close()
+    totals["net_ada"] = net_stake / million
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show which delegators joined, left, grew or shrank between two epochs of a pool, "
+                    + "from the loyalty history store.")
+    parser.add_argument('-i', "--pool-id", dest="id", required=True, help="the pool ID")
+    parser.add_argument('-d', "--store", dest="store", default="history",
+                        help="the history store directory (default: history)")
+    parser.add_argument('-l', "--ledger", dest="ledgers", action="append",
+                        help="a ledger-state file (JSON or CBOR) to add to the store first, can be repeated")
+    parser.add_argument("--from", dest="old_epoch", type=int,
+                        help="the epoch to compare from (default: the stored epoch before --to)")
+    parser.add_argument("--to", dest="new_epoch", type=int,
+                        help="the epoch to compare to (default: the latest stored epoch)")
+    parser.add_argument('-o', "--output", dest="output",
+                        help="if specified will write every changed delegator to this file "
+                             + "(.csv or .jsonl, optionally .gz/.zst compressed)")
+    parser.add_argument("--changes", dest="changes", default=",".join(CHANGES[:-1]),
+                        help="the changes written to --output, comma separated (default: joined,left,grew,shrank)")
+    args = parser.parse_args()
+
+    pool_id = loyaltystore.pool_hex(args.id)
+    for ledger in args.ledgers or []:
+        print(ledger + ": epoch " + str(loyaltystore.ingest(args.store, ledger, [pool_id])) + " stored")
+    try:
+        if args.output is not None:
+            export.check_path(args.output)
+        changes = [change.strip() for change in args.changes.split(",") if change.strip()]
+        for change in changes:
+            if change not in CHANGES:
+                raise ValueError("Unknown change " + change + ", expected some of " + ",".join(CHANGES))
+        pool_epochs = loyaltystore.epochs(args.store, pool_id)
+        new_epoch = args.new_epoch if args.new_epoch is not None else latest_epoch(args.store, pool_id)
+        old_epoch = args.old_epoch
+        if old_epoch is None:
+            earlier = [epoch for epoch in pool_epochs if epoch < new_epoch]
+            if not earlier:
+                raise ValueError("No stored epoch before " + str(new_epoch) + " to compare with")
+            old_epoch = earlier[-1]
+        totals = write_diff(args.store, pool_id, old_epoch, new_epoch, args.output, changes)
+    except ValueError as error:
+        print(error)
+        exit()
+
+    print("Epoch " + str(old_epoch) + " -> " + str(new_epoch))
+    for change in CHANGES:
+        print(change.capitalize() + ": " + str(totals[change]))
+    print("Net stake change (ADA): " + str(totals["net_ada"]))
+    if args.output is not None:
+        print("Changes written to " + args.output)
@@ -0,0 +1,189 @@
+#!/bin/env python3
+# BlockfrostClient against a local aiohttp mock of the Blockfrost API: pagination, parallel pages,
+# 429/Retry-After, 5xx backoff and its retry ceiling, 404s, and the 10/s (burst 500) token bucket.
+# Needs aiohttp, like the client.
+# Run with: python3 -m unittest test_blockfrost (or pytest)
+import asyncio
+import unittest
+from unittest import mock
+
+import blockfrost
+
+try:
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+except ImportError:
+    web = None
+
+POOL = "pool1test"
+DELEGATORS = 250
+LONG_HISTORY = 350
+# every mocked request takes this long, so that parallel requests overlap
+LATENCY = 0.02
+
+
+def _page(items, request):
+    page = int(request.query.get("page", 1))
+    count = int(request.query.get("count", 100))
+    return items[(page - 1) * count:page * count]
+
+
+class MockBlockfrost:
+    def __init__(self):
+        self.delegators = [{"address": "stake_test" + str(i), "live_stake": str(i)} for i in range(DELEGATORS)]
+        self.hits = {}
+        self.pages = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.flaky_left = 1
+        self.app = web.Application()
+        self.app.router.add_get("/api/v0/pools/{pool}/delegators", self.pool_delegators)
+        self.app.router.add_get("/api/v0/accounts/{address}/history", self.history)
+        self.app.router.add_get("/api/v0/flaky", self.flaky)
+        self.app.router.add_get("/api/v0/broken", self.broken)
+
+    async def _enter(self, request):
+        if request.headers.get("project_id") != "test-project":
+            raise web.HTTPForbidden()
+        self.hits[request.path] = self.hits.get(request.path, 0) + 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(LATENCY)
+        self.in_flight -= 1
+
+    async def pool_delegators(self, request):
+        await self._enter(request)
+        if request.match_info["pool"] != POOL:
+            raise web.HTTPNotFound()
+        self.pages.append(int(request.query["page"]))
+        return web.json_response(_page(self.delegators, request))
+
+    async def history(self, request):
+        await self._enter(request)
+        address = request.match_info["address"]
+        epochs = LONG_HISTORY if address == "stake_long" else 3
+        rows = [{"active_epoch": 300 + i, "amount": str(1000000 * (i + 1)), "pool_id": POOL} for i in range(epochs)]
+        return web.json_response(_page(rows, request))
+
+    async def flaky(self, request):
+        await self._enter(request)
+        if self.flaky_left:
+            self.flaky_left -= 1
+            return web.json_response({"error": "Too Many Requests"}, status=429, headers={"Retry-After": "0.05"})
+        return web.json_response({"ok": True})
+
+    async def broken(self, request):
+        await self._enter(request)
+        return web.json_response({"error": "Service Unavailable"}, status=503)
+
+
+@unittest.skipIf(web is None, "aiohttp is not installed")
+class BlockfrostClientTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.mock = MockBlockfrost()
+        self.server = TestServer(self.mock.app)
+        await self.server.start_server()
+        self.base_url = str(self.server.make_url("")).rstrip("/")
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    def client(self, **options):
+        return blockfrost.BlockfrostClient("test-project", base_url=self.base_url, **options)
+
+    def spy_delays(self, client):
+        # records the retry delays the client picks, without changing them
+        delays = []
+        pick = client._retry_delay
+
+        def recorded(attempt, retry_after=None):
+            delays.append(pick(attempt, retry_after))
+            return delays[-1]
+        client._retry_delay = recorded
+        return delays
+
+    async def test_paginated_delegators(self):
+        async with self.client() as client:
+            delegators = await client.fetch_list("/api/v0/pools/" + POOL + "/delegators")
+        self.assertEqual(delegators, self.mock.delegators)
+        # the first page alone, then pages 2-5 at once (page_concurrency), the short page 3 ends the list
+        self.assertEqual(self.mock.pages[0], 1)
+        self.assertEqual(sorted(self.mock.pages[1:]), [2, 3, 4, 5])
+        self.assertEqual(client.retries, 0)
+
+    async def test_histories_fetched_in_parallel(self):
+        paths = ["/api/v0/accounts/stake_test" + str(i) + "/history" for i in range(20)]
+        async with self.client(concurrency=10) as client:
+            histories = await client.fetch_lists(paths)
+        self.assertEqual([len(history) for history in histories], [3] * 20)
+        self.assertGreater(self.mock.max_in_flight, 1)
+        self.assertLessEqual(self.mock.max_in_flight, 10)
+        self.assertEqual(client.requests, 20)
+
+    async def test_history_pages_in_parallel(self):
+        async with self.client() as client:
+            history = await client.fetch_list("/api/v0/accounts/stake_long/history")
+        self.assertEqual([row["active_epoch"] for row in history], list(range(300, 300 + LONG_HISTORY)))
+        self.assertGreater(self.mock.max_in_flight, 1)
+
+    async def test_429_honours_retry_after(self):
+        async with self.client() as client:
+            delays = self.spy_delays(client)
+            self.assertEqual(await client.get("/api/v0/flaky"), {"ok": True})
+        self.assertEqual(delays, [0.05])
+        self.assertEqual((client.requests, client.retries), (2, 1))
+
+    async def test_5xx_backoff_and_retry_ceiling(self):
+        async with self.client(max_retries=3, backoff=0.01, max_backoff=0.02) as client:
+            delays = self.spy_delays(client)
+            with self.assertRaises(blockfrost.BlockfrostError) as raised:
+                await client.get("/api/v0/broken")
+        self.assertEqual(raised.exception.status, 503)
+        self.assertEqual((client.requests, client.retries), (4, 3))
+        self.assertEqual(self.mock.hits["/api/v0/broken"], 4)
+        # exponential, jittered down to half, capped at max_backoff
+        for delay, ceiling in zip(delays, (0.01, 0.02, 0.02)):
+            self.assertTrue(ceiling / 2 <= delay <= ceiling, (delay, ceiling))
+        self.assertEqual(len(delays), 3)
+
+    async def test_404_is_empty(self):
+        async with self.client() as client:
+            self.assertIsNone(await client.get("/api/v0/pools/pool1unknown/delegators"))
+            self.assertEqual(await client.fetch_list("/api/v0/pools/pool1unknown/delegators"), [])
+        self.assertEqual(client.retries, 0)
+
+    async def test_client_rate_limits(self):
+        client = self.client()
+        self.assertEqual((client.bucket.rate, client.bucket.burst), (blockfrost.RATE_LIMIT, blockfrost.BURST_LIMIT))
+        self.assertEqual((blockfrost.RATE_LIMIT, blockfrost.BURST_LIMIT), (10, 500))
+
+
+class TokenBucketTest(unittest.IsolatedAsyncioTestCase):
+    async def test_burst_then_rate(self):
+        now = [0.0]
+
+        async def sleep(delay):
+            # a little over, as a real clock would be, or float rounding can leave the bucket a hair short
+            now[0] += delay + 1e-9
+
+        bucket = blockfrost.TokenBucket(10, 500, clock=lambda: now[0])
+        with mock.patch("asyncio.sleep", sleep):
+            for _ in range(500):
+                await bucket.acquire()
+            self.assertEqual(now[0], 0)
+            # past the burst, 10 per second
+            for _ in range(100):
+                await bucket.acquire()
+            self.assertAlmostEqual(now[0], 10, places=6)
+            # an idle bucket refills up to the burst, not beyond
+            now[0] += 3600
+            start = now[0]
+            for _ in range(500):
+                await bucket.acquire()
+            self.assertEqual(now[0], start)
+            await bucket.acquire()
+            self.assertAlmostEqual(now[0] - start, 0.1, places=6)
+
+
+if __name__ == "__main__":
+    unittest.main()
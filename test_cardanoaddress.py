@@ -0,0 +1,97 @@
+#!/bin/env python3
+# The in-process address codec against the test vectors of CIP-19 (every Shelley address type, on
+# mainnet and testnet) and two Byron addresses, one of each era.
+# Run with: python3 -m unittest test_cardanoaddress (or pytest)
+import unittest
+import zlib
+
+import cardanoaddress
+
+PAYMENT_KEY_HASH = "9493315cd92eb5d8c4304e67b7e16ae36d61d34502694657811a2c8e"
+STAKE_KEY_HASH = "337b62cfff6403a06a3acbc34f8c46003c69fe79a3628cefa9c47251"
+SCRIPT_HASH = "c37b1b5dc0669f1d3c61a6fddb2e8fde96be87b881c60bce8e8d542f"
+# slot 2498243, transaction 27, certificate 3
+POINTER = "8198bd431b03"
+
+# CIP-19: (address, header, payload after the header)
+SHELLEY_VECTORS = [
+    ("addr1qx2fxv2umyhttkxyxp8x0dlpdt3k6cwng5pxj3jhsydzer3n0d3vllmyqwsx5wktcd8cc3sq835lu7drv2xwl2wywfgse35a3x",
+     0x01, PAYMENT_KEY_HASH + STAKE_KEY_HASH),
+    ("addr1z8phkx6acpnf78fuvxn0mkew3l0fd058hzquvz7w36x4gten0d3vllmyqwsx5wktcd8cc3sq835lu7drv2xwl2wywfgs9yc0hh",
+     0x11, SCRIPT_HASH + STAKE_KEY_HASH),
+    ("addr1yx2fxv2umyhttkxyxp8x0dlpdt3k6cwng5pxj3jhsydzerkr0vd4msrxnuwnccdxlhdjar77j6lg0wypcc9uar5d2shs2z78ve",
+     0x21, PAYMENT_KEY_HASH + SCRIPT_HASH),
+    ("addr1x8phkx6acpnf78fuvxn0mkew3l0fd058hzquvz7w36x4gt7r0vd4msrxnuwnccdxlhdjar77j6lg0wypcc9uar5d2shskhj42g",
+     0x31, SCRIPT_HASH + SCRIPT_HASH),
+    ("addr1gx2fxv2umyhttkxyxp8x0dlpdt3k6cwng5pxj3jhsydzer5pnz75xxcrzqf96k", 0x41, PAYMENT_KEY_HASH + POINTER),
+    ("addr128phkx6acpnf78fuvxn0mkew3l0fd058hzquvz7w36x4gtupnz75xxcrtw79hu", 0x51, SCRIPT_HASH + POINTER),
+    ("addr1vx2fxv2umyhttkxyxp8x0dlpdt3k6cwng5pxj3jhsydzers66hrl8", 0x61, PAYMENT_KEY_HASH),
+    ("addr1w8phkx6acpnf78fuvxn0mkew3l0fd058hzquvz7w36x4gtcyjy7wx", 0x71, SCRIPT_HASH),
+    ("stake1uyehkck0lajq8gr28t9uxnuvgcqrc6070x3k9r8048z8y5gh6ffgw", 0xe1, STAKE_KEY_HASH),
+    ("stake178phkx6acpnf78fuvxn0mkew3l0fd058hzquvz7w36x4gtcccycj5", 0xf1, SCRIPT_HASH),
+    ("addr_test1qz2fxv2umyhttkxyxp8x0dlpdt3k6cwng5pxj3jhsydzer3n0d3vllmyqwsx5wktcd8cc3sq835lu7drv2xwl2wywfgs68faae",
+     0x00, PAYMENT_KEY_HASH + STAKE_KEY_HASH),
+    ("addr_test1vz2fxv2umyhttkxyxp8x0dlpdt3k6cwng5pxj3jhsydzerspjrlsz", 0x60, PAYMENT_KEY_HASH),
+    ("stake_test1uqehkck0lajq8gr28t9uxnuvgcqrc6070x3k9r8048z8y5gssrtvn", 0xe0, STAKE_KEY_HASH),
+    ("stake_test17rphkx6acpnf78fuvxn0mkew3l0fd058hzquvz7w36x4gtcljw6kf", 0xf0, SCRIPT_HASH),
+]
+
+# (address, CBOR bytes): an Icarus and a Daedalus address
+BYRON_VECTORS = [
+    ("Ae2tdPwUPEZFRbyhz3cpfC2CumGzNkFBN2L42rcUc2yjQpEkxDbkPodpMAi",
+     "82d818582183581cba970ad36654d8dd8f74274b733452ddeab9a62a397746be3c42ccdda0001a9026da5b"),
+    ("DdzFFzCqrhsw3prhfMFDNFowbzUku3QmrMwarfjUbWXRisodn97R436SHc1rimp4MhPNmbdYb1aTdqtGSJixMVMi5MkArDQJ6Sc1n3Ez",
+     "82d818584283581c83ff43ed8337e0b719c5c2fc4ec75de4c70aa4865c0b269fb29bb9f6a101581e581cb4fe3afaea801fd92105caf1f0"
+     "231485dd6e8f614f5b77eab08dad72001ad07eeb1b"),
+]
+
+
+class Cip19Test(unittest.TestCase):
+    def test_shelley_vectors(self):
+        for address, header, payload in SHELLEY_VECTORS:
+            with self.subTest(address):
+                raw = bytes([header]) + bytes.fromhex(payload)
+                self.assertEqual(cardanoaddress.encode_address(raw), address)
+                self.assertEqual(cardanoaddress.bech32_decode(address), (address.split("1", 1)[0], raw))
+                self.assertEqual(cardanoaddress.bech32_decode(address.upper())[1], raw)
+
+    def test_batch_encoding(self):
+        hex_addresses = [("%02x" % header) + payload for _, header, payload in SHELLEY_VECTORS]
+        hex_addresses += [raw for _, raw in BYRON_VECTORS]
+        cache = {}
+        expected = [address for address, _, _ in SHELLEY_VECTORS] + [address for address, _ in BYRON_VECTORS]
+        self.assertEqual(cardanoaddress.encode_addresses(hex_addresses, cache=cache), expected)
+        self.assertEqual(cardanoaddress.encode_addresses(hex_addresses[::-1], cache=cache), expected[::-1])
+        self.assertEqual(len(cache), len(expected))
+
+    def test_stake_key_hashes(self):
+        self.assertEqual(cardanoaddress.encode_stake_addresses([STAKE_KEY_HASH, STAKE_KEY_HASH]),
+                         ["stake1uyehkck0lajq8gr28t9uxnuvgcqrc6070x3k9r8048z8y5gh6ffgw"] * 2)
+        self.assertEqual(cardanoaddress.encode_stake_addresses([STAKE_KEY_HASH], cardanoaddress.TESTNET),
+                         ["stake_test1uqehkck0lajq8gr28t9uxnuvgcqrc6070x3k9r8048z8y5gssrtvn"])
+
+    def test_byron_vectors(self):
+        for address, raw in BYRON_VECTORS:
+            with self.subTest(address):
+                raw = bytes.fromhex(raw)
+                # [tag 24 (address bytes), crc32 of them]: the vectors are well formed
+                self.assertEqual(zlib.crc32(raw[5:-5]), int.from_bytes(raw[-4:], "big"))
+                self.assertEqual(cardanoaddress.encode_address(raw), address)
+
+    def test_bad_bech32(self):
+        address = SHELLEY_VECTORS[0][0]
+        for bad in (address[:-1] + ("q" if address[-1] != "q" else "p"), address.replace("1", "b", 1), "addr1"):
+            with self.assertRaises(ValueError):
+                cardanoaddress.bech32_decode(bad)
+
+    def test_group_by_stake(self):
+        base = "01" + PAYMENT_KEY_HASH + STAKE_KEY_HASH
+        script_payment = "11" + SCRIPT_HASH + STAKE_KEY_HASH
+        script_stake = "21" + PAYMENT_KEY_HASH + SCRIPT_HASH
+        enterprise = "61" + PAYMENT_KEY_HASH
+        self.assertEqual(cardanoaddress.group_by_stake({base: 1, script_payment: 2, script_stake: 4, enterprise: 8}),
+                         {"e1" + STAKE_KEY_HASH: 3, "f1" + SCRIPT_HASH: 4, enterprise: 8})
+
+
+if __name__ == "__main__":
+    unittest.main()
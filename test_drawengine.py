@@ -0,0 +1,105 @@
+#!/bin/env python3
+# The Fenwick tree draw has to pick exactly who a scan over the cumulative tickets would, at every
+# ticket number, and keep doing so as --unique winners leave the draw.
+# Run with: python3 -m unittest test_drawengine (or pytest)
+import bisect
+import itertools
+import math
+import random
+import unittest
+
+import drawengine
+import giveaway
+
+
+def scanned_holder(tickets, winning_num):
+    # the linear scan the tree replaces
+    return bisect.bisect_left(list(itertools.accumulate(tickets)), winning_num)
+
+
+class TicketDrawTest(unittest.TestCase):
+    def test_boundary_tickets(self):
+        draw = drawengine.TicketDraw("abcdef", [3, 0, 5, 1, 0, 2])
+        self.assertEqual(draw.total, 11)
+        holders = [draw.participants[draw.ticket_holder(n)] for n in range(1, 12)]
+        self.assertEqual("".join(holders), "aaacccccdff")
+        for outside in (0, 12, -1):
+            with self.assertRaises(ValueError):
+                draw.ticket_holder(outside)
+
+    def test_every_ticket_matches_a_scan(self):
+        rng = random.Random(1)
+        for size in list(range(1, 40)) + [64, 65, 127, 1000]:
+            tickets = [rng.choice((0, 1, rng.randint(1, 10 ** 12))) for _ in range(size)]
+            tickets[rng.randrange(size)] = 1
+            draw = drawengine.TicketDraw(range(size), tickets)
+            cumulative = list(itertools.accumulate(tickets))
+            edges = {1, draw.total} | {c for c in cumulative if c} | {c + 1 for c in cumulative if c < draw.total}
+            for winning_num in edges | {rng.randint(1, draw.total) for _ in range(50)}:
+                self.assertEqual(draw.ticket_holder(winning_num), scanned_holder(tickets, winning_num),
+                                 (size, winning_num))
+
+    def test_distribution(self):
+        tickets = [1, 2, 3, 4, 0, 10]
+        draw = drawengine.TicketDraw(range(len(tickets)), tickets, random.Random(7))
+        draws = 200000
+        counts = [0] * len(tickets)
+        for _ in range(draws):
+            counts[draw.draw()[1]] += 1
+        self.assertEqual(counts[4], 0)
+        for count, participant_tickets in zip(counts, tickets):
+            expected = draws * participant_tickets / draw.total
+            # five standard deviations of a binomial count
+            self.assertLessEqual(abs(count - expected), 5 * math.sqrt(expected) + 1, (counts, tickets))
+
+    def test_unique_removal(self):
+        tickets = [5, 1, 7, 3]
+        draw = drawengine.TicketDraw("wxyz", tickets)
+        draw.remove(2)
+        draw.remove(2)
+        self.assertEqual(draw.total, 9)
+        self.assertEqual([draw.ticket_holder(n) for n in range(1, 10)], [0] * 5 + [1] + [3] * 3)
+        with self.assertRaises(ValueError):
+            draw.restore(0, 5)
+        draw.restore(2, 7)
+        self.assertEqual([draw.ticket_holder(n) for n in range(1, 17)], [0] * 5 + [1] + [2] * 7 + [3] * 3)
+
+    def test_unique_winners_leave_the_draw(self):
+        raffle = giveaway.Raffle("unique", pool_id="00" * 28, number_winners=20, unique=True)
+        raffle.eligible_participants = {"%056x" % i: i * 1000 + 1 for i in range(20)}
+        draw = drawengine.from_dict(raffle.eligible_participants, random.Random(3))
+        winners = [giveaway.draw_prize(raffle, draw)[1] for _ in range(20)]
+        self.assertEqual(sorted(winners), sorted(raffle.eligible_participants))
+        self.assertEqual(draw.total, 0)
+        with self.assertRaises(ValueError):
+            draw.draw()
+
+    def test_invalid_tickets(self):
+        with self.assertRaises(ValueError):
+            drawengine.TicketDraw("ab", [1, -1])
+        with self.assertRaises(ValueError):
+            drawengine.TicketDraw("ab", [1])
+
+
+class WeightingTest(unittest.TestCase):
+    def test_isqrt_is_exact(self):
+        weighting = giveaway.Weighting(use_sqrt=True)
+        root = 10 ** 15 + 1
+        # a float square root rounds these up to root
+        self.assertEqual(weighting.tickets(root * root - 1), root - 1)
+        self.assertEqual(weighting.tickets(root * root), root)
+        self.assertEqual(giveaway.Weighting().tickets(root * root - 1), root * root - 1)
+
+    def test_raffle_weighting(self):
+        pool_raffle = giveaway.Raffle("pool", pool_id="00" * 28, use_sqrt=True)
+        self.assertEqual(pool_raffle.maybe_apply_sqrt(4 * 10 ** 12), 2 * 10 ** 6)
+        # token amounts are scaled up first, so that small balances keep their precision
+        token_raffle = giveaway.Raffle("policy", policy_id="ff" * 28, use_sqrt=True)
+        self.assertEqual(token_raffle.maybe_apply_sqrt(2), math.isqrt(2 * 10 ** 6))
+        self.assertEqual(token_raffle.maybe_apply_sqrt(2) // token_raffle.ticket_unit, 1)
+        linear = giveaway.Raffle("linear", policy_id="ff" * 28)
+        self.assertEqual(linear.maybe_apply_sqrt(12345), 12345)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+#!/bin/env python3
+# Exclusion entries: bech32 in any case, hex credentials and addresses, and what gets rejected.
+# Run with: python3 -m unittest test_exclusions (or pytest)
+import unittest
+
+import exclusions
+
+# CIP-19 test vectors
+STAKE_ADDRESS = "stake1uyehkck0lajq8gr28t9uxnuvgcqrc6070x3k9r8048z8y5gh6ffgw"
+STAKE_CREDENTIAL = "337b62cfff6403a06a3acbc34f8c46003c69fe79a3628cefa9c47251"
+BASE_ADDRESS = "addr1qx2fxv2umyhttkxyxp8x0dlpdt3k6cwng5pxj3jhsydzer3n0d3vllmyqwsx5wktcd8cc3sq835lu7drv2xwl2wywfgse35a3x"
+PAYMENT_CREDENTIAL = "9493315cd92eb5d8c4304e67b7e16ae36d61d34502694657811a2c8e"
+
+
+class ExclusionSetTest(unittest.TestCase):
+    def test_bech32_any_case(self):
+        excluded = exclusions.ExclusionSet([STAKE_ADDRESS.upper(), " " + BASE_ADDRESS.capitalize()])
+        self.assertEqual(excluded.credentials, {STAKE_CREDENTIAL, PAYMENT_CREDENTIAL})
+        self.assertTrue(excluded.excludes_stake_address(STAKE_ADDRESS))
+
+    def test_length_counts_entries(self):
+        # a base address brings its two credentials along, it is still one entry
+        excluded = exclusions.ExclusionSet([BASE_ADDRESS, STAKE_CREDENTIAL.upper(), STAKE_CREDENTIAL])
+        self.assertEqual(len(excluded), 2)
+        self.assertEqual(len(excluded.credentials), 2)
+        self.assertEqual(len(excluded.addresses), 1)
+        self.assertEqual(len(exclusions.ExclusionSet()), 0)
+
+    def test_hex_addresses(self):
+        excluded = exclusions.ExclusionSet(["61" + PAYMENT_CREDENTIAL, "e1" + STAKE_CREDENTIAL])
+        self.assertEqual(excluded.credentials, {STAKE_CREDENTIAL, PAYMENT_CREDENTIAL})
+        self.assertTrue(excluded.excludes_address("01" + PAYMENT_CREDENTIAL + "00" * 28))
+
+    def test_invalid_entries_name_their_line(self):
+        for entry in ("abcd", "not hex", "01" + PAYMENT_CREDENTIAL, "91" + PAYMENT_CREDENTIAL, "stake1xyz"):
+            with self.assertRaises(ValueError) as raised:
+                exclusions.ExclusionSet().add_list("# owners\n" + STAKE_CREDENTIAL + ", " + entry, "exclude.txt")
+            self.assertTrue(str(raised.exception).startswith("exclude.txt, line 2: "), str(raised.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/bin/env python3
+# The CBOR reader has to give the same extract as the JSON one. fixtures/ledger-small.json and
+# fixtures/ledger-small.cbor are the same ledger written both ways by:
+#   python3 ledgergen.py --scale 60 --format json -o fixtures/ledger-small.json
+#   python3 ledgergen.py --scale 60 --format cbor -o fixtures/ledger-small.cbor
+# Run with: python3 -m unittest test_ledgercbor (or pytest)
+import os
+import unittest
+
+import ledgercbor
+import ledgerreader
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+JSON_LEDGER = os.path.join(FIXTURES, "ledger-small.json")
+CBOR_LEDGER = os.path.join(FIXTURES, "ledger-small.cbor")
+
+
+def pool_fields(pool):
+    return pool.delegators, pool.stake, pool.owners, pool.reward_account, pool.recorded_stake
+
+
+class CborMatchesJsonTest(unittest.TestCase):
+    def assertSameExtract(self, json_extract, cbor_extract):
+        self.assertEqual(json_extract.epoch, cbor_extract.epoch)
+        self.assertEqual(sorted(json_extract.pools), sorted(cbor_extract.pools))
+        for pool_id, pool in json_extract.pools.items():
+            self.assertEqual(pool_fields(pool), pool_fields(cbor_extract.pools[pool_id]), pool_id)
+        self.assertEqual(json_extract.policies, cbor_extract.policies)
+
+    def test_formats_detected(self):
+        self.assertEqual(ledgercbor.detect_format(JSON_LEDGER), "json")
+        self.assertEqual(ledgercbor.detect_format(CBOR_LEDGER), "cbor")
+
+    def test_whole_ledger(self):
+        json_extract = ledgerreader.read_ledger(JSON_LEDGER, ledgerreader.ALL, ledgerreader.ALL,
+                                                json_backend="stdlib")
+        cbor_extract = ledgercbor.read_ledger(CBOR_LEDGER, ledgerreader.ALL, ledgerreader.ALL)
+        self.assertTrue(json_extract.pools)
+        self.assertTrue(json_extract.policies)
+        self.assertSameExtract(json_extract, cbor_extract)
+
+    def test_requested_pools_and_policies(self):
+        everything = ledgerreader.read_ledger(JSON_LEDGER, ledgerreader.ALL, ledgerreader.ALL, json_backend="stdlib")
+        pool_ids = sorted(everything.pools)[:2] + ["00" * 28]
+        policy_ids = sorted(everything.policies)[:2] + ["ff" * 28]
+        json_extract = ledgerreader.read_ledger(JSON_LEDGER, pool_ids, policy_ids, json_backend="stdlib")
+        cbor_extract = ledgercbor.read_ledger(CBOR_LEDGER, pool_ids, policy_ids)
+        self.assertIsNone(cbor_extract.pools["00" * 28].recorded_stake)
+        self.assertEqual(cbor_extract.policies["ff" * 28], {})
+        self.assertSameExtract(json_extract, cbor_extract)
+
+
+class CborReaderTest(unittest.TestCase):
+    def test_skip_rejects_reserved_integer_lengths(self):
+        for initial in (0x1c, 0x1d, 0x1e, 0x1f, 0x3c, 0x3f):
+            with self.assertRaises(ValueError):
+                ledgercbor.CborReader(bytes([initial]) + bytes(200)).skip()
+
+    def test_skip_integers(self):
+        reader = ledgercbor.CborReader(b"\x1b" + bytes(8) + b"\x38\x05\x01")
+        reader.skip(2)
+        self.assertEqual(reader.pos, 11)
+
+
+if __name__ == "__main__":
+    unittest.main()
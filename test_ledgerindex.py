@@ -0,0 +1,121 @@
+#!/bin/env python3
+# The ledger index has to answer like the ledger it was built from, and only for as long as that
+# ledger doesn't change. Works on a copy of the fixture ledger (see test_ledgercbor.py), the index
+# is written next to it.
+# Run with: python3 -m unittest test_ledgerindex (or pytest)
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import ledgerindex
+import ledgerreader
+import phasemetrics
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def extract_fields(extract):
+    pools = {pool_id: (pool.delegators, pool.stake, pool.owners, pool.reward_account, pool.recorded_stake)
+             for pool_id, pool in extract.pools.items()}
+    return extract.epoch, pools, extract.policies
+
+
+class LedgerIndexTest(unittest.TestCase):
+    def setUp(self):
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        self.ledger = os.path.join(work_dir.name, "ledger.json")
+        shutil.copy(os.path.join(FIXTURES, "ledger-small.json"), self.ledger)
+        self.everything = ledgerreader.read_ledger(self.ledger, ledgerreader.ALL, ledgerreader.ALL,
+                                                   json_backend="stdlib")
+
+    def build(self):
+        return ledgerindex.build_index(self.ledger, json_backend="stdlib")
+
+    def source(self):
+        metrics = phasemetrics.Metrics()
+        ledgerindex.read_ledger(self.ledger, ["00" * 28], metrics=metrics, json_backend="stdlib")
+        return metrics.counters["ledger_source"]
+
+    def test_round_trip(self):
+        self.assertEqual(self.build(), self.ledger + ".idx")
+        pool_ids = sorted(self.everything.pools) + ["00" * 28]
+        policy_ids = sorted(self.everything.policies) + ["ff" * 28]
+        expected = ledgerreader.read_ledger(self.ledger, pool_ids, policy_ids, json_backend="stdlib")
+        index = ledgerindex.open_index(self.ledger)
+        try:
+            self.assertEqual(extract_fields(index.extract(pool_ids, policy_ids)), extract_fields(expected))
+            self.assertEqual(index.pool("not hex").delegators, [])
+        finally:
+            index.close()
+        self.assertEqual(self.source(), "index")
+
+    def test_unchanged_stat_skips_the_hash(self):
+        self.build()
+        with mock.patch("ledgerindex.ledger_hash", side_effect=AssertionError("hashed")):
+            self.assertEqual(self.source(), "index")
+
+    def test_touched_ledger_is_rehashed(self):
+        self.build()
+        stat = os.stat(self.ledger)
+        os.utime(self.ledger, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        with mock.patch("ledgerindex.ledger_hash", wraps=ledgerindex.ledger_hash) as hashed:
+            self.assertEqual(self.source(), "index")
+        hashed.assert_called_once_with(self.ledger)
+
+    def test_changed_ledger_is_stale(self):
+        self.build()
+        stat = os.stat(self.ledger)
+        with open(self.ledger, "r+b") as ledger_file:
+            content = ledger_file.read()
+            ledger_file.seek(0)
+            ledger_file.write(content.replace(b'"lastEpoch": 400', b'"lastEpoch": 401', 1))
+        self.assertEqual(os.path.getsize(self.ledger), stat.st_size)
+        os.utime(self.ledger, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(ledgerindex.open_index(self.ledger))
+        self.assertEqual(self.source(), "json")
+
+    def test_other_version_is_ignored(self):
+        with mock.patch("ledgerindex.VERSION", ledgerindex.VERSION - 1):
+            self.build()
+        with self.assertRaises(ValueError):
+            ledgerindex.LedgerIndex(self.ledger + ".idx")
+        self.assertIsNone(ledgerindex.open_index(self.ledger))
+        self.assertEqual(self.source(), "json")
+
+    def test_ledger_changed_while_indexed(self):
+        read_ledger_file = ledgerindex.read_ledger_file
+
+        def read_and_touch(*args, **kwargs):
+            extract = read_ledger_file(*args, **kwargs)
+            with open(self.ledger, "ab") as ledger_file:
+                ledger_file.write(b"\n")
+            return extract
+        with mock.patch("ledgerindex.read_ledger_file", read_and_touch):
+            with self.assertRaises(ValueError):
+                self.build()
+        self.assertFalse(os.path.exists(self.ledger + ".idx"))
+
+    def test_quantities_past_64_bits(self):
+        policy_id = "ab" * 28
+        extract = ledgerreader.LedgerExtract(policy_ids=[policy_id, "cd" * 28])
+        extract.policies[policy_id] = {"61" + "01" * 28: 7, "61" + "02" * 28: (1 << 64) - 1,
+                                       "61" + "03" * 28: (1 << 64) + 5, "61" + "04" * 28: 1 << 100}
+        extract.policies["cd" * 28] = {"61" + "05" * 28: (1 << 64) - 2}
+        out_path = self.ledger + ".idx"
+        ledgerindex.write_index(extract, bytes(32), (0, 0), out_path)
+        index = ledgerindex.LedgerIndex(out_path)
+        try:
+            self.assertEqual(index.extract(policy_ids=list(extract.policies)).policies, extract.policies)
+        finally:
+            index.close()
+        extract.policies[policy_id]["61" + "06" * 28] = 1 << 128
+        with self.assertRaises(ValueError) as raised:
+            ledgerindex.write_index(extract, bytes(32), (0, 0), out_path)
+        self.assertIn(policy_id, str(raised.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
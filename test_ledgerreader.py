@@ -0,0 +1,107 @@
+#!/bin/env python3
+# The streaming readers have to give what a plain json.load() of the whole ledger gives. Tiny chunk
+# sizes put chunk boundaries inside every key, string and number of the fixture ledger (see
+# test_ledgercbor.py), and several workers split its utxo map at arbitrary offsets.
+# Run with: python3 -m unittest test_ledgerreader (or pytest)
+import io
+import json
+import os
+import unittest
+
+import ledgercbor
+import ledgerreader
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+JSON_LEDGER = os.path.join(FIXTURES, "ledger-small.json")
+CBOR_LEDGER = os.path.join(FIXTURES, "ledger-small.cbor")
+CHUNK_SIZES = (7, 257)
+WORKERS = (1, 3)
+UNKNOWN_POOL = "00" * 28
+UNKNOWN_POLICY = "ff" * 28
+
+
+def loaded_extract(ledger, pool_ids, policy_ids):
+    # what the readers should find, straight from the json.load()ed ledger
+    state = ledger["stateBefore"]
+    delegations = state["esSnapshots"]["pstakeSet"]["delegations"]
+    pool_params = state["esLState"]["delegationState"]["pstate"]["pParams pState"]
+    if pool_ids is ledgerreader.ALL:
+        pool_ids = set(ledger["stakeDistrib"]) | set(pool_params) | {pool_id for _, pool_id in delegations}
+    pools = {}
+    for pool_id in pool_ids:
+        delegators = [credential["key hash"] for credential, delegated_to in delegations if delegated_to == pool_id]
+        stake = {}
+        for credential, amount in state["esSnapshots"]["pstakeSet"]["stake"]:
+            if credential["key hash"] in delegators:
+                stake[credential["key hash"]] = stake.get(credential["key hash"], 0) + amount
+        params = pool_params.get(pool_id)
+        distrib = ledger["stakeDistrib"].get(pool_id)
+        pools[pool_id] = (delegators, stake, params["owners"] if params else [],
+                          params["rewardAccount"]["credential"]["key hash"] if params else None,
+                          distrib["individualPoolStake"]["numerator"] if distrib else None)
+    policies = {} if policy_ids is ledgerreader.ALL else {policy_id: {} for policy_id in policy_ids}
+    for entry in state["esLState"]["utxoState"]["utxo"].values():
+        for policy_id, assets in entry["amount"]["policies"].items():
+            if policy_ids is ledgerreader.ALL or policy_id in policies:
+                holders = policies.setdefault(policy_id, {})
+                holders[entry["address"]] = holders.get(entry["address"], 0) + sum(assets.values())
+    return ledger["lastEpoch"], pools, policies
+
+
+def read_extract(extract):
+    pools = {pool_id: (pool.delegators, pool.stake, pool.owners, pool.reward_account, pool.recorded_stake)
+             for pool_id, pool in extract.pools.items()}
+    return extract.epoch, pools, extract.policies
+
+
+class ReadersMatchJsonLoadTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(JSON_LEDGER) as ledger_file:
+            cls.ledger = json.load(ledger_file)
+        policies = sorted({policy_id for entry in cls.ledger["stateBefore"]["esLState"]["utxoState"]["utxo"].values()
+                           for policy_id in entry["amount"]["policies"]})
+        cls.selections = {
+            "everything": (ledgerreader.ALL, ledgerreader.ALL),
+            "some": (sorted(cls.ledger["stakeDistrib"])[:2] + [UNKNOWN_POOL], policies[:2] + [UNKNOWN_POLICY]),
+        }
+        assert policies and cls.ledger["stakeDistrib"]
+
+    def test_json_reader(self):
+        for name, (pool_ids, policy_ids) in self.selections.items():
+            expected = loaded_extract(self.ledger, pool_ids, policy_ids)
+            for chunk_size in CHUNK_SIZES:
+                for workers in WORKERS:
+                    with self.subTest(name, chunk_size=chunk_size, workers=workers):
+                        extract = ledgerreader.read_ledger(JSON_LEDGER, pool_ids, policy_ids, workers,
+                                                           json_backend="stdlib", chunk_size=chunk_size)
+                        self.assertEqual(read_extract(extract), expected)
+
+    def test_cbor_reader(self):
+        for name, (pool_ids, policy_ids) in self.selections.items():
+            with self.subTest(name):
+                extract = ledgercbor.read_ledger(CBOR_LEDGER, pool_ids, policy_ids)
+                self.assertEqual(read_extract(extract), loaded_extract(self.ledger, pool_ids, policy_ids))
+
+
+class JsonStreamTest(unittest.TestCase):
+    def stream(self, text, chunk_size):
+        return ledgerreader.JsonStream(io.BytesIO(text.encode("latin-1")), chunk_size=chunk_size)
+
+    def test_values_across_chunks(self):
+        text = '{"a": 12345678901234567890, "b\\"c": [1, {"d": "e\\\\"}, []], "f": -0.5e3, "g": "x"}'
+        for chunk_size in (1, 2, 3, 7, 257):
+            with self.subTest(chunk_size=chunk_size):
+                stream = self.stream(text, chunk_size)
+                values = {}
+                for key in stream.iter_object():
+                    values[key] = stream.read_raw() if key == "g" else stream.read_value()
+                self.assertEqual(values, {"a": 12345678901234567890, 'b"c': [1, {"d": "e\\"}, []], "f": -500.0,
+                                          "g": '"x"'})
+                skipping = self.stream(text, chunk_size)
+                self.assertEqual([key for key in skipping.iter_object() if skipping.skip_value() is None],
+                                 ["a", 'b"c', "f", "g"])
+
+
+if __name__ == "__main__":
+    unittest.main()
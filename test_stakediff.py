@@ -0,0 +1,77 @@
+#!/bin/env python3
+# --new-since/--stayed-since are applied to the delegators of the ledger being drawn, compared with
+# the snapshots stored before its epoch. The fixture ledger (see test_ledgercbor.py) is at epoch 400,
+# the stores here are made up around its biggest pool.
+# Run with: python3 -m unittest test_stakediff (or pytest)
+import os
+import tempfile
+import unittest
+
+import giveaway
+import ledgerreader
+import loyaltystore
+import stakediff
+
+LEDGER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "ledger-small.json")
+LEDGER_EPOCH = 400
+
+
+class HistoryFilterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pools = ledgerreader.read_ledger(LEDGER, ledgerreader.ALL, json_backend="stdlib").pools
+        cls.pool_id = max(pools, key=lambda pool_id: len(pools[pool_id].delegators))
+        cls.source = giveaway.LedgerSource(LEDGER, use_index=False)
+        unfiltered = giveaway.Raffle("all", pool_id=cls.pool_id)
+        cls.source.collect(unfiltered)
+        cls.eligible = sorted(unfiltered.eligible_participants)
+        assert len(cls.eligible) >= 9
+
+    def setUp(self):
+        self.store = tempfile.TemporaryDirectory()
+        self.addCleanup(self.store.cleanup)
+        # 398: everyone but the last six, 399 (the last stored epoch): everyone but the last three,
+        # who only joined in the ledger's epoch
+        self.stored = {398: self.eligible[:-6], 399: self.eligible[:-3]}
+        # a stored delegator who already left by the ledger's epoch
+        self.gone = "ee" * 28
+        for epoch, delegators in self.stored.items():
+            stakes = {delegator: 1000000 for delegator in delegators}
+            stakes[self.gone] = 1000000
+            loyaltystore.write_snapshot(self.store.name, self.pool_id, epoch, stakes)
+
+    def draw_set(self, joined_since=None, kept_since=None):
+        raffle = giveaway.Raffle("filtered", pool_id=self.pool_id,
+                                 history_filter=stakediff.history_filter(self.store.name, joined_since, kept_since))
+        self.source.collect(raffle)
+        return set(raffle.eligible_participants)
+
+    def test_joined_after_last_ingest(self):
+        # the ledger is newer than the last stored epoch, its newest delegators can still win
+        self.assertEqual(self.draw_set(joined_since=399), set(self.eligible[-3:]))
+        self.assertEqual(self.draw_set(joined_since=398), set(self.eligible[-6:]))
+
+    def test_stayed_since(self):
+        self.assertEqual(self.draw_set(kept_since=398), set(self.eligible[:-6]))
+        self.assertEqual(self.draw_set(kept_since=399), set(self.eligible[:-3]))
+        self.assertNotIn(self.gone, self.draw_set(kept_since=398))
+
+    def test_both_filters(self):
+        self.assertEqual(self.draw_set(joined_since=398, kept_since=399), set(self.eligible[-6:-3]))
+
+    def test_newer_stored_epochs_ignored(self):
+        # a store that is ahead of the ledger being drawn: epochs after the ledger's don't count
+        loyaltystore.write_snapshot(self.store.name, self.pool_id, LEDGER_EPOCH + 1, {self.gone: 1})
+        self.assertEqual(self.draw_set(kept_since=399), set(self.eligible[:-3]))
+
+    def test_epochs_checked(self):
+        with self.assertRaises(ValueError):
+            stakediff.HistoryFilter(self.store.name, joined_since=397).check(self.pool_id)
+        loyaltystore.write_snapshot(self.store.name, self.pool_id, LEDGER_EPOCH, {self.gone: 1})
+        with self.assertRaises(ValueError):
+            self.draw_set(joined_since=LEDGER_EPOCH)
+        self.assertIsNone(stakediff.history_filter(self.store.name))
+
+
+if __name__ == "__main__":
+    unittest.main()